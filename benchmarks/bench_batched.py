@@ -0,0 +1,76 @@
+""" Send many small report messages with and without batching
+
+Pushes ``key-in-memory`` messages through a local socket pair, once with a
+``write`` per message and once through a ``BatchedStream``::
+
+    $ python benchmarks/bench_batched.py [n]
+"""
+from __future__ import print_function, division, absolute_import
+
+import socket
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from distributed.batched import BatchedStream
+from distributed.core import read, write
+
+
+def messages(n):
+    return [{'op': 'key-in-memory', 'key': ('x', i), 'workers': [('a', 1)]}
+            for i in range(n)]
+
+
+@gen.coroutine
+def unbatched(a, b, msgs):
+    @gen.coroutine
+    def receive():
+        for i in range(len(msgs)):
+            yield read(b)
+
+    done = receive()
+    for msg in msgs:
+        write(a, msg)
+    yield done
+    raise gen.Return(len(msgs))
+
+
+@gen.coroutine
+def batched(a, b, msgs):
+    sender, receiver = BatchedStream(a), BatchedStream(b)
+
+    @gen.coroutine
+    def receive():
+        for i in range(len(msgs)):
+            yield receiver.recv()
+
+    done = receive()
+    for i, msg in enumerate(msgs):
+        sender.send(msg)
+        if i % 1000 == 0:
+            yield gen.moment  # let the event loop run as it would in practice
+    yield done
+    raise gen.Return(sender.batch_count)
+
+
+def run(n):
+    loop = IOLoop.current()
+    msgs = messages(n)
+    for name, f in [('unbatched', unbatched), ('batched', batched)]:
+        x, y = socket.socketpair()
+        a, b = IOStream(x), IOStream(y)
+        start = time()
+        writes = loop.run_sync(lambda: f(a, b, msgs))
+        duration = time() - start
+        print('%-10s %8d messages  %8d writes  %8.0f msgs/s' % (
+              name, n, writes, n / duration))
+        a.close()
+        b.close()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    run(n)
@@ -0,0 +1,60 @@
+""" Throughput of ``distributed.core.read/write`` over a local TCP connection
+
+Sends messages of 1 kB, 1 MB and 1 GB through an ``rpc`` echo server and
+reports messages per second and MB/s for each size.  Pass sizes in bytes on
+the command line to override the defaults::
+
+    $ python benchmarks/bench_core.py
+    $ python benchmarks/bench_core.py 1000 1000000
+"""
+from __future__ import print_function, division, absolute_import
+
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed.core import Server, rpc
+
+
+def echo(stream, x=None):
+    return x
+
+
+@gen.coroutine
+def bench(remote, nbytes, duration=1.0):
+    data = b'0' * nbytes
+    yield remote.echo(x=data)  # warm up connection
+    count = 0
+    start = time()
+    while True:
+        result = yield remote.echo(x=data)
+        assert len(result) == nbytes
+        count += 1
+        if time() - start > duration:
+            break
+    end = time()
+    raise gen.Return((count, end - start))
+
+
+@gen.coroutine
+def main(sizes):
+    server = Server({'echo': echo})
+    server.listen(0)
+    remote = rpc(ip='127.0.0.1', port=server.port)
+
+    print('%12s %12s %12s' % ('bytes', 'msgs/s', 'MB/s'))
+    for nbytes in sizes:
+        count, duration = yield bench(remote, nbytes)
+        # each round trip moves the payload twice
+        print('%12d %12.1f %12.1f' % (nbytes, count / duration,
+                                      2 * count * nbytes / duration / 1e6))
+
+    remote.close_streams()
+    server.stop()
+
+
+if __name__ == '__main__':
+    sizes = [int(s) for s in sys.argv[1:]] or [int(1e3), int(1e6), int(1e9)]
+    IOLoop.current().run_sync(lambda: main(sizes))
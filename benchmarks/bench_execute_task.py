@@ -0,0 +1,55 @@
+""" Overhead of filling and evaluating nested tasks on a worker
+
+Builds tasks shaped like those from dask.array, with keys, slices and nested
+calls to cheap functions, and times filling in their data and evaluating
+them, first walking each task with ``pack_data`` and ``execute_task`` and then
+with ``flatten_task`` and ``execute_plan``::
+
+    $ python benchmarks/bench_execute_task.py [ntasks]
+"""
+from __future__ import print_function, division, absolute_import
+
+from operator import add, getitem
+import sys
+from time import time
+
+from distributed.client import pack_data
+from distributed.worker import (execute_task, flatten_task, execute_plan,
+        _plans)
+
+
+def make_tasks(n):
+    data = {('x', i): [i] * 10 for i in range(n)}
+    tasks = []
+    for i in range(n):
+        x = ('x', i)
+        tasks.append((getitem, (add, x, (list, (reversed, x))),
+                      slice(i % 5, None)))
+        tasks.append((sum, [(len, x), (len, (getitem, x, slice(0, 5))),
+                            (max, x), 1]))
+    return data, tasks
+
+
+def interpret(data, tasks):
+    return [execute_task(pack_data(task, data)) for task in tasks]
+
+
+def compiled(data, tasks):
+    return [execute_plan(*flatten_task(task, data)) for task in tasks]
+
+
+def run(n):
+    data, tasks = make_tasks(n)
+    assert interpret(data, tasks) == compiled(data, tasks)
+    _plans.clear()
+    for name, func in [('interpret', interpret), ('compiled', compiled)]:
+        start = time()
+        func(data, tasks)
+        duration = time() - start
+        print('%-10s %8d tasks  %6.2f us per task' % (
+              name, len(tasks), duration / len(tasks) * 1e6))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    run(n)
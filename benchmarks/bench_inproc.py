@@ -0,0 +1,65 @@
+""" Latency and throughput of rpc calls over each transport
+
+Compares TCP, Unix domain sockets and the in-process transport::
+
+    $ python benchmarks/bench_inproc.py
+"""
+from __future__ import print_function, division, absolute_import
+
+import os
+import tempfile
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed.core import Server, rpc, pingpong
+from distributed import unix
+
+
+def echo(stream, x=None):
+    return x
+
+
+@gen.coroutine
+def latency(remote, n=5000):
+    yield remote.ping()  # warm up connection
+    start = time()
+    for i in range(n):
+        yield remote.ping()
+    raise gen.Return((time() - start) / n)
+
+
+@gen.coroutine
+def throughput(remote, nbytes=int(1e6), n=200):
+    data = b'0' * nbytes
+    yield remote.echo(x=data)
+    start = time()
+    for i in range(n):
+        yield remote.echo(x=data)
+    raise gen.Return(2 * n * nbytes / (time() - start))
+
+
+@gen.coroutine
+def main():
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+    transports = [('tcp', 0, '127.0.0.1'), ('inproc', 'inproc://', None)]
+    if unix.available:
+        transports.insert(1, ('unix', 'unix://' + path, 'unix://' + path))
+
+    print('%10s %14s %12s' % ('transport', 'latency (us)', 'MB/s (1MB)'))
+    for name, port, ip in transports:
+        server = Server({'ping': pingpong, 'echo': echo})
+        server.listen(0)
+        if name != 'tcp':
+            server.listen(port)
+        remote = rpc(ip=ip or server.ip, port=server.port)
+        lat = yield latency(remote)
+        bw = yield throughput(remote)
+        print('%10s %14.1f %12.1f' % (name, lat * 1e6, bw / 1e6))
+        remote.close_streams()
+        server.stop()
+
+
+if __name__ == '__main__':
+    IOLoop.current().run_sync(main)
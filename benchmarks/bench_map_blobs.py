@@ -0,0 +1,44 @@
+""" Size of the update-graph message from Executor.map
+
+Builds the tasks that ``Executor.map`` sends for a function with a large
+keyword argument and reports the size of the serialized message and the time
+taken to build and serialize it, first with every task carrying its own
+function and arguments and then with these sent once by content hash::
+
+    $ python benchmarks/bench_map_blobs.py [ntasks] [kwarg-bytes]
+"""
+from __future__ import print_function, division, absolute_import
+
+import sys
+from time import time
+
+from dask.compatibility import apply
+from toolz import valmap
+
+from distributed.protocol import dumps
+from distributed.scheduler import dumps_task, hash_blobs
+
+
+def f(x, y=None):
+    return x
+
+
+def run(n, nbytes):
+    y = b'0' * nbytes
+    dsk = {'f-%d' % i: (apply, f, (tuple, [i]), {'y': y}) for i in range(n)}
+    for name, hashed in [('inline', False), ('hashed', True)]:
+        start = time()
+        msg = {'op': 'update-graph', 'tasks': valmap(dumps_task, dsk)}
+        if hashed:
+            msg['blobs'] = hash_blobs(msg['tasks'])
+        frames = dumps(msg)
+        duration = time() - start
+        size = sum(map(len, frames))
+        print('%-7s %6d tasks  %10d bytes  %6.3f s' % (name, n, size,
+                                                       duration))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nbytes = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    run(n, nbytes)
@@ -0,0 +1,64 @@
+""" Event loop responsiveness while a large message is (de)serialized
+
+Echoes a message made of many small Python objects, which is slow to
+serialize, while pinging the same server every 10ms over another connection.
+Reports the slowest ping with (de)serialization on the event loop and with it
+offloaded to a thread::
+
+    $ python benchmarks/bench_offload.py [n]
+"""
+from __future__ import print_function, division, absolute_import
+
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed import core
+from distributed.core import Server, rpc, pingpong
+
+
+@gen.coroutine
+def echo_while_pinging(data):
+    server = Server({'ping': pingpong, 'echo': lambda stream, x: x})
+    server.listen(0)
+    big = rpc(ip='127.0.0.1', port=server.port)
+    small = rpc(ip='127.0.0.1', port=server.port)
+    yield small.ping()
+
+    start = time()
+    future = big.echo(x=data)
+    latencies = []
+    while not future.done():
+        t = time()
+        yield small.ping()
+        latencies.append(time() - t)
+        yield gen.sleep(0.01)  # like a heartbeat
+    yield future
+    duration = time() - start
+
+    big.close_streams()
+    small.close_streams()
+    server.stop()
+    raise gen.Return((duration, latencies))
+
+
+def run(n):
+    data = [('x-%d' % i, i, float(i)) for i in range(n)]
+    loop = IOLoop.current()
+    threshold = core.OFFLOAD_THRESHOLD
+    for name, t in [('on loop', None), ('offloaded', threshold)]:
+        core.OFFLOAD_THRESHOLD = t
+        before = core.offload_stats['offloaded-time']
+        duration, latencies = loop.run_sync(lambda: echo_while_pinging(data))
+        print('%-10s echo %6.2f s  %5d pings  slowest %7.1f ms  '
+              'offloaded %5.2f s' % (
+              name, duration, len(latencies), max(latencies) * 1000,
+              core.offload_stats['offloaded-time'] - before))
+    core.OFFLOAD_THRESHOLD = threshold
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    run(n)
@@ -0,0 +1,57 @@
+""" Pure Python tasks on one worker, in threads and in a process pool
+
+Runs tasks that decode a JSON document, which holds the GIL throughout, on one
+Worker with several cores.  They run first in the worker's threads and then in
+its process pool.  Reports the time taken for each::
+
+    $ python benchmarks/bench_processes.py [ntasks] [ncores] 2> /dev/null
+"""
+from __future__ import print_function, division, absolute_import
+
+import json
+import shutil
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed.scheduler import dumps_task
+from distributed.worker import Worker
+
+
+text = json.dumps([{'name': 'Alice', 'amount': i, 'tags': ['a', 'b', 'c']}
+                   for i in range(50000)])
+
+
+@gen.coroutine
+def run_tasks(worker, ntasks, processes):
+    task = dumps_task((len, (json.loads, text)))
+    responses = yield [worker.compute(None, key=i, report=False,
+                                      serialized=True, processes=processes,
+                                      **task)
+                       for i in range(ntasks)]
+    assert all(response == b'OK' for response, _ in responses)
+
+
+def run(ntasks, ncores):
+    loop = IOLoop.current()
+    worker = Worker('127.0.0.1', 8787, ip='127.0.0.1', ncores=ncores)
+    try:
+        loop.run_sync(lambda: run_tasks(worker, ncores, True))  # warm up
+        for name, processes in [('threads', False), ('processes', True)]:
+            start = time()
+            loop.run_sync(lambda: run_tasks(worker, ntasks, processes))
+            duration = time() - start
+            print('%-10s %4d tasks on %d cores  %6.2f s' % (
+                  name, ntasks, ncores, duration))
+    finally:
+        worker.process_pool.shutdown()
+        worker.executor.shutdown()
+        shutil.rmtree(worker.local_dir)
+
+
+if __name__ == '__main__':
+    ntasks = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    ncores = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    run(ntasks, ncores)
@@ -0,0 +1,46 @@
+""" Round trips per second of typical scheduler messages through the protocol
+
+Compares ``distributed.protocol.dumps/loads``, which uses msgpack for plain
+control messages when available, against pickling every message::
+
+    $ python benchmarks/bench_protocol.py
+"""
+from __future__ import print_function, division, absolute_import
+
+from time import time
+
+from distributed import protocol
+from distributed.core import dumps, loads
+
+workers = [('192.168.0.%d' % i, 8000 + i) for i in range(10)]
+
+messages = {
+    'compute': {'op': 'compute', 'key': ('x', 1), 'report': False,
+                'who_has': {('y', i): {workers[i]} for i in range(3)},
+                'serialized': True, 'function': b'f' * 50, 'args': b'a' * 20},
+    'key-in-memory': {'op': 'key-in-memory', 'key': ('x', 1),
+                      'workers': [workers[0]], 'type': b't' * 40},
+    'add_keys': {'op': 'add_keys', 'address': workers[0],
+                 'keys': [('x', i) for i in range(5)], 'reply': True},
+    'delete_data': {'op': 'delete_data', 'report': False, 'reply': True,
+                    'keys': {'x-%d' % i for i in range(20)}},
+    'compute-response': (b'OK', {'nbytes': 1000}),
+}
+
+
+def bench(dumps, loads, msg, duration=0.5):
+    count = 0
+    start = time()
+    while time() - start < duration:
+        for i in range(100):
+            loads(dumps(msg))
+        count += 100
+    return count / (time() - start)
+
+
+if __name__ == '__main__':
+    print('%20s %12s %12s' % ('message', 'protocol/s', 'pickle/s'))
+    for name, msg in sorted(messages.items()):
+        print('%20s %12.0f %12.0f' % (name,
+                                      bench(protocol.dumps, protocol.loads, msg),
+                                      bench(dumps, loads, msg)))
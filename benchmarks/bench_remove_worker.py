@@ -0,0 +1,76 @@
+""" Losing a worker halfway through a large computation
+
+Builds a graph of ``n`` tasks, pairs of a leaf and a task that depends on
+it, on a Scheduler with fake workers, and finishes about half of them.  Then
+removes one worker and reports how long the scheduler takes to recover,
+first healing the whole graph with ``heal_state`` and then recovering only
+the affected keys with ``remove_worker``::
+
+    $ python benchmarks/bench_remove_worker.py [ntasks] [nworkers]
+"""
+from __future__ import print_function, division, absolute_import
+
+import sys
+from time import time
+
+from tornado.queues import Queue
+
+from distributed.scheduler import Scheduler
+from distributed.utils import clear_queue
+
+
+def make_scheduler(n, nworkers):
+    s = Scheduler(delete_interval=1e9)
+    s.worker_queues = {}
+    for i in range(nworkers):
+        w = ('10.0.%d.%d' % divmod(i, 256), 8000)
+        s.ncores[w] = 4
+        s.has_what[w] = set()
+        s.processing[w] = set()
+        s.stacks[w] = []
+        s.io_stacks[w] = []
+        s.occupancy[w] = 0
+        s.durations[w] = {}
+        s.hosts[w[0]].add(w)
+        s.worker_queues[w] = Queue()
+        s.worker_services[w] = {}
+
+    tasks = {}
+    dependencies = {}
+    for i in range(n // 2):
+        tasks['x-%d' % i] = (abs, i)
+        dependencies['x-%d' % i] = set()
+        tasks['y-%d' % i] = (abs, 'x-%d' % i)
+        dependencies['y-%d' % i] = {'x-%d' % i}
+    s.update_graph(tasks=tasks, keys=[k for k in tasks if k[0] == 'y'],
+                   dependencies=dependencies, client='client')
+
+    done = 0
+    while done < n // 2:
+        for w, keys in s.processing.items():
+            for key in list(keys):
+                s.mark_task_finished(key, w, 28)
+                done += 1
+            clear_queue(s.worker_queues[w])
+    return s
+
+
+def run(n, nworkers):
+    for name in ['heal', 'incremental']:
+        s = make_scheduler(n, nworkers)
+        worker = next(iter(s.ncores))
+        start = time()
+        if name == 'heal':
+            s.remove_worker(address=worker, heal=False)
+            s.heal_state()
+        else:
+            s.remove_worker(address=worker)
+        duration = time() - start
+        print('%-12s %8d tasks on %4d workers  %8.3f s' % (
+              name, n, nworkers, duration))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    run(n, nworkers)
@@ -0,0 +1,40 @@
+""" Placing tasks restricted to a few hosts among many workers
+
+Builds tasks like those from ``distributed.hdfs.read_bytes``, each restricted
+to the three hosts holding a replica of its block, and times choosing a
+worker for each with ``decide_worker``, first checking every worker against
+the restrictions and then looking workers up by hostname::
+
+    $ python benchmarks/bench_restrictions.py [ntasks] [nhosts]
+"""
+from __future__ import print_function, division, absolute_import
+
+import random
+import sys
+from time import time
+
+from distributed.scheduler import decide_worker
+
+
+def run(n, nhosts):
+    hostnames = ['192.168.0.%d' % i for i in range(nhosts)]
+    workers = [(host, 8000 + j) for host in hostnames for j in range(4)]
+    stacks = {w: [] for w in workers}
+    hosts = {host: {w for w in workers if w[0] == host} for host in hostnames}
+    dependencies = {i: set() for i in range(n)}
+    restrictions = {i: frozenset(random.sample(hostnames, 3))
+                    for i in range(n)}
+    for name, index in [('scan', None), ('index', hosts)]:
+        start = time()
+        for key in range(n):
+            decide_worker(dependencies, stacks, {}, restrictions, set(), {},
+                          key, hosts=index)
+        duration = time() - start
+        print('%-6s %6d tasks on %4d workers  %6.2f us per task' % (
+              name, n, len(workers), duration / n * 1e6))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nhosts = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    run(n, nhosts)
@@ -0,0 +1,77 @@
+""" Throughput of tiny tasks through a scheduler and local workers
+
+Starts a Scheduler and Executor in this process and a few Workers, each in
+its own process, connected over TCP.  Submits a graph of independent tasks
+that do almost nothing and reports tasks per second from submission until
+all results are in memory::
+
+    $ python benchmarks/bench_scheduler.py [ntasks] [nworkers] [ncores] 2> /dev/null
+"""
+from __future__ import print_function, division, absolute_import
+
+from multiprocessing import Process
+import shutil
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed import Executor, Scheduler, Worker
+
+
+def inc(x):
+    return x + 1
+
+
+def run_worker(port, ncores):
+    loop = IOLoop()
+    loop.make_current()
+    w = Worker('127.0.0.1', port, ncores=ncores, ip='127.0.0.1', loop=loop)
+    w.start(0)
+    try:
+        loop.start()
+    finally:
+        shutil.rmtree(w.local_dir, ignore_errors=True)
+
+
+@gen.coroutine
+def run_graph(n, nworkers, ncores):
+    s = Scheduler(ip='127.0.0.1')
+    s.start(0)
+    workers = [Process(target=run_worker, args=(s.port, ncores))
+               for i in range(nworkers)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    while len(s.ncores) < nworkers:
+        yield gen.sleep(0.01)
+
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    dsk = {('x', i): (inc, i) for i in range(n)}
+    start = time()
+    results = yield e._get(dsk, list(dsk))
+    duration = time() - start
+    assert sum(results) == n * (n + 1) // 2
+
+    yield e._shutdown()
+    for w in workers:
+        w.terminate()
+    s.stop()
+    raise gen.Return(duration)
+
+
+def run(n, nworkers, ncores):
+    duration = IOLoop.current().run_sync(
+            lambda: run_graph(n, nworkers, ncores))
+    print('%d workers x %d cores  %8d tasks  %8.0f tasks/s' % (
+          nworkers, ncores, n, n / duration))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    ncores = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    run(n, nworkers, ncores)
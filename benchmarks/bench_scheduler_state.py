@@ -0,0 +1,93 @@
+""" Scheduler memory and transition cost on large graphs
+
+Builds a graph of ``n`` tasks, leaves and tasks that each depend on two
+leaves, on a Scheduler with fake workers and runs it to completion.  Reports
+the memory held by the new graph and the time spent per task to submit it and
+to carry it through the scheduler, once with per-key state in plain dicts and
+sets, the default, and once in the compact ``TaskTable`` of
+``Scheduler(compact_state=True)``::
+
+    $ python benchmarks/bench_scheduler_state.py [ntasks] [nworkers]
+"""
+from __future__ import print_function, division, absolute_import
+
+import gc
+import sys
+from time import time
+import tracemalloc
+
+from tornado.queues import Queue
+
+from distributed.scheduler import Scheduler
+from distributed.utils import clear_queue
+
+
+def make_scheduler(layout, nworkers):
+    s = Scheduler(delete_interval=1e9, compact_state=layout == 'table')
+    s.worker_queues = {}
+    for i in range(nworkers):
+        w = ('10.0.%d.%d' % divmod(i, 256), 8000)
+        s.ncores[w] = 4
+        s.has_what[w] = set()
+        s.processing[w] = set()
+        s.stacks[w] = []
+        s.io_stacks[w] = []
+        s.occupancy[w] = 0
+        s.durations[w] = {}
+        s.hosts[w[0]].add(w)
+        s.worker_queues[w] = Queue()
+        s.worker_services[w] = {}
+    return s
+
+
+def make_graph(n):
+    tasks = {}
+    dependencies = {}
+    m = n // 2
+    for i in range(m):
+        tasks['x-%d' % i] = (abs, i)
+        dependencies['x-%d' % i] = set()
+    for i in range(m):
+        deps = {'x-%d' % i, 'x-%d' % ((i + 1) % m)}
+        tasks['y-%d' % i] = (max,) + tuple(deps)
+        dependencies['y-%d' % i] = deps
+    return tasks, dependencies
+
+
+def run(n, nworkers):
+    for layout in ['dicts', 'table']:
+        s = make_scheduler(layout, nworkers)
+        tasks, dependencies = make_graph(n)
+        keys = [k for k in tasks if k[0] == 'y']
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time()
+        s.update_graph(tasks=tasks, keys=keys, dependencies=dependencies,
+                       client='client')
+        submit = time() - start
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del tasks, dependencies
+
+        start = time()
+        done = 0
+        while done < n:
+            for w, processing in s.processing.items():
+                for key in list(processing):
+                    s.mark_task_finished(key, w, 28)
+                    done += 1
+                clear_queue(s.worker_queues[w])
+        finish = time() - start
+
+        print('%-6s %8d tasks  %7.0f bytes/task  submit %6.1f us/task  '
+              'run %6.1f us/task' % (layout, n, memory / n, submit / n * 1e6,
+                                     finish / n * 1e6))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    run(n, nworkers)
@@ -0,0 +1,74 @@
+""" Null-task throughput of a single worker
+
+Runs tasks that do nothing on one Worker, first by calling
+``Worker.compute`` directly on the worker's event loop and then through
+``rpc`` from several concurrent clients over TCP, as the scheduler does.
+Tasks are serialized once up front with ``dumps_task``.  Logging stays at
+its usual level, so send stderr elsewhere to keep the terminal quiet.
+Reports tasks per second for each::
+
+    $ python benchmarks/bench_worker.py [ntasks] [nclients] 2> /dev/null
+"""
+from __future__ import print_function, division, absolute_import
+
+import shutil
+import sys
+from time import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from distributed.core import rpc
+from distributed.scheduler import dumps_task
+from distributed.worker import Worker
+
+
+def noop():
+    pass
+
+
+@gen.coroutine
+def direct(worker, n):
+    task = dumps_task((noop,))
+    for i in range(n):
+        response, _ = yield worker.compute(None, key=i, report=False,
+                                           serialized=True, **task)
+        assert response == b'OK'
+
+
+@gen.coroutine
+def over_rpc(worker, n, nclients):
+    @gen.coroutine
+    def client(keys):
+        remote = rpc(ip=worker.ip, port=worker.port)
+        task = dumps_task((noop,))
+        for key in keys:
+            response, _ = yield remote.compute(key=key, report=False,
+                                               serialized=True, **task)
+            assert response == b'OK'
+        remote.close_streams()
+
+    yield [client(range(i, n, nclients)) for i in range(nclients)]
+
+
+def run(n, nclients):
+    loop = IOLoop.current()
+    worker = Worker('127.0.0.1', 8787, ip='127.0.0.1', ncores=4)
+    worker.listen(0)
+    try:
+        for name, f in [('direct', lambda: direct(worker, n)),
+                        ('rpc x %d' % nclients,
+                         lambda: over_rpc(worker, n, nclients))]:
+            start = time()
+            loop.run_sync(f)
+            duration = time() - start
+            print('%-10s %8d tasks  %8.0f tasks/s' % (name, n, n / duration))
+    finally:
+        worker.stop()
+        shutil.rmtree(worker.local_dir)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    nclients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    run(n, nclients)
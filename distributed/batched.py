@@ -0,0 +1,150 @@
+from __future__ import print_function, division, absolute_import
+
+from collections import deque
+import logging
+
+from tornado import gen
+from tornado.gen import Return
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+from .core import read, write
+
+logger = logging.getLogger(__name__)
+
+
+class BatchedStream(object):
+    """ Batch many small messages into a single write
+
+    Some traffic, like ``key-in-memory`` reports from the scheduler or
+    ``update-graph`` and ``client-releases-keys`` messages from the Executor,
+    consists of many small messages sent in quick succession.  Sending each
+    on its own costs one serialization and one system call per message.
+
+    ``BatchedStream`` sends at most one batch every ``interval`` seconds.
+    A message sent after a quiet period goes out on the next iteration of the
+    event loop.  Messages sent while we are waiting out the interval are
+    collected and sent together as a single ``{'op': 'batch', 'msgs': [...]}``
+    message.  On the receiving side ``recv`` unpacks those batches and returns
+    messages one at a time.  Any other message, including a plain list, is
+    passed through unchanged so that either side may send without batching.
+
+    ``send`` may be called from other threads.
+
+    Parameters
+    ----------
+    stream: IOStream
+    interval: float
+        Minimum number of seconds between batches
+    max_messages: int
+        Send immediately once this many messages are waiting
+
+    Examples
+    --------
+    >>> bstream = BatchedStream(stream, interval=0.002)  # doctest: +SKIP
+    >>> bstream.send({'op': 'key-in-memory', 'key': 'x'})  # doctest: +SKIP
+    >>> msg = yield bstream.recv()  # doctest: +SKIP
+    """
+    def __init__(self, stream, interval=0.002, max_messages=10000, loop=None):
+        self.stream = stream
+        self.interval = interval
+        self.max_messages = max_messages
+        self.loop = loop or IOLoop.current()
+        self.buffer = deque()
+        self.inbox = deque()
+        self.waiting = False
+        self.last_send = 0
+        self.last_write = None
+        self.message_count = 0
+        self.batch_count = 0
+
+    def __str__(self):
+        return '<BatchedStream: %d messages in %d batches, %d waiting>' % (
+                self.message_count, self.batch_count, len(self.buffer))
+
+    __repr__ = __str__
+
+    def send(self, msg):
+        """ Schedule a message to be sent with the next batch """
+        self.buffer.append(msg)
+        if len(self.buffer) >= self.max_messages:
+            self.loop.add_callback(self.flush)
+        elif not self.waiting:
+            self.waiting = True
+            self.loop.add_callback(self._schedule_flush)
+
+    def _schedule_flush(self):
+        delay = self.last_send + self.interval - self.loop.time()
+        if delay > 0:
+            self.loop.call_later(delay, self.flush)
+        else:
+            self.flush()
+
+    def flush(self):
+        """ Send all waiting messages now
+
+        Returns a future that resolves once the batch is written
+        """
+        self.waiting = False
+        n = len(self.buffer)
+        if not n:
+            return self.last_write or gen.maybe_future(None)
+        payload = [self.buffer.popleft() for i in range(n)]
+        self.last_send = self.loop.time()
+        self.message_count += n
+        self.batch_count += 1
+        if self.stream.closed():
+            logger.info("Dropping %d messages to closed stream", n)
+            return gen.maybe_future(None)
+        self.last_write = write(self.stream, {'op': 'batch', 'msgs': payload})
+        self.loop.add_future(self.last_write, self._check_write)
+        return self.last_write
+
+    def _check_write(self, future):
+        try:
+            future.result()
+        except StreamClosedError:
+            logger.info("Lost connection while sending batch")
+        except Exception as e:
+            logger.exception(e)
+
+    @gen.coroutine
+    def _read(self):
+        """ Read one message from the stream into the inbox """
+        msg = yield read(self.stream)
+        if isinstance(msg, dict) and msg.get('op') == 'batch':
+            self.inbox.extend(msg['msgs'])
+        else:
+            self.inbox.append(msg)
+
+    @gen.coroutine
+    def recv(self):
+        """ Receive the next message, unpacking batches as they arrive """
+        while not self.inbox:
+            yield self._read()
+        raise Return(self.inbox.popleft())
+
+    @gen.coroutine
+    def recv_many(self):
+        """ Receive all messages that have arrived, waiting for at least one
+
+        Cheaper than calling ``recv`` once per message when handling many
+        small messages.
+        """
+        while not self.inbox:
+            yield self._read()
+        msgs = list(self.inbox)
+        self.inbox.clear()
+        raise Return(msgs)
+
+    @gen.coroutine
+    def close(self):
+        """ Flush waiting messages and close the stream """
+        try:
+            yield self.flush()
+        except StreamClosedError:
+            pass
+        self.stream.close()
+
+    def closed(self):
+        return self.stream.closed()
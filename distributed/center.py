@@ -4,13 +4,13 @@ from collections import defaultdict
 import logging
 from functools import partial
 import socket
-from toolz import first
+from toolz import dissoc
 
 from tornado import gen
 from tornado.gen import Return
 from tornado.iostream import StreamClosedError
 
-from .core import Server, read, write, rpc, pingpong, send_recv
+from .core import Server, read, write, pingpong, connection_pool
 from .utils import ignoring, ignore_exceptions, All, get_ip
 
 
@@ -39,6 +39,8 @@ class Center(Server):
     *   ``worker_services:: {worker: {str: port}}``:
         Ports of other running services on each worker.
         E.g. ``{('192.168.1.100', 8000): {'http': 9001, 'nanny': 9002}}``
+    *   ``services:: {str: server}``:
+        Other services running on this center, like HTTP
 
     Workers and clients check in with the Center to discover available resources
 
@@ -82,7 +84,7 @@ class Center(Server):
     --------
     distributed.worker.Worker:
     """
-    def __init__(self, ip=None, **kwargs):
+    def __init__(self, ip=None, services=None, **kwargs):
         self.ip = ip or get_ip()
         self.who_has = defaultdict(set)
         self.has_what = defaultdict(set)
@@ -99,19 +101,22 @@ class Center(Server):
                 d.items()}
         d['ping'] = pingpong
 
-        super(Center, self).__init__(d, **kwargs)
+        services = services or {}
+        self.services = {k: v(self) for k, v in services.items()}
+        for v in self.services.values():
+            v.listen(0)
 
-    @property
-    def port(self):
-        return first(self._sockets.values()).getsockname()[1]
+        super(Center, self).__init__(d, **kwargs)
 
     @gen.coroutine
     def terminate(self, stream=None):
+        for v in self.services.values():
+            v.stop()
         self.stop()
         return b'OK'
 
     def register(self, stream, address=None, keys=(), ncores=None,
-                 services=None):
+                 services=None, io_threads=None):
         self.has_what[address] = set(keys)
         for key in keys:
             self.who_has[key].add(address)
@@ -186,8 +191,9 @@ class Center(Server):
             del self.who_has[key]
 
         # TODO: ignore missing workers
-        coroutines = [rpc(ip=worker[0], port=worker[1]).delete_data(
-                                keys=keys, report=False, close=True)
+        pool = connection_pool()
+        coroutines = [pool(ip=worker[0], port=worker[1]).delete_data(
+                                keys=keys, report=False)
                       for worker, keys in d.items()]
         for worker, keys in d.items():
             logger.debug("Remove %d keys from worker %s", len(keys), worker)
@@ -199,6 +205,8 @@ class Center(Server):
     def broadcast(self, stream, msg=None):
         """ Broadcast message to workers, return all results """
         workers = list(self.ncores)
-        results = yield All([send_recv(ip=ip, port=port, close=True, **msg)
+        pool = connection_pool()
+        results = yield All([getattr(pool(ip=ip, port=port), msg['op'])(
+                                **dissoc(msg, 'op'))
                              for ip, port in workers])
         raise Return(dict(zip(workers, results)))
@@ -5,6 +5,7 @@ from tornado.ioloop import IOLoop
 
 from distributed.utils import get_ip
 from distributed import Center
+from distributed.http import HTTPCenter
 from distributed.cli.utils import check_python_3
 
 # Set up signal handling
@@ -26,8 +27,10 @@ def main(host, port):
         host = get_ip()
 
     logger.info("Start center at %s:%d", host, port)
-    center = Center(host)
+    center = Center(host, services={'http': HTTPCenter})
     center.listen(port)
+    for k, v in center.services.items():
+        logger.info("  %13s at: %20s:%s", k, host, v.port)
     IOLoop.current().start()
     IOLoop.current().close()
     logger.info("\nEnd center at %s:%d", host, port)
@@ -26,8 +26,22 @@ ip = get_ip()
               help="Number of threads per process. Defaults to number of cores")
 @click.option('--nprocs', type=int, default=1,
               help="Number of worker processes.  Defaults to one.")
+@click.option('--memory-limit', type=float, default=None,
+              help="Bytes of data to keep in memory per process before "
+                   "spilling to disk.  Defaults to no limit.")
+@click.option('--compressed-limit', type=float, default=0,
+              help="Bytes of compressed data to keep in memory per process "
+                   "before spilling to disk.  Used with --memory-limit.  "
+                   "Defaults to zero.")
+@click.option('--process-pool', is_flag=True,
+              help="Run tasks in a pool of --nthreads processes within each "
+                   "worker, for pure Python code that holds the GIL.")
+@click.option('--io-threads', type=int, default=16,
+              help="Number of threads per process for I/O-bound tasks, like "
+                   "reads from S3 or HDFS.  Defaults to 16.")
 @click.option('--no-nanny', is_flag=True)
-def main(center, host, port, nthreads, nprocs, no_nanny):
+def main(center, host, port, nthreads, nprocs, no_nanny, memory_limit,
+         compressed_limit, process_pool, io_threads):
     try:
         center_ip, center_port = center.split(':')
         center_port = int(center_port)
@@ -49,7 +63,9 @@ def main(center, host, port, nthreads, nprocs, no_nanny):
     loop = IOLoop.current()
     t = Worker if no_nanny else Nanny
     nannies = [t(center_ip, center_port, ncores=nthreads, ip=host,
-                 services=services, loop=loop)
+                 services=services, loop=loop, memory_limit=memory_limit,
+                 compressed_limit=compressed_limit, processes=process_pool,
+                 io_threads=io_threads)
                 for i in range(nprocs)]
 
     for nanny in nannies:
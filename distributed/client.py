@@ -2,6 +2,7 @@ from __future__ import print_function, division, absolute_import
 
 from collections import Iterable, defaultdict
 from itertools import count, cycle
+import logging
 import random
 import socket
 import uuid
@@ -14,10 +15,14 @@ from tornado.iostream import StreamClosedError
 from dask.base import tokenize
 from toolz import merge, concat, groupby, drop
 
-from .core import rpc, coerce_to_rpc
+from .core import rpc, coerce_to_rpc, connection_pool
+from .unix import local_address
 from .utils import ignore_exceptions, ignoring, All
 
 
+logger = logging.getLogger(__name__)
+
+
 no_default = '__no_default__'
 
 
@@ -76,15 +81,46 @@ _gather.__doc__ = gather.__doc__
 
 
 @gen.coroutine
-def gather_from_workers(who_has):
+def get_data_from_worker(addr, keys, unix_paths=None):
+    """ Ask a peer for keys, over its Unix domain socket if it has one
+
+    Falls back to TCP if the socket can not be reached, and then forgets the
+    socket in ``unix_paths``.
+    """
+    pool = connection_pool()
+    local = local_address(addr, unix_paths)
+    if local != addr:
+        try:
+            result = yield pool(addr=local).get_data(keys=keys)
+            raise Return(result)
+        except (socket.error, StreamClosedError) as e:
+            logger.info("Could not reach %s over %s, using TCP: %s",
+                        addr, local[0], e)
+            unix_paths.pop(addr, None)
+    result = yield pool(addr=addr).get_data(keys=keys)
+    raise Return(result)
+
+
+@gen.coroutine
+def gather_from_workers(who_has, permissive=False, unix_paths=None):
     """ Gather data directly from peers
 
     Parameters
     ----------
     who_has: dict
         Dict mapping keys to sets of workers that may have that key
-
-    Returns dict mapping key to value
+    permissive: bool
+        If True, return the keys we could not find rather than raise.  Any
+        error from a peer then marks that peer as bad, not just a lost
+        connection.
+    unix_paths: dict, optional
+        Dict mapping workers to the Unix domain socket paths they advertised.
+        Peers on this host are reached over these sockets.  Peers that we
+        can't reach are removed from it.
+
+    Returns dict mapping key to value, or a tuple of that dict and the set of
+    missing keys if ``permissive``.  Keys held by the same peer are requested
+    in a single ``get_data`` call.
 
     See Also
     --------
@@ -94,13 +130,14 @@ def gather_from_workers(who_has):
     bad_addresses = set()
     who_has = who_has.copy()
     results = dict()
+    all_bad_keys = set()
 
-    while len(results) < len(who_has):
+    while len(results) + len(all_bad_keys) < len(who_has):
         d = defaultdict(list)
         rev = dict()
         bad_keys = set()
         for key, addresses in who_has.items():
-            if key in results:
+            if key in results or key in all_bad_keys:
                 continue
             try:
                 addr = random.choice(list(addresses - bad_addresses))
@@ -109,17 +146,32 @@ def gather_from_workers(who_has):
             except IndexError:
                 bad_keys.add(key)
         if bad_keys:
-            raise KeyError(*bad_keys)
-
-        coroutines = [rpc(ip=ip, port=port).get_data(keys=keys, close=True)
-                            for (ip, port), keys in d.items()]
-        response = yield ignore_exceptions(coroutines, socket.error,
-                                                       StreamClosedError)
+            if permissive:
+                all_bad_keys |= bad_keys
+            else:
+                raise KeyError(*bad_keys)
+
+        coroutines = [get_data_from_worker(addr, keys, unix_paths)
+                      for addr, keys in d.items()]
+        if permissive:
+            exceptions = (Exception,)
+        else:
+            exceptions = (socket.error, StreamClosedError)
+        response = yield ignore_exceptions(coroutines, *exceptions)
         response = merge(response)
-        bad_addresses |= {v for k, v in rev.items() if k not in response}
+        bad = {v for k, v in rev.items() if k not in response}
+        if bad:
+            logger.info("Could not get data from %s", bad)
+            if unix_paths:
+                for addr in bad:
+                    unix_paths.pop(addr, None)
+        bad_addresses |= bad
         results.update(merge(response))
 
-    raise Return(results)
+    if permissive:
+        raise Return((results, all_bad_keys))
+    else:
+        raise Return(results)
 
 
 class WrappedKey(object):
@@ -214,8 +266,9 @@ def scatter_to_workers(ncores, data, report=True):
     d = {k: {b: c for a, b, c in v}
           for k, v in d.items()}
 
-    out = yield All([rpc(ip=w_ip, port=w_port).update_data(data=v,
-                                             close=True, report=report)
+    pool = connection_pool()
+    out = yield All([pool(ip=w_ip, port=w_port).update_data(data=v,
+                                                            report=report)
                  for (w_ip, w_port), v in d.items()])
     nbytes = merge([o[1]['nbytes'] for o in out])
 
@@ -225,7 +278,7 @@ def scatter_to_workers(ncores, data, report=True):
 
 
 @gen.coroutine
-def broadcast_to_workers(workers, data, report=False, rpc=rpc):
+def broadcast_to_workers(workers, data, report=False, rpc=None):
     """ Broadcast data directly to all workers
 
     This sends all data to every worker.
@@ -254,6 +307,7 @@ def broadcast_to_workers(workers, data, report=False, rpc=rpc):
                 names.append(str(uuid.uuid1()))
         data = dict(zip(names, data))
 
+    rpc = rpc or connection_pool()
     out = yield All([rpc(ip=w_ip, port=w_port).update_data(data=data,
                                                            report=report)
                      for (w_ip, w_port) in workers])
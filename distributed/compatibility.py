@@ -1,5 +1,6 @@
 from __future__ import print_function, division, absolute_import
 
+from operator import mul
 import sys
 
 if sys.version_info[0] == 2:
@@ -8,6 +9,7 @@ if sys.version_info[0] == 2:
     from thread import get_ident as get_thread_identity
     reload = reload
     unicode = unicode
+    string_types = (str, unicode)
 
     import gzip
     def gzip_decompress(b):
@@ -21,17 +23,36 @@ if sys.version_info[0] == 2:
                 hasattr(o, '__module__') and
                 o.__module__ == 'Queue')
 
+    def memoryview_nbytes(m):
+        return int(m.itemsize * reduce(mul, m.shape, 1))
+
+    def byte_view(m):
+        """ The bytes of a memoryview, as a bytestring on Python 2
+
+        Python 2 memoryviews can't be cast and index by item rather than by
+        byte, and compressors don't accept them.
+        """
+        return m.tobytes()
+
 
 if sys.version_info[0] == 3:
     from queue import Queue, Empty
     from importlib import reload
     from threading import get_ident as get_thread_identity
     unicode = str
+    string_types = (str,)
     from gzip import decompress as gzip_decompress
 
     def isqueue(o):
         return isinstance(o, Queue)
 
+    def memoryview_nbytes(m):
+        return m.nbytes
+
+    def byte_view(m):
+        """ A flat view of the bytes of a memoryview """
+        return m.cast('B') if m.format != 'B' else m
+
 
 try:
     from functools import singledispatch
@@ -1,25 +1,35 @@
 from __future__ import print_function, division, absolute_import
 
+from bisect import bisect
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from hashlib import md5
+from itertools import islice
 import logging
 import signal
 import socket
 import struct
+import sys
 from time import sleep, time
 import uuid
+import weakref
 
 from toolz import assoc, first
 import tornado
 import pickle
 import cloudpickle
 from tornado import ioloop, gen
+from tornado.concurrent import Future
 from tornado.gen import Return
 from tornado.tcpserver import TCPServer
 from tornado.tcpclient import TCPClient
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream, StreamClosedError
 
+from . import inproc, protocol, unix
+from .inproc import InProcStream
+from .utils import nbytes
+
 
 def dumps(x):
     try:
@@ -49,6 +59,49 @@ def get_total_physical_memory():
 
 
 MAX_BUFFER_SIZE = get_total_physical_memory()
+SMALL_MESSAGE_SIZE = 2**16  # messages smaller than this are sent in one write
+
+# Messages with more bytes than this are (de)serialized in ``offload_executor``
+# rather than on the event loop.  Set to ``None`` to never offload.
+OFFLOAD_THRESHOLD = 10e6
+
+offload_executor = ThreadPoolExecutor(1)
+
+# Time spent (de)serializing in ``offload_executor``, which would otherwise
+# have blocked the event loop
+offload_stats = {'offloaded-loads': 0,
+                 'offloaded-dumps': 0,
+                 'offloaded-bytes': 0,
+                 'offloaded-time': 0.0}
+
+# Upper bounds in seconds of latency histogram buckets, from 1us to ~17s
+LATENCY_BUCKETS = [2**i * 1e-6 for i in range(25)]
+
+
+def op_metrics():
+    """ Empty counters for one operation handled by a Server
+
+    Each of ``deserialize``, ``handler`` and ``serialize`` holds the number of
+    calls that fell in each bucket of ``LATENCY_BUCKETS``, with one final
+    bucket for anything slower.  The matching ``-time`` entries hold totals.
+    """
+    d = {'count': 0, 'bytes-in': 0, 'bytes-out': 0}
+    for stage in ['deserialize', 'handler', 'serialize']:
+        d[stage] = [0] * (len(LATENCY_BUCKETS) + 1)
+        d[stage + '-time'] = 0.0
+    return d
+
+
+def record_latency(metrics, stage, duration):
+    """ Add one duration to the ``stage`` histogram of ``metrics``
+
+    >>> m = op_metrics()
+    >>> record_latency(m, 'handler', 0.0015)
+    >>> m['handler'].index(1)  # bucket with upper bound 2**11 us
+    11
+    """
+    metrics[stage][bisect(LATENCY_BUCKETS, duration)] += 1
+    metrics[stage + '-time'] += duration
 
 
 def handle_signal(sig, frame):
@@ -88,9 +141,22 @@ class Server(TCPServer):
 
     *  ``{'op': 'ping'}``
     *  ``{'op': 'add': 'x': 10, 'y': 20}``
+
+    **Metrics**
+
+    For every operation we count calls and bytes received and sent, and keep
+    histograms of the time spent deserializing the message, running the
+    handler and serializing the reply.  These are in the ``metrics``
+    attribute and are returned by the ``metrics`` operation.
+
+    Messages larger than ``OFFLOAD_THRESHOLD`` bytes are (de)serialized in a
+    separate thread so that the event loop keeps serving other connections.
+    ``offload_stats`` counts the time moved off the event loop this way.
     """
     def __init__(self, handlers, max_buffer_size=MAX_BUFFER_SIZE, **kwargs):
         self.handlers = assoc(handlers, 'identity', self.identity)
+        self.handlers.setdefault('metrics', self.get_metrics)
+        self.metrics = defaultdict(op_metrics)
         self.id = uuid.uuid1()
         self._port = None
         super(Server, self).__init__(max_buffer_size=max_buffer_size, **kwargs)
@@ -99,7 +165,9 @@ class Server(TCPServer):
     def port(self):
         if not self._port:
             try:
-                self._port = first(self._sockets.values()).getsockname()[1]
+                self._port = first(s for s in self._sockets.values()
+                                   if s.family != getattr(socket, 'AF_UNIX', None)
+                                   ).getsockname()[1]
             except StopIteration:
                 raise OSError("Server has no port.  Please call .listen first")
         return self._port
@@ -107,7 +175,30 @@ class Server(TCPServer):
     def identity(self, stream):
         return {'type': type(self).__name__, 'id': self.id}
 
+    def get_metrics(self, stream=None):
+        """ Counts, bytes and latency histograms for each operation
+
+        Also includes ``offload_stats`` for this process
+        """
+        return {'buckets': LATENCY_BUCKETS,
+                'ops': {op: d.copy() for op, d in self.metrics.items()},
+                'offload': offload_stats.copy()}
+
     def listen(self, port):
+        """ Listen on a TCP port, or in-process if ``port`` is ``'inproc://'``
+
+        In-process servers take an address of the form
+        ``('inproc://<pid>', n)`` and set ``self.ip`` accordingly.  A
+        ``port`` like ``'unix:///path/to/socket'`` adds a Unix domain socket
+        alongside any TCP port.
+        """
+        if inproc.is_inproc(port):
+            self.ip, self._port = inproc.new_address()
+            inproc.servers[(self.ip, self._port)] = self
+            return
+        if unix.is_unix(port):
+            unix.listen(self, port)
+            return
         while True:
             try:
                 super(Server, self).listen(port)
@@ -119,6 +210,11 @@ class Server(TCPServer):
                     logger.info('Randomly assigned port taken for %s. Retrying',
                                 type(self).__name__)
 
+    def stop(self):
+        if inproc.is_inproc(getattr(self, 'ip', None)):
+            inproc.servers.pop((self.ip, self._port), None)
+        super(Server, self).stop()
+
     @gen.coroutine
     def handle_stream(self, stream, address):
         """ Dispatch new connections to coroutine-handlers
@@ -131,13 +227,29 @@ class Server(TCPServer):
 
         Coroutines should expect a single IOStream object.
         """
+        if not isinstance(address, tuple):  # Unix domain socket
+            address = ('unix', 0)
         ip, port = address
         logger.info("Connection from %s:%d to %s", ip, port,
                     type(self).__name__)
         try:
             while True:
                 try:
-                    msg = yield read(stream)
+                    if isinstance(stream, InProcStream):
+                        frames = ()
+                        msg = yield stream.read_msg()
+                        deserialize_time = 0
+                    else:
+                        frames = yield read_frames(stream)
+                        start = time()
+                        n = sum(map(nbytes, frames))
+                        if _should_offload(n):
+                            offload_stats['offloaded-bytes'] += n
+                            msg = yield offload(protocol.loads, frames,
+                                                'loads')
+                        else:
+                            msg = protocol.loads(frames)
+                        deserialize_time = time() - start
                     logger.debug("Message from %s:%d: %s", ip, port, msg)
                 except StreamClosedError:
                     logger.info("Lost connection: %s", str(address))
@@ -159,6 +271,7 @@ class Server(TCPServer):
                     if reply:
                         yield write(stream, b'OK')
                     break
+                metrics = None
                 try:
                     handler = self.handlers[op]
                 except KeyError:
@@ -166,14 +279,20 @@ class Server(TCPServer):
                     logger.warn(result)
                 else:
                     logger.debug("Calling into handler %s", handler.__name__)
+                    metrics = self.metrics[op]
+                    metrics['count'] += 1
+                    metrics['bytes-in'] += sum(map(nbytes, frames))
+                    record_latency(metrics, 'deserialize', deserialize_time)
+                    start = time()
                     try:
                         result = yield gen.maybe_future(handler(stream, **msg))
                     except Exception as e:
                         logger.exception(e)
                         raise
+                    record_latency(metrics, 'handler', time() - start)
                 if reply:
                     try:
-                        yield write(stream, result)
+                        yield write(stream, result, metrics)
                     except StreamClosedError:
                         logger.info("Lost connection: %s" % str(address))
                         break
@@ -188,22 +307,218 @@ class Server(TCPServer):
                     type(self).__name__)
 
 
-sentinel = md5(b'7f57da0f9202f6b4df78e251058be6f0').hexdigest().encode()
+def frame_header(frames):
+    """ Header describing a sequence of frames
+
+    Eight bytes holding the number of frames followed by eight bytes for the
+    length of each frame
+
+    >>> len(frame_header([b'123', b'']))
+    24
+    """
+    lengths = [nbytes(frame) for frame in frames]
+    return (struct.pack('<Q', len(frames)) +
+            struct.pack('<' + 'Q' * len(frames), *lengths))
+
+
+@gen.coroutine
+def read_frames(stream):
+    """ Read a sequence of length-prefixed frames from a stream
+
+    We read a small header with the number of frames and their lengths and
+    then read each frame with a single exact-size read.  This avoids scanning
+    large messages for a delimiter.
+
+    Large frames are read into writable ``bytearray`` objects, so that arrays
+    built on top of them by ``protocol.loads`` are writable without a copy.
+
+    See Also
+    --------
+    write_frames
+    """
+    n_frames = yield stream.read_bytes(8)
+    n_frames = struct.unpack('<Q', n_frames)[0]
+    lengths = yield stream.read_bytes(8 * n_frames)
+    lengths = struct.unpack('<' + 'Q' * n_frames, lengths)
+
+    frames = []
+    for length in lengths:
+        if length >= SMALL_MESSAGE_SIZE:
+            frame = yield read_into_bytearray(stream, length)
+        elif length:
+            frame = yield stream.read_bytes(length)
+        else:
+            frame = b''
+        frames.append(frame)
+    raise Return(frames)
+
+
+@gen.coroutine
+def read_into_bytearray(stream, length):
+    """ Read ``length`` bytes from a stream into a new ``bytearray``
+
+    Tornado joins the chunks of a large read into a new bytestring anyway.
+    We copy them into a preallocated buffer instead, which costs the same and
+    leaves us with mutable memory.
+    """
+    frame = bytearray(length)
+    if hasattr(stream, 'read_into'):  # tornado >= 5
+        yield stream.read_into(frame)
+        raise Return(frame)
+    view = memoryview(frame)
+    start = 0
+    while start < length:
+        chunk = yield stream.read_bytes(length - start, partial=True)
+        view[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    raise Return(frame)
+
+
+@gen.coroutine
+def write_frames(stream, frames):
+    """ Write a sequence of frames to a stream, prefixed by their lengths
+
+    All frames are handed to the stream before we yield so that concurrent
+    writers never interleave their frames.  Small frames are joined onto the
+    header so that small messages go out in a single write.
+
+    See Also
+    --------
+    read_frames
+    """
+    lengths = [nbytes(frame) for frame in frames]
+    if sum(lengths) < SMALL_MESSAGE_SIZE:
+        future = stream.write(b''.join([frame_header(frames)] +
+                                       [frame.tobytes()
+                                        if isinstance(frame, memoryview)
+                                        else bytes(frame)
+                                        for frame in frames]))
+    else:
+        future = stream.write(frame_header(frames))
+        for frame, length in zip(frames, lengths):
+            if length:
+                if isinstance(frame, memoryview) and tornado.version_info < (4, 5):
+                    frame = frame.tobytes()  # older tornado only accepts bytes
+                future = stream.write(frame)
+    yield future
+
+
+def message_nbytes(msg, sample=10):
+    """ Estimate the size of a message in bytes
+
+    We add up the lengths of bytestrings and the ``nbytes`` of arrays within
+    dicts, lists, tuples and sets.  Other objects count for their
+    ``sys.getsizeof``.  Containers with more than ``sample`` elements are
+    estimated from their first ``sample`` elements so that this stays cheap
+    for messages with many small items.
+
+    >>> message_nbytes({'op': 'update-data', 'data': {'x': b'0' * 1000}}) >= 1000
+    True
+    >>> message_nbytes([b'0' * 1000] * 100000) >= 1e8
+    True
+    """
+    typ = type(msg)
+    if typ in (bytes, bytearray, memoryview):
+        return nbytes(msg)
+    if typ is dict:
+        items = msg.values()
+    elif typ in (list, tuple, set, frozenset):
+        items = msg
+    else:
+        n = getattr(msg, 'nbytes', None)
+        return n if isinstance(n, int) else sys.getsizeof(msg, 0)
+    if len(items) > sample:
+        total = sum(message_nbytes(o, sample) for o in islice(items, sample))
+        return total * len(items) // sample
+    return sum(message_nbytes(o, sample) for o in items)
+
+
+def _should_offload(n):
+    return OFFLOAD_THRESHOLD is not None and n > OFFLOAD_THRESHOLD
+
+
+def _timed(func, arg):
+    start = time()
+    result = func(arg)
+    return result, time() - start
+
+
+@gen.coroutine
+def offload(func, arg, kind):
+    """ Call ``func(arg)`` in ``offload_executor`` and record its duration
+
+    ``kind`` is ``'loads'`` or ``'dumps'``.
+    """
+    result, duration = yield offload_executor.submit(_timed, func, arg)
+    offload_stats['offloaded-' + kind] += 1
+    offload_stats['offloaded-time'] += duration
+    raise Return(result)
+
 
 @gen.coroutine
 def read(stream):
-    """ Read a message from a stream """
-    msg = yield stream.read_until(sentinel)
-    msg = msg[:-len(sentinel)]
-    msg = loads(msg)
+    """ Read a message from a stream
+
+    Large messages are deserialized in ``offload_executor``
+    """
+    if isinstance(stream, InProcStream):
+        msg = yield stream.read_msg()
+        raise Return(msg)
+    frames = yield read_frames(stream)
+    n = sum(map(nbytes, frames))
+    if _should_offload(n):
+        offload_stats['offloaded-bytes'] += n
+        msg = yield offload(protocol.loads, frames, 'loads')
+    else:
+        msg = protocol.loads(frames)
     raise Return(msg)
 
 
 @gen.coroutine
-def write(stream, msg):
-    """ Write a message to a stream """
-    msg = dumps(msg)
-    yield stream.write(msg + sentinel)
+def write(stream, msg, metrics=None):
+    """ Write a message to a stream
+
+    Messages estimated by ``message_nbytes`` to be large are serialized in
+    ``offload_executor``, and later writes to the same stream may serialize
+    meanwhile.  Frames are still handed to the stream in the order in which
+    ``write`` was called.
+
+    If given, we update the ``serialize`` latency and ``bytes-out`` of
+    ``metrics``.
+    """
+    if isinstance(stream, InProcStream):
+        yield stream.write_msg(msg)
+        return
+    start = time()
+    large = _should_offload(message_nbytes(msg))
+    previous = getattr(stream, '_pending_write', None)
+    if not large and previous is None:
+        frames = protocol.dumps(msg)
+        if metrics is not None:
+            record_latency(metrics, 'serialize', time() - start)
+            metrics['bytes-out'] += sum(map(nbytes, frames))
+        yield write_frames(stream, frames)
+        return
+
+    done = Future()
+    stream._pending_write = done
+    try:
+        if large:
+            frames = yield offload(protocol.dumps, msg, 'dumps')
+            offload_stats['offloaded-bytes'] += sum(map(nbytes, frames))
+        else:
+            frames = protocol.dumps(msg)
+        if metrics is not None:
+            record_latency(metrics, 'serialize', time() - start)
+            metrics['bytes-out'] += sum(map(nbytes, frames))
+        if previous is not None:
+            yield previous
+        future = write_frames(stream, frames)
+    finally:
+        if stream._pending_write is done:
+            stream._pending_write = None
+        done.set_result(None)
+    yield future
 
 
 def pingpong(stream):
@@ -212,10 +527,19 @@ def pingpong(stream):
 
 @gen.coroutine
 def connect(ip, port, timeout=3):
+    if unix.is_unix(ip):
+        future = unix.connect(ip, max_buffer_size=MAX_BUFFER_SIZE)
+        try:
+            stream = yield gen.with_timeout(timedelta(seconds=timeout), future)
+        except gen.TimeoutError:
+            raise IOError("Timed out while connecting to %s" % ip)
+        raise Return(stream)
     client = TCPClient()
     start = time()
     while True:
         try:
+            if inproc.is_inproc(ip):
+                raise Return(inproc.connect(ip, port))
             future = client.connect(ip, port, max_buffer_size=MAX_BUFFER_SIZE)
             stream = yield gen.with_timeout(timedelta(seconds=timeout), future)
             raise Return(stream)
@@ -344,11 +668,224 @@ def coerce_to_rpc(o, **kwargs):
     if isinstance(o, tuple):
         return rpc(ip=o[0], port=o[1], **kwargs)
     if isinstance(o, str):
-        ip, port = o.split(':')
+        ip, port = o.rsplit(':', 1)
         return rpc(ip=ip, port=int(port), **kwargs)
-    elif isinstance(o, IOStream):
+    elif isinstance(o, (IOStream, InProcStream)):
         return rpc(stream=o, **kwargs)
     elif isinstance(o, rpc):
         return o
     else:
         raise TypeError()
+
+
+class ConnectionPool(object):
+    """ A pool of open streams to remote servers, shared within a process
+
+    We keep streams open after use and hand them out again to later callers
+    that talk to the same address.  This avoids a new TCP connection for
+    every request.
+
+    >>> pool = connection_pool()  # doctest: +SKIP
+    >>> result = yield pool(ip='127.0.0.1', port=8000).get_data(keys=['x'])  # doctest: +SKIP
+
+    Parameters
+    ----------
+    limit_per_address: int
+        Maximum number of open streams to any one address.  Further callers
+        wait until a stream is released.
+    max_idle: int
+        Maximum number of idle streams kept open across all addresses.  We
+        close the least recently used streams beyond this.
+    idle_timeout: float
+        Seconds after which we close a stream that has not been used
+
+    Attributes
+    ----------
+    available: {address: [streams]}
+        Idle streams, most recently used last
+    occupied: {address: set(streams)}
+        Streams currently in use
+    counts: dict
+        Number of ``hits`` (reused a stream), ``misses`` (opened a new one)
+        and ``evictions`` (closed an idle stream)
+    """
+    def __init__(self, limit_per_address=10, max_idle=512, idle_timeout=60):
+        self.limit_per_address = limit_per_address
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.available = defaultdict(list)
+        self.occupied = defaultdict(set)
+        self.connecting = defaultdict(int)
+        self.idle = OrderedDict()  # stream: (address, last used), oldest first
+        self.waiters = defaultdict(deque)
+        self.rpcs = dict()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @property
+    def open(self):
+        """ Number of open streams, idle or in use """
+        return len(self.idle) + sum(map(len, self.occupied.values()))
+
+    def __str__(self):
+        return '<ConnectionPool: open=%d, active=%d, hits=%d, misses=%d>' % (
+                self.open, self.open - len(self.idle), self.counts['hits'],
+                self.counts['misses'])
+
+    __repr__ = __str__
+
+    def __call__(self, ip=None, port=None, addr=None):
+        """ An rpc-like object that sends each message over a pooled stream """
+        if addr is None:
+            addr = (ip, port)
+        try:
+            return self.rpcs[addr]
+        except KeyError:
+            remote = self.rpcs[addr] = PooledRPC(addr, self)
+            return remote
+
+    @gen.coroutine
+    def connect(self, addr, timeout=3):
+        """ Get a stream to ``addr``, reusing an idle one if possible
+
+        Return the stream with ``release`` when done with it.
+        """
+        stream, reused = yield self._acquire(addr, timeout=timeout)
+        raise Return(stream)
+
+    @gen.coroutine
+    def _acquire(self, addr, timeout=3):
+        self.collect()
+        while True:
+            available = self.available.get(addr)
+            while available:
+                stream = available.pop()
+                del self.idle[stream]
+                if stream.closed():
+                    continue
+                self.counts['hits'] += 1
+                self.occupied[addr].add(stream)
+                raise Return((stream, True))
+
+            if (len(self.occupied[addr]) + self.connecting[addr] <
+                    self.limit_per_address):
+                break
+            future = gen.Future()
+            self.waiters[addr].append(future)
+            yield future
+
+        self.counts['misses'] += 1
+        self.connecting[addr] += 1
+        try:
+            stream = yield connect(addr[0], addr[1], timeout=timeout)
+        except Exception:
+            self._wake(addr)
+            raise
+        finally:
+            self.connecting[addr] -= 1
+        self.occupied[addr].add(stream)
+        raise Return((stream, False))
+
+    def release(self, addr, stream):
+        """ Return a stream to the pool after use """
+        self.occupied[addr].discard(stream)
+        if not stream.closed():
+            self.available[addr].append(stream)
+            self.idle[stream] = (addr, time())
+            if len(self.idle) > self.max_idle:
+                self.evict()
+        self._wake(addr)
+
+    def discard(self, addr, stream):
+        """ Close and forget a stream that is in an unknown state """
+        self.occupied[addr].discard(stream)
+        stream.close()
+        self._wake(addr)
+
+    def _wake(self, addr):
+        waiters = self.waiters.get(addr)
+        if waiters:
+            waiters.popleft().set_result(None)
+            if not waiters:
+                del self.waiters[addr]
+
+    def evict(self):
+        """ Close the least recently used idle stream """
+        stream, (addr, _) = self.idle.popitem(last=False)
+        self.available[addr].remove(stream)
+        stream.close()
+        self.counts['evictions'] += 1
+
+    def collect(self):
+        """ Close streams that have been idle longer than ``idle_timeout`` """
+        deadline = time() - self.idle_timeout
+        while self.idle and next(iter(self.idle.values()))[1] < deadline:
+            self.evict()
+
+    def close(self):
+        """ Close all idle streams """
+        while self.idle:
+            self.evict()
+
+
+class PooledRPC(object):
+    """ Send messages to one address over streams from a ``ConnectionPool``
+
+    Behaves like an ``rpc`` object.  If a reused stream turns out to be closed
+    while we write the request, we retry once on a new stream.  Once the
+    request has been written we never retry, because the peer may already
+    have acted on it.
+
+    >>> remote = connection_pool()(ip='127.0.0.1', port=8000)  # doctest: +SKIP
+    >>> response = yield remote.add(x=10, y=20)  # doctest: +SKIP
+    """
+    def __init__(self, addr, pool):
+        self.addr = addr
+        self.pool = pool
+
+    def __getattr__(self, key):
+        @gen.coroutine
+        def send_recv_from_pool(**kwargs):
+            msg = kwargs
+            msg['op'] = key
+            msg['reply'] = True
+            for i in range(2):
+                stream, reused = yield self.pool._acquire(self.addr)
+                try:
+                    yield write(stream, msg)
+                except StreamClosedError:
+                    self.pool.discard(self.addr, stream)
+                    if reused and i == 0:  # peer closed it while idle, retry
+                        continue
+                    raise
+                except Exception:
+                    self.pool.discard(self.addr, stream)
+                    raise
+                # The peer may have acted on the message, never send it twice
+                try:
+                    result = yield read(stream)
+                except Exception:
+                    self.pool.discard(self.addr, stream)
+                    raise
+                if msg.get('close'):  # the peer closes its end
+                    self.pool.discard(self.addr, stream)
+                else:
+                    self.pool.release(self.addr, stream)
+                raise Return(result)
+        return send_recv_from_pool
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def connection_pool():
+    """ The connection pool shared by everything running on the current loop
+
+    Streams are bound to an event loop, so each IOLoop in the process gets its
+    own pool.
+    """
+    loop = IOLoop.current()
+    try:
+        return _pools[loop]
+    except KeyError:
+        pool = _pools[loop] = ConnectionPool()
+        return pool
@@ -11,7 +11,7 @@ import logging
 import os
 from time import sleep
 import uuid
-from threading import Thread
+from threading import Thread, Lock
 import six
 
 import dask
@@ -27,9 +27,11 @@ from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.iostream import StreamClosedError, IOStream
 from tornado.queues import Queue
 
+from .batched import BatchedStream
 from .client import (WrappedKey, unpack_remotedata, pack_data)
-from .core import read, write, connect, rpc, coerce_to_rpc, dumps
-from .scheduler import Scheduler, dumps_function, dumps_task
+from .core import read, write, connect, rpc, coerce_to_rpc, dumps, loads
+from .inproc import InProcStream
+from .scheduler import Scheduler, dumps_function, dumps_task, hash_blobs
 from .utils import All, sync, funcname, ignoring, queue_to_iterator, _deps
 from .compatibility import Queue as pyQueue, Empty, isqueue
 
@@ -178,9 +180,13 @@ class Future(WrappedKey):
     @property
     def type(self):
         try:
-            return self.executor.futures[self.key]['type']
+            d = self.executor.futures[self.key]
+            typ = d['type']
         except KeyError:
             return None
+        if isinstance(typ, bytes):  # pickled by the worker
+            typ = d['type'] = loads(typ)
+        return typ
 
     def __del__(self):
         self.executor._dec_ref(self.key)
@@ -250,6 +256,8 @@ class Executor(object):
         self.coroutines = []
         self.id = str(uuid.uuid1())
         self._start_arg = address
+        self._pending_msgs = []  # sent before the scheduler connection exists
+        self._pending_lock = Lock()
 
         if start:
             self.start(timeout=timeout)
@@ -282,10 +290,19 @@ class Executor(object):
         sync(self.loop, self._start, **kwargs)
 
     def _send_to_scheduler(self, msg):
+        if msg['op'] == 'update-graph' and msg['tasks']:
+            msg['blobs'] = hash_blobs(msg['tasks'])
+        with self._pending_lock:
+            if self._pending_msgs is not None:
+                self._pending_msgs.append(msg)
+                return
+        self._write_to_scheduler(msg)
+
+    def _write_to_scheduler(self, msg):
         if isinstance(self.scheduler, Scheduler):
             self.loop.add_callback(self.scheduler_queue.put_nowait, msg)
-        elif isinstance(self.scheduler_stream, IOStream):
-            self.loop.add_callback(write, self.scheduler_stream, msg)
+        elif isinstance(self.scheduler_stream, (IOStream, InProcStream)):
+            self.batched_stream.send(msg)
         else:
             raise NotImplementedError()
 
@@ -295,7 +312,7 @@ class Executor(object):
             self.scheduler = self._start_arg
             self.center = self._start_arg.center
         if isinstance(self._start_arg, str):
-            ip, port = tuple(self._start_arg.split(':'))
+            ip, port = tuple(self._start_arg.rsplit(':', 1))
             self._start_arg = (ip, int(port))
         if isinstance(self._start_arg, tuple):
             r = coerce_to_rpc(self._start_arg, timeout=timeout)
@@ -313,6 +330,8 @@ class Executor(object):
                 self.scheduler_stream = yield connect(*self._start_arg)
                 yield write(self.scheduler_stream, {'op': 'register-client',
                                                     'client': self.id})
+                self.batched_stream = BatchedStream(self.scheduler_stream,
+                                                    loop=self.loop)
                 if 'center' in ident:
                     cip, cport = ident['center']
                     self.center = rpc(ip=cip, port=cport)
@@ -330,6 +349,11 @@ class Executor(object):
             self.coroutines.append(self.scheduler.handle_queues(
                 self.scheduler_queue, self.report_queue))
 
+        with self._pending_lock:
+            for msg in self._pending_msgs:
+                self._write_to_scheduler(msg)
+            self._pending_msgs = None
+
         start_event = Event()
         self.coroutines.append(self._handle_report(start_event))
 
@@ -368,8 +392,8 @@ class Executor(object):
         """ Listen to scheduler """
         if isinstance(self.scheduler, Scheduler):
             next_message = self.report_queue.get
-        elif isinstance(self.scheduler_stream, IOStream):
-            next_message = lambda: read(self.scheduler_stream)
+        elif isinstance(self.scheduler_stream, (IOStream, InProcStream)):
+            next_message = self.batched_stream.recv
         else:
             raise NotImplemented()
 
@@ -429,9 +453,18 @@ class Executor(object):
                 yield [gen.with_timeout(timedelta(seconds=2), f)
                         for f in self.coroutines]
 
+    @gen.coroutine
+    def _flush_scheduler_stream(self, timeout):
+        """ Wait until waiting messages are written to the scheduler """
+        with ignoring(StreamClosedError, TimeoutError):
+            yield gen.with_timeout(timedelta(seconds=timeout),
+                                   self.batched_stream.flush())
+
     def shutdown(self, timeout=10):
         """ Send shutdown signal and wait until scheduler terminates """
         self._send_to_scheduler({'op': 'close'})
+        if self.loop._running and not isinstance(self.scheduler, Scheduler):
+            sync(self.loop, self._flush_scheduler_stream, timeout)
         self.loop.stop()
         self._loop_thread.join(timeout=timeout)
         if _global_executor[0] is self:
@@ -451,6 +484,9 @@ class Executor(object):
         workers: set, iterable of sets
             A set of worker hostnames on which computations may be performed.
             Leave empty to default to all workers (common case)
+        processes: bool (defaults to False)
+            Run in a pool of processes on the worker rather than in a thread.
+            Useful for pure Python functions that hold the GIL.
 
         Examples
         --------
@@ -471,6 +507,7 @@ class Executor(object):
         pure = kwargs.pop('pure', True)
         workers = kwargs.pop('workers', None)
         allow_other_workers = kwargs.pop('allow_other_workers', False)
+        processes = kwargs.pop('processes', False)
 
         if allow_other_workers not in (True, False, None):
             raise TypeError("allow_other_workers= must be True or False")
@@ -505,6 +542,10 @@ class Executor(object):
             task['args'] = dumps(args2)
         if kwargs2:
             task['kwargs'] = dumps(kwargs2)
+        if processes:
+            task['processes'] = True
+        if getattr(func, 'io_bound', False):
+            task['io'] = True
 
         logger.debug("Submit %s(...), %s", funcname(func), key)
         self._send_to_scheduler({'op': 'update-graph',
@@ -546,6 +587,9 @@ class Executor(object):
         workers: set, iterable of sets
             A set of worker hostnames on which computations may be performed.
             Leave empty to default to all workers (common case)
+        processes: bool (defaults to False)
+            Run in a pool of processes on the worker rather than in a thread.
+            Useful for pure Python functions that hold the GIL.
 
         Examples
         --------
@@ -578,6 +622,7 @@ class Executor(object):
         pure = kwargs.pop('pure', True)
         workers = kwargs.pop('workers', None)
         allow_other_workers = kwargs.pop('allow_other_workers', False)
+        processes = kwargs.pop('processes', False)
 
         if allow_other_workers and workers is None:
             raise ValueError("Only use allow_other_workers= if using workers=")
@@ -624,9 +669,14 @@ class Executor(object):
             loose_restrictions = set()
 
 
+        tasks = valmap(dumps_task, dsk)
+        if processes:
+            for task in tasks.values():
+                task['processes'] = True
+
         logger.debug("map(%s, ...)", funcname(func))
         self._send_to_scheduler({'op': 'update-graph',
-                                 'tasks': valmap(dumps_task, dsk),
+                                 'tasks': tasks,
                                  'dependencies': dependencies,
                                  'keys': keys,
                                  'restrictions': restrictions,
@@ -955,7 +1005,8 @@ class Executor(object):
         dsk2 = {name: (v._finalize, v._keys()) for name, v in zip(names, variables)}
 
         d = {k: unpack_remotedata(v) for k, v in merge(dsk, dsk2).items()}
-        dsk3 = {k: v[0] for k, v in d.items()}
+        dsk3 = {k: v[0] for k, v in d.items()
+                if (k == v[0]) is not True}
         dependencies = {k: v[1] for k, v in d.items()}
 
         for k, v in dsk3.items():
@@ -1025,7 +1076,8 @@ class Executor(object):
                     for opt, val in groups.items()])
 
         d = {k: unpack_remotedata(v) for k, v in dsk.items()}
-        dsk2 = {k: v[0] for k, v in d.items()}
+        dsk2 = {k: v[0] for k, v in d.items()
+                if (k == v[0]) is not True}
         dependencies = {k: v[1] for k, v in d.items()}
 
         for k, v in dsk2.items():
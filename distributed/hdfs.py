@@ -14,7 +14,7 @@ from toolz import merge
 
 from .compatibility import unicode
 from .executor import default_executor, ensure_default_get
-from .utils import ignoring, sync
+from .utils import ignoring, sync, io_bound
 
 
 logger = logging.getLogger(__name__)
@@ -34,6 +34,7 @@ def get_block_locations(hdfs, filename):
             for block in hdfs.get_block_locations(fn)]
 
 
+@io_bound
 def read_block_from_hdfs(filename, offset, length, host=None, port=None,
         delimiter=None):
     from hdfs3 import HDFileSystem
@@ -251,6 +252,7 @@ def read_avro(fn, executor=None, hdfs=None, lazy=True, **kwargs):
     return sync(executor.loop, _read_avro, fn, executor, hdfs, lazy, **kwargs)
 
 
+@io_bound
 def write_block_to_hdfs(fn, data, hdfs=None):
     """ Write bytes to HDFS """
     if not isinstance(data, bytes):
@@ -2,3 +2,4 @@ from __future__ import print_function, division, absolute_import
 
 from .worker import HTTPWorker
 from .scheduler import HTTPScheduler
+from .center import HTTPCenter
@@ -0,0 +1,29 @@
+from __future__ import print_function, division, absolute_import
+
+import logging
+
+from tornado import web
+
+from .core import RequestHandler, MyApp, Resources, Compression, Metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class Info(RequestHandler):
+    """Basic info about the center"""
+    def get(self):
+        resp = {'ncores': {'%s:%d' % k: n for k, n in self.server.ncores.items()},
+                'nkeys': len(self.server.who_has),
+                'status': self.server.status}
+        self.write(resp)
+
+
+def HTTPCenter(center):
+    application = MyApp(web.Application([
+        (r'/info.json', Info, {'server': center}),
+        (r'/resources.json', Resources, {'server': center}),
+        (r'/compression.json', Compression, {'server': center}),
+        (r'/metrics.json', Metrics, {'server': center})
+        ]))
+    return application
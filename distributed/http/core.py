@@ -52,6 +52,20 @@ class Resources(RequestHandler):
         self.write(resource_collect())
 
 
+class Compression(RequestHandler):
+    """Bytes saved and time spent compressing frames in this process"""
+    def get(self):
+        from .. import protocol
+        self.write(dict(protocol.compression_stats,
+                        compression=protocol.default_compression))
+
+
+class Metrics(RequestHandler):
+    """Call counts, bytes and latency histograms for each operation"""
+    def get(self):
+        self.write(self.server.get_metrics())
+
+
 class Proxy(RequestHandler):
     """Send REST call to specific worker return its response"""
     @gen.coroutine
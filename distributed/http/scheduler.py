@@ -7,7 +7,8 @@ import logging
 from tornado import web, gen
 from tornado.httpclient import AsyncHTTPClient
 
-from .core import RequestHandler, MyApp, Resources, Proxy
+from .core import (RequestHandler, MyApp, Resources, Proxy, Compression,
+        Metrics)
 from ..utils import key_split
 
 
@@ -68,14 +69,32 @@ class MemoryLoadByKey(RequestHandler):
         self.write(out)
 
 
+class TaskDurations(RequestHandler):
+    """Average seconds to compute tasks of each group"""
+    def get(self):
+        self.write(self.server.task_duration)
+
+
+class Occupancy(RequestHandler):
+    """Expected seconds of work queued and running on each worker"""
+    def get(self):
+        out = {"%s:%d" % worker: seconds
+               for worker, seconds in self.server.occupancy.items()}
+        self.write(out)
+
+
 def HTTPScheduler(scheduler):
     application = MyApp(web.Application([
         (r'/info.json', Info, {'server': scheduler}),
         (r'/resources.json', Resources, {'server': scheduler}),
+        (r'/compression.json', Compression, {'server': scheduler}),
+        (r'/metrics.json', Metrics, {'server': scheduler}),
         (r'/processing.json', Processing, {'server': scheduler}),
         (r'/proxy/([\w.-]+):(\d+)/(.+)', Proxy),
         (r'/broadcast/(.+)', Broadcast, {'server': scheduler}),
         (r'/memory-load.json', MemoryLoad, {'server': scheduler}),
         (r'/memory-load-by-key.json', MemoryLoadByKey, {'server': scheduler}),
+        (r'/task-durations.json', TaskDurations, {'server': scheduler}),
+        (r'/occupancy.json', Occupancy, {'server': scheduler}),
         ]))
     return application
@@ -0,0 +1,32 @@
+import json
+
+from tornado.httpclient import AsyncHTTPClient
+
+from distributed import Center
+from distributed.core import rpc
+from distributed.utils_test import gen_test
+from distributed.http.center import HTTPCenter
+
+
+@gen_test()
+def test_simple():
+    c = Center(ip='127.0.0.1', services={'http': HTTPCenter})
+    c.listen(0)
+    server = c.services['http']
+    client = AsyncHTTPClient()
+
+    r = rpc(ip='127.0.0.1', port=c.port)
+    yield r.register(address=('127.0.0.1', 8000), keys=['x'], ncores=2)
+
+    response = yield client.fetch('http://localhost:%d/info.json' % server.port)
+    response = json.loads(response.body.decode())
+    assert response['ncores'] == {'127.0.0.1:8000': 2}
+    assert response['nkeys'] == 1
+
+    response = yield client.fetch('http://localhost:%d/metrics.json' %
+                                  server.port)
+    response = json.loads(response.body.decode())
+    assert response['ops']['register']['count'] == 1
+
+    r.close_streams()
+    yield c.terminate()
@@ -133,3 +133,45 @@ def test_with_data(s, a, b):
 
     ss.stop()
     yield e._shutdown()
+
+
+@gen_cluster()
+def test_metrics(s, a, b):
+    server = HTTPScheduler(s)
+    server.listen(0)
+    client = AsyncHTTPClient()
+
+    response = yield client.fetch('http://localhost:%d/metrics.json' %
+                                  server.port)
+    response = json.loads(response.body.decode())
+    assert response['ops']['register']['count'] == 2
+    assert len(response['buckets']) == len(response['ops']['register']['handler']) - 1
+
+    server.stop()
+
+
+@gen_cluster()
+def test_task_durations_and_occupancy(s, a, b):
+    server = HTTPScheduler(s)
+    server.listen(0)
+    client = AsyncHTTPClient()
+
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    L = e.map(inc, range(10))
+    yield _wait(L)
+
+    response = yield client.fetch('http://localhost:%d/task-durations.json' %
+                                  server.port)
+    response = json.loads(response.body.decode())
+    assert list(response) == ['inc']
+    assert 0 <= response['inc'] < 1
+
+    response = yield client.fetch('http://localhost:%d/occupancy.json' %
+                                  server.port)
+    response = json.loads(response.body.decode())
+    assert response == {a.address_string: 0, b.address_string: 0}
+
+    server.stop()
+    yield e._shutdown()
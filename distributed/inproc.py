@@ -0,0 +1,147 @@
+"""
+In-process transport between servers and clients sharing one event loop
+
+Servers that listen on ``'inproc://'`` register themselves in a process-local
+table instead of opening a socket.  Their address is a normal ``(ip, port)``
+pair whose ip starts with ``inproc://``, so it travels through the scheduler,
+center and workers like any other address.  Connecting to such an address
+gives an ``InProcStream``: a pair of in-memory queues over which ``read`` and
+``write`` pass Python objects directly, without serialization.
+
+This is meant for a Scheduler, Workers and an Executor running on the same
+IOLoop, as in tests and small local jobs.
+
+>>> server.listen('inproc://')  # doctest: +SKIP
+>>> server.ip, server.port  # doctest: +SKIP
+('inproc://12345', 1)
+>>> yield rpc(ip=server.ip, port=server.port).ping()  # doctest: +SKIP
+b'pong'
+"""
+from __future__ import print_function, division, absolute_import
+
+from itertools import count
+import logging
+import os
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue
+
+from .compatibility import string_types
+
+logger = logging.getLogger(__name__)
+
+
+PREFIX = 'inproc://'
+
+servers = dict()  # {(ip, port): Server}
+_ports = count(1)
+_clients = count(1)
+_closed = object()  # sentinel put on a queue when its stream closes
+
+
+def is_inproc(ip):
+    """ Does this address refer to an in-process server?
+
+    >>> is_inproc('inproc://123')
+    True
+    >>> is_inproc('127.0.0.1')
+    False
+    """
+    return isinstance(ip, string_types) and ip.startswith(PREFIX)
+
+
+def new_address():
+    """ A fresh in-process address for a server to listen on """
+    return (PREFIX + str(os.getpid()), next(_ports))
+
+
+def _copy(msg):
+    """ Shallow copy messages so that receivers may pop from them freely """
+    if type(msg) is dict:
+        return msg.copy()
+    if type(msg) is list:
+        return [m.copy() if type(m) is dict else m for m in msg]
+    return msg
+
+
+class InProcStream(object):
+    """ One end of an in-memory connection
+
+    Messages written to one end are read from the other, in order.  After
+    one end closes, reads on it raise ``StreamClosedError`` and the other end
+    raises once it has read all pending messages.
+
+    See Also
+    --------
+    stream_pair
+    """
+    def __init__(self):
+        self.queue = Queue()
+        self.peer = None
+        self._closed = False
+
+    def closed(self):
+        return self._closed
+
+    def write_msg(self, msg):
+        """ Send a message to the other end
+
+        Returns a finished future for symmetry with ``IOStream.write``
+        """
+        if self._closed or self.peer._closed:
+            raise StreamClosedError()
+        self.peer.queue.put_nowait(_copy(msg))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    @gen.coroutine
+    def read_msg(self):
+        """ Receive the next message from the other end """
+        if self._closed:
+            raise StreamClosedError()
+        msg = yield self.queue.get()
+        if msg is _closed:
+            self._closed = True
+            raise StreamClosedError()
+        raise gen.Return(msg)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.queue.put_nowait(_closed)  # wake up our own pending reads
+            if not self.peer._closed:
+                self.peer.queue.put_nowait(_closed)
+
+
+def stream_pair():
+    """ Two connected ends of an in-memory stream
+
+    >>> a, b = stream_pair()
+    >>> _ = a.write_msg({'op': 'ping'})
+    >>> b.queue.get_nowait()
+    {'op': 'ping'}
+    """
+    a, b = InProcStream(), InProcStream()
+    a.peer, b.peer = b, a
+    return a, b
+
+
+def connect(ip, port):
+    """ Connect to the in-process server at ``(ip, port)``
+
+    The server handles its end of the stream on the current IOLoop.  Raises
+    ``StreamClosedError`` if no such server is listening, like a refused
+    TCP connection.
+    """
+    try:
+        server = servers[(ip, port)]
+    except KeyError:
+        raise StreamClosedError("No in-process server at %s:%d" % (ip, port))
+    client, remote = stream_pair()
+    IOLoop.current().add_callback(server.handle_stream, remote,
+                                  ('inproc', next(_clients)))
+    return client
@@ -2,9 +2,12 @@ from __future__ import print_function, division, absolute_import
 
 from datetime import datetime, timedelta
 import logging
+import multiprocessing
 from multiprocessing import Process, Queue, queues
 import os
 import shutil
+import signal
+import sys
 import tempfile
 
 from tornado.ioloop import IOLoop
@@ -23,11 +26,17 @@ class Nanny(Server):
     them as necessary.
     """
     def __init__(self, center_ip, center_port, ip=None,
-                ncores=None, loop=None, local_dir=None, services=None, **kwargs):
+                ncores=None, loop=None, local_dir=None, services=None,
+                memory_limit=None, compressed_limit=0, processes=False,
+                io_threads=16, **kwargs):
         self.ip = ip or get_ip()
         self.worker_port = None
         self.ncores = ncores
         self.local_dir = local_dir
+        self.memory_limit = memory_limit
+        self.compressed_limit = compressed_limit
+        self.processes = processes
+        self.io_threads = io_threads
         self.worker_dir = ''
         self.status = None
         self.process = None
@@ -99,7 +108,9 @@ class Nanny(Server):
         self.process = Process(target=run_worker,
                                args=(q, self.ip, self.center.ip,
                                      self.center.port, self.ncores,
-                                     self.port, self.local_dir, self.services))
+                                     self.port, self.local_dir, self.services,
+                                     self.memory_limit, self.compressed_limit,
+                                     self.processes, self.io_threads))
         self.process.daemon = True
         self.process.start()
         while True:
@@ -177,17 +188,29 @@ class Nanny(Server):
             yield gen.sleep(interval)
 
 
+def _terminate_worker(signum, frame):
+    """ Take the worker's process pool down with it when killed """
+    for child in multiprocessing.active_children():  # pragma: no cover
+        child.terminate()  # pragma: no cover
+    sys.exit(0)  # pragma: no cover
+
+
 def run_worker(q, ip, center_ip, center_port, ncores, nanny_port,
-        local_dir, services):
+        local_dir, services, memory_limit=None, compressed_limit=0,
+        processes=False, io_threads=16):
     """ Function run by the Nanny when creating the worker """
     from distributed import Worker  # pragma: no cover
     from tornado.ioloop import IOLoop  # pragma: no cover
+    signal.signal(signal.SIGTERM, _terminate_worker)  # pragma: no cover
     IOLoop.clear_instance()  # pragma: no cover
     loop = IOLoop()  # pragma: no cover
     loop.make_current()  # pragma: no cover
     worker = Worker(center_ip, center_port, ncores=ncores, ip=ip,
                     service_ports={'nanny': nanny_port}, local_dir=local_dir,
-                    services=services)  # pragma: no cover
+                    services=services, memory_limit=memory_limit,
+                    compressed_limit=compressed_limit,
+                    processes=processes,
+                    io_threads=io_threads)  # pragma: no cover
 
     @gen.coroutine  # pragma: no cover
     def start():
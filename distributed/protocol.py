@@ -0,0 +1,386 @@
+"""
+Serialize messages into sequences of frames
+
+The first frame of every message is a single header byte that selects the
+serializer used for the message in the second frame:
+
+*  ``msgpack``: plain control messages built from dicts, lists, tuples, sets,
+   strings, bytes and numbers.  This is much faster than pickle for the small
+   messages that dominate traffic between scheduler, workers and executors.
+   Used only when ``msgpack`` is importable.
+*  ``pickle``: everything else, such as user functions and data
+
+Large frames are compressed when a sample of them compresses well.  We use
+lz4 or blosc when importable.  zlib is built in and may be selected with
+``default_compression``.  ``compression_stats`` records bytes saved and time
+spent.
+
+Within pickled messages, objects of types registered with
+``register_serialization`` are serialized by their own functions and their
+buffers are sent as separate frames.  Large NumPy arrays, including those
+inside pandas objects, are handled this way so that on the receiving side we
+rebuild the arrays directly on top of those frames.  ``core.read_frames``
+reads large frames into writable buffers, so these arrays are writable
+without another copy.  Arrays on top of immutable frames, such as the output
+of decompression, are copied.
+
+>>> frames = dumps({'op': 'ping'})
+>>> len(frames)
+2
+>>> loads(frames)
+{'op': 'ping'}
+"""
+from __future__ import print_function, division, absolute_import
+
+from io import BytesIO
+import logging
+import pickle
+from time import time
+import zlib
+
+import cloudpickle
+
+from .compatibility import byte_view
+from .utils import ignoring, nbytes
+
+logger = logging.getLogger(__name__)
+
+
+PICKLE = b'\x00'
+MSGPACK = b'\x01'
+
+FRAME_SIZE_THRESHOLD = 2**16  # arrays smaller than this stay in the pickle
+
+
+msgpack = None
+with ignoring(ImportError):
+    import msgpack
+    if msgpack.version < (0, 5, 0):  # no strict_types
+        msgpack = None
+
+_TUPLE = 1
+_SET = 2
+_FROZENSET = 3
+
+
+def _msgpack_default(o):
+    """ Encode tuples and sets, which msgpack doesn't support natively """
+    if type(o) is tuple:
+        return msgpack.ExtType(_TUPLE, _packb(list(o)))
+    if type(o) is set:
+        return msgpack.ExtType(_SET, _packb(list(o)))
+    if type(o) is frozenset:
+        return msgpack.ExtType(_FROZENSET, _packb(list(o)))
+    raise TypeError("Can not msgpack %s" % type(o).__name__)
+
+
+def _msgpack_ext_hook(code, data):
+    if code == _TUPLE:
+        return tuple(_unpackb(data))
+    if code == _SET:
+        return set(_unpackb(data))
+    if code == _FROZENSET:
+        return frozenset(_unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+def _packb(o):
+    return msgpack.packb(o, use_bin_type=True, strict_types=True,
+                         default=_msgpack_default)
+
+
+if msgpack is not None and msgpack.version >= (1, 0, 0):
+    _unpack_kwargs = {'raw': False, 'strict_map_key': False}
+else:
+    _unpack_kwargs = {'encoding': 'utf-8'}
+
+
+def _unpackb(b):
+    return msgpack.unpackb(b, ext_hook=_msgpack_ext_hook, use_list=True,
+                           **_unpack_kwargs)
+
+
+compressions = {None: {'code': b'\x00',
+                        'compress': lambda b: b,
+                        'decompress': lambda b: b},
+                'zlib': {'code': b'\x01',
+                         'compress': lambda b: zlib.compress(b, 1),
+                         'decompress': zlib.decompress}}
+
+with ignoring(ImportError):
+    import lz4
+    try:
+        from lz4.block import compress as lz4_compress, decompress as lz4_decompress
+    except ImportError:  # older versions of lz4
+        lz4_compress, lz4_decompress = lz4.LZ4_compress, lz4.LZ4_uncompress
+    compressions['lz4'] = {'code': b'\x02',
+                           'compress': lz4_compress,
+                           'decompress': lz4_decompress}
+
+with ignoring(ImportError):
+    import blosc
+    compressions['blosc'] = {'code': b'\x03',
+                             'compress': lambda b: blosc.compress(b, typesize=8),
+                             'decompress': blosc.decompress}
+
+decompressions = {v['code']: v['decompress'] for v in compressions.values()}
+
+# Fast compressors are used by default.  Set to 'zlib' to trade CPU for
+# bandwidth or to None to turn compression off.
+default_compression = ('lz4' if 'lz4' in compressions else
+                       'blosc' if 'blosc' in compressions else None)
+
+COMPRESSION_SIZE_THRESHOLD = 10000  # don't compress frames smaller than this
+COMPRESSION_SAMPLE_SIZE = 10000     # bytes compressed to estimate the ratio
+COMPRESSION_MAX_SIZE = 2**31 - 1    # lz4 and blosc can't handle larger frames
+COMPRESSION_MIN_RATIO = 0.9         # send uncompressed unless this much smaller
+
+no_default = '__no_default__'
+
+compression_stats = {'frames-compressed': 0,
+                     'frames-not-compressed': 0,
+                     'bytes-before-compression': 0,
+                     'bytes-after-compression': 0,
+                     'compress-time': 0.0,
+                     'decompress-time': 0.0}
+
+
+def maybe_compress(frame, compression=no_default):
+    """ Compress a frame if it is large and compressible
+
+    We first compress a small sample from the middle of the frame.  Only if
+    that compresses well do we compress the full frame.  Returns the
+    compression code and the possibly compressed frame.
+
+    >>> code, frame = maybe_compress(b'0' * 100000, 'zlib')
+    >>> code, len(frame) < 1000
+    (b'\\x01', True)
+    >>> code, frame = maybe_compress(b'0' * 100, 'zlib')  # too small
+    >>> code, frame == b'0' * 100
+    (b'\\x00', True)
+    """
+    if compression is no_default:
+        compression = default_compression
+    n = nbytes(frame)
+    if (compression is None or n < COMPRESSION_SIZE_THRESHOLD or
+            n > COMPRESSION_MAX_SIZE):
+        return compressions[None]['code'], frame
+
+    compress = compressions[compression]['compress']
+    start = time()
+    if isinstance(frame, memoryview):
+        frame = byte_view(frame)
+    mid = n // 2
+    sample = frame[mid: mid + COMPRESSION_SAMPLE_SIZE]
+    result = None
+    if len(compress(sample)) < COMPRESSION_MIN_RATIO * nbytes(sample):
+        compressed = compress(frame)
+        if len(compressed) < COMPRESSION_MIN_RATIO * n:
+            result = compressed
+    compression_stats['compress-time'] += time() - start
+
+    if result is None:
+        compression_stats['frames-not-compressed'] += 1
+        return compressions[None]['code'], frame
+    else:
+        compression_stats['frames-compressed'] += 1
+        compression_stats['bytes-before-compression'] += n
+        compression_stats['bytes-after-compression'] += len(result)
+        return compressions[compression]['code'], result
+
+
+def decompress(code, frame):
+    """ Decompress a frame given its compression code
+
+    See Also
+    --------
+    maybe_compress
+    """
+    if code == compressions[None]['code']:
+        return frame
+    start = time()
+    result = decompressions[code](frame)
+    compression_stats['decompress-time'] += time() - start
+    return result
+
+
+serializers = dict()
+deserializers = dict()
+
+
+def register_serialization(cls, serialize, deserialize, name=None):
+    """ Register custom serialization for a type
+
+    Parameters
+    ----------
+    cls: type
+    serialize: function
+        Takes an object of type ``cls`` and returns a picklable header and a
+        list of bytes-like frames.  May return ``None`` to fall back to
+        ordinary pickling for that object.
+    deserialize: function
+        Takes the header and list of frames and returns the object
+    name: str, optional
+        Name under which the deserializer is found on the receiving side.
+        Defaults to the fully qualified type name.
+
+    Examples
+    --------
+    >>> class Human(object):
+    ...     def __init__(self, name):
+    ...         self.name = name
+
+    >>> def serialize(h):
+    ...     return {}, [h.name.encode()]
+
+    >>> def deserialize(header, frames):
+    ...     return Human(bytes(frames[0]).decode())
+
+    >>> register_serialization(Human, serialize, deserialize)
+    >>> loads(dumps(Human('Alice'))).name
+    'Alice'
+    """
+    if name is None:
+        name = '%s.%s' % (cls.__module__, cls.__name__)
+    serializers[cls] = (name, serialize)
+    deserializers[name] = deserialize
+
+
+class FramePickler(cloudpickle.CloudPickler):
+    """ Pickler that hands registered types to their own serializers
+
+    The buffers produced by those serializers are appended to ``frames`` and
+    replaced in the pickle by a small persistent id.
+    """
+    def __init__(self, file, frames):
+        cloudpickle.CloudPickler.__init__(self, file,
+                                          protocol=pickle.HIGHEST_PROTOCOL)
+        self.frames = frames
+
+    def persistent_id(self, obj):
+        try:
+            name, serialize = serializers[type(obj)]
+        except KeyError:
+            return None
+        result = serialize(obj)
+        if result is None:
+            return None
+        header, frames = result
+        start = len(self.frames)
+        self.frames.extend(frames)
+        return (name, header, start, len(self.frames))
+
+
+class FrameUnpickler(pickle.Unpickler):
+    """ Unpickler that rebuilds registered types from out-of-band frames
+
+    See Also
+    --------
+    FramePickler
+    """
+    def __init__(self, file, frames):
+        pickle.Unpickler.__init__(self, file)
+        self.frames = frames
+
+    def persistent_load(self, pid):
+        name, header, start, stop = pid
+        try:
+            deserialize = deserializers[name]
+        except KeyError:
+            raise pickle.UnpicklingError("No deserializer for %s" % name)
+        return deserialize(header, self.frames[start:stop])
+
+
+def dumps(msg, compression=no_default):
+    """ Serialize a message into a list of frames
+
+    The first frame is a header.  Its first byte names the serializer and, if
+    any frame was compressed, one further byte per frame names the compression
+    used for that frame.  The second frame holds the serialized message.  Any
+    further frames hold buffers from registered serializers referenced from
+    within that message.  Frames are compressed with ``default_compression``
+    unless ``compression`` names another compressor or is ``None``.
+
+    See Also
+    --------
+    loads
+    maybe_compress
+    """
+    frames = None
+    if msgpack is not None:
+        try:
+            frames = [MSGPACK, _packb(msg)]
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if frames is None:
+        try:
+            frames = [PICKLE, None]
+            f = BytesIO()
+            FramePickler(f, frames).dump(msg)
+            frames[1] = f.getvalue()
+        except Exception as e:
+            logger.info("Failed to serialize %s", msg, exc_info=True)
+            raise
+
+    codes, frames[1:] = zip(*[maybe_compress(frame, compression)
+                              for frame in frames[1:]])
+    if any(code != compressions[None]['code'] for code in codes):
+        frames[0] = frames[0] + b''.join(codes)
+    return frames
+
+
+def loads(frames):
+    """ Deserialize a list of frames into a message
+
+    See Also
+    --------
+    dumps
+    """
+    header = bytes(frames[0])
+    if len(header) > 1:
+        frames = [header] + [decompress(header[i:i + 1], frame)
+                             for i, frame in enumerate(frames[1:], 1)]
+        header = header[:1]
+    try:
+        if header == MSGPACK:
+            return _unpackb(frames[1])
+        elif header == PICKLE:
+            return FrameUnpickler(BytesIO(frames[1]), frames).load()
+        else:
+            raise ValueError("Unknown message header %r" % header)
+    except Exception as e:
+        logger.info("Failed to deserialize %s",
+                    frames[1 if len(frames) > 1 else 0][:1000], exc_info=True)
+        raise
+
+
+with ignoring(ImportError):
+    import numpy as np
+
+    def serialize_numpy_ndarray(x):
+        """ Send large contiguous arrays as a single raw frame """
+        if (x.nbytes < FRAME_SIZE_THRESHOLD or x.dtype.hasobject or
+                not (x.flags.c_contiguous or x.flags.f_contiguous)):
+            return None
+        order = 'C' if x.flags.c_contiguous else 'F'
+        data = x.ravel(order='K').view(np.uint8)
+        return (x.dtype, x.shape, order), [memoryview(data)]
+
+    def deserialize_numpy_ndarray(header, frames):
+        """ Rebuild an array on top of its frame
+
+        Frames read off the network are writable and used as they are.
+        Immutable frames, like decompressed bytestrings, are copied so that
+        tasks may modify their inputs in place.
+        """
+        dtype, shape, order = header
+        x = np.frombuffer(frames[0], dtype=dtype)
+        if not x.flags.writeable:
+            x = x.copy()
+        return x.reshape(shape, order=order)
+
+    register_serialization(np.ndarray, serialize_numpy_ndarray,
+                           deserialize_numpy_ndarray)
+    # Arrays spilled to disk by workers come back as memory maps
+    register_serialization(np.memmap, serialize_numpy_ndarray,
+                           deserialize_numpy_ndarray, name='numpy.ndarray')
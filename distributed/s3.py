@@ -11,6 +11,7 @@ from dask.imperative import Value
 
 from .compatibility import get_thread_identity
 from .executor import default_executor, ensure_default_get
+from .utils import io_bound
 
 
 logger = logging.getLogger(__name__)
@@ -65,6 +66,7 @@ def get_list_of_summary_objects(bucket_name, prefix='', delimiter='',
     return [s for s in L if s.key[-1] != '/']
 
 
+@io_bound
 def read_content_from_keys(bucket, key, anon=None):
     if bucket.startswith('s3://'):
         bucket = bucket[len('s3://'):]
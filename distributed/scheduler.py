@@ -1,15 +1,16 @@
 from __future__ import print_function, division, absolute_import
 
-from collections import defaultdict, deque
+from collections import defaultdict, deque, Set
 from datetime import datetime
 from functools import partial
+import hashlib
 import logging
 from math import ceil
 import socket
 from time import time
 import uuid
 
-from toolz import frequencies, memoize, concat, identity, valmap
+from toolz import frequencies, memoize, concat, identity, valmap, dissoc
 from tornado import gen
 from tornado.gen import Return
 from tornado.queues import Queue
@@ -20,12 +21,15 @@ from dask.compatibility import apply
 from dask.core import get_deps, reverse_dict, istask
 from dask.order import order
 
-from .core import (rpc, coerce_to_rpc, connect, read, write, MAX_BUFFER_SIZE,
-        Server, send_recv, dumps)
+from .core import (coerce_to_rpc, connect, read, write, MAX_BUFFER_SIZE,
+        Server, dumps, connection_pool)
+from .batched import BatchedStream
 from .client import (unpack_remotedata, scatter_to_workers,
         gather_from_workers, broadcast_to_workers)
+from .tasktable import TaskTable
 from .utils import (All, ignoring, clear_queue, _deps, get_ip,
-        ignore_exceptions, ensure_ip, get_traceback, truncate_exception)
+        ignore_exceptions, ensure_ip, get_traceback, truncate_exception,
+        key_split)
 
 
 logger = logging.getLogger(__name__)
@@ -68,6 +72,13 @@ class Scheduler(Server):
     * **tasks:** ``{key: task}``:
         Dictionary mapping key to task, either dask task, or serialized dict
         like: ``{'function': b'xxx', 'args': b'xxx'}`` or ``{'task': b'xxx'}``
+        Fields sent as content hashes are listed under ``'hashes'``, like
+        ``{'hashes': {'function': 'a94a8fe5...'}, 'args': b'xxx'}``
+    * **blobs:** ``{hash: bytes}``:
+        Serialized functions and large arguments referred to by tasks'
+        ``'hashes'``.  Workers fetch these once and cache them.
+    * **blob_refs:** ``{hash: int}``:
+        Number of tasks referring to each blob.  Blobs go once this is zero.
     * **dependencies:** ``{key: {key}}``:
         Dictionary showing which keys depend on which others
     * **dependents:** ``{key: {key}}``:
@@ -85,6 +96,7 @@ class Scheduler(Server):
         E.g. ``{('192.168.1.100', 8000): {'http': 9001, 'nanny': 9002}}``
     * **who_has:** ``{key: {worker}}``:
         Where each key lives.  The current state of distributed memory.
+        Includes replicas that workers kept after fetching dependencies.
     * **has_what:** ``{worker: {key}}``:
         What worker has what keys.  The transpose of who_has.
     * **who_wants:** ``{key: {client}}``:
@@ -94,14 +106,60 @@ class Scheduler(Server):
     * **nbytes:** ``{key: int}``:
         Number of bytes for a key as reported by workers holding that key.
     * **processing:** ``{worker: {keys}}``:
-        Set of keys currently in execution on each worker
+        Set of keys sent to each worker and not yet finished, at most
+        ``oversubscription`` per core plus one per I/O thread
     * **stacks:** ``{worker: [keys]}``:
         List of keys waiting to be sent to each worker
+    * **io_stacks:** ``{worker: [keys]}``:
+        Like stacks, but for I/O-bound keys.  These go out up to the number
+        of the worker's I/O threads and don't count against its cores
+    * **io_keys:** ``{key}``:
+        Keys whose tasks are tagged as I/O-bound, like reads from S3 or HDFS
+    * **io_threads:** ``{worker: int}``:
+        Number of threads each worker keeps for I/O-bound tasks
+    * **oversubscription:** ``int``:
+        Number of tasks per core sent to a worker ahead of their execution
+    * **steal:** ``bool``:
+        Whether workers with free cores and empty stacks take tasks from the
+        bottom of the longest stack.  See ``Scheduler.steal_work``.
+    * **table:** ``TaskTable`` or ``None``:
+        With ``compact_state=True``, ``tasks``, ``dependencies``,
+        ``dependents``, ``waiting``, ``waiting_data``, ``keyorder`` and
+        ``in_play`` are views onto this table rather than dicts and sets.
+        This takes about a third of the memory per key, for graphs of
+        millions of tasks, but makes every transition slower.
+    * **idle:** ``{worker}``:
+        Workers with free slots and nothing on their stacks
+    * **task_duration:** ``{key-prefix: float}``:
+        Running average of the seconds taken to compute tasks of each group,
+        as given by ``utils.key_split`` and reported by workers.  Tasks of
+        groups not yet seen count as ``DEFAULT_TASK_DURATION``.
+    * **occupancy:** ``{worker: float}``:
+        Expected seconds of work on each worker's stack and in processing,
+        excluding I/O-bound tasks
+    * **durations:** ``{worker: {key: float}}``:
+        The expected seconds that each key added to its worker's occupancy.
+        We subtract the same amount when the key leaves, even if
+        ``task_duration`` has changed in the meantime.
+    * **stolen:** ``{key: (victim, thief)}``:
+        Keys moved between stacks by work stealing and not yet finished
+    * **steal_counts:** ``{str: int}``:
+        Number of ``steals``, keys ``stolen``, keys ``rejected`` as too
+        expensive to move, and stolen keys ``finished`` on the thief
+    * **steal_log:** ``deque([(time, victim, thief, nkeys)])``:
+        Recent steals
     * **retrictions:** ``{key: {hostnames}}``:
         A set of hostnames per key of where that key can be run.  Usually this
         is empty unless a key has been specifically restricted to only run on
         certain hosts.  These restrictions don't include a worker port.  Any
         worker on that hostname is deemed valid.
+    * **restriction_sets:** ``{frozenset: frozenset}``:
+        Restrictions as sent by clients, mapped to the same hostnames
+        resolved to IP addresses.  Keys with equal restrictions share one
+        resolved set.
+    * **hosts:** ``{hostname: {worker}}``:
+        Workers on each host, for finding the workers that satisfy
+        restrictions
     * **loose_retrictions:** ``{key}``:
         Set of keys for which we are allow to violate restrictions (see above)
         if not valid workers are present.
@@ -114,9 +172,9 @@ class Scheduler(Server):
         A list of Tornado Queues from which we accept stimuli
     * **report_queues:** ``[Queues]``:
         A list of Tornado Queues on which we report results
-    * **streams:** ``[IOStreams]``:
-        A list of Tornado IOStreams from which we both accept stimuli and
-        report results
+    * **streams:** ``{client: BatchedStream}``:
+        Streams to clients from which we both accept stimuli and report
+        results.  Reports are batched over a few milliseconds.
     * **coroutines:** ``[Futures]``:
         A list of active futures that control operation
     *  **exceptions:** ``{key: Exception}``:
@@ -133,7 +191,8 @@ class Scheduler(Server):
     def __init__(self, center=None, loop=None,
             resource_interval=1, resource_log_size=1000,
             max_buffer_size=MAX_BUFFER_SIZE, delete_interval=500,
-            ip=None, services=None, **kwargs):
+            ip=None, services=None, oversubscription=4, steal=True,
+            compact_state=False, **kwargs):
         self.scheduler_queues = [Queue()]
         self.report_queues = []
         self.streams = dict()
@@ -141,28 +200,55 @@ class Scheduler(Server):
         self.coroutines = []
         self.ip = ip or get_ip()
         self.delete_interval = delete_interval
+        self.oversubscription = oversubscription
+        self.steal = steal
 
         if center:
             self.center = coerce_to_rpc(center)
         else:
             self.center = None
 
-        self.tasks = dict()
-        self.dependencies = dict()
-        self.dependents = dict()
+        if compact_state:
+            self.table = TaskTable()
+            self.tasks = self.table.tasks
+            self.dependencies = self.table.dependencies
+            self.dependents = self.table.dependents
+            self.in_play = self.table.in_play
+            self.keyorder = self.table.keyorder
+            self.waiting = self.table.waiting
+            self.waiting_data = self.table.waiting_data
+        else:
+            self.table = None
+            self.tasks = dict()
+            self.dependencies = dict()
+            self.dependents = dict()
+            self.in_play = set()
+            self.keyorder = dict()
+            self.waiting = dict()
+            self.waiting_data = dict()
+        self.blobs = dict()
+        self.blob_refs = defaultdict(int)
         self.generation = 0
         self.has_what = defaultdict(set)
-        self.in_play = set()
-        self.keyorder = dict()
         self.nbytes = dict()
         self.ncores = dict()
         self.worker_services = defaultdict(dict)
         self.processing = dict()
         self.restrictions = dict()
+        self.restriction_sets = dict()
+        self.hosts = defaultdict(set)
         self.loose_restrictions = set()
         self.stacks = dict()
-        self.waiting = dict()
-        self.waiting_data = dict()
+        self.io_stacks = dict()
+        self.io_keys = set()
+        self.io_threads = dict()
+        self.idle = set()
+        self.task_duration = dict()
+        self.occupancy = dict()
+        self.durations = dict()
+        self.stolen = dict()
+        self.steal_counts = defaultdict(int)
+        self.steal_log = deque(maxlen=1000)
         self.who_has = defaultdict(set)
         self.deleted_keys = defaultdict(set)
         self.who_wants = defaultdict(set)
@@ -178,8 +264,6 @@ class Scheduler(Server):
         self.resource_interval = resource_interval
         self.resource_log_size = resource_log_size
 
-        self._rpcs = dict()
-
         self.plugins = []
 
         self.compute_handlers = {'update-graph': self.update_graph,
@@ -198,6 +282,7 @@ class Scheduler(Server):
                          'terminate': self.close,
                          'broadcast': self.broadcast,
                          'ncores': self.get_ncores,
+                         'get_blobs': self.get_blobs,
                          'has_what': self.get_has_what,
                          'who_has': self.get_who_has}
 
@@ -210,10 +295,8 @@ class Scheduler(Server):
                 max_buffer_size=max_buffer_size, **kwargs)
 
     def rpc(self, ip, port):
-        """ Cached rpc objects """
-        if (ip, port) not in self._rpcs:
-            self._rpcs[(ip, port)] = rpc(ip=ip, port=port)
-        return self._rpcs[(ip, port)]
+        """ rpc-like objects backed by the shared connection pool """
+        return connection_pool()(ip=ip, port=port)
 
     @property
     def address(self):
@@ -246,12 +329,20 @@ class Scheduler(Server):
         collections = [self.tasks, self.dependencies, self.dependents,
                 self.waiting, self.waiting_data, self.in_play, self.keyorder,
                 self.nbytes, self.processing, self.restrictions,
-                self.loose_restrictions]
+                self.loose_restrictions, self.restriction_sets,
+                self.io_keys, self.blobs, self.blob_refs, self.stolen]
         for collection in collections:
             collection.clear()
 
         self.processing = {addr: set() for addr in self.ncores}
         self.stacks = {addr: list() for addr in self.ncores}
+        self.io_stacks = {addr: list() for addr in self.ncores}
+        self.occupancy = {addr: 0 for addr in self.ncores}
+        self.durations = {addr: dict() for addr in self.ncores}
+        self.idle = set(self.ncores)
+        self.hosts.clear()
+        for addr in self.ncores:
+            self.hosts[addr[0]].add(addr)
 
         self.worker_queues = {addr: Queue() for addr in self.ncores}
 
@@ -318,9 +409,8 @@ class Scheduler(Server):
         self.status = 'closing'
         logger.debug("Cleaning up coroutines")
         n = 0
-        for w, nc in self.ncores.items():
-            for i in range(nc):
-                self.worker_queues[w].put_nowait({'op': 'close'}); n += 1
+        for w in self.ncores:
+            self.worker_queues[w].put_nowait({'op': 'close'}); n += 1
 
         for s in self.scheduler_queues[1:]:
             s.put_nowait({'op': 'close-stream'})
@@ -340,15 +430,20 @@ class Scheduler(Server):
         Scheduler.ensure_occupied
         """
         logger.debug("Mark %s ready to run", key)
-        if key in self.waiting:
-            assert not self.waiting[key]
-            del self.waiting[key]
-
-        new_worker = decide_worker(self.dependencies, self.stacks,
-                self.who_has, self.restrictions, self.loose_restrictions,
-                self.nbytes, key)
-
-        self.stacks[new_worker].append(key)
+        s = self.waiting.pop(key, None)
+        assert not s
+
+        if key in self.io_keys:
+            new_worker = decide_worker(self.dependencies, self.io_stacks,
+                    self.who_has, self.restrictions, self.loose_restrictions,
+                    self.nbytes, key, hosts=self.hosts)
+            self.io_stacks[new_worker].append(key)
+        else:
+            new_worker = decide_worker(self.dependencies, self.stacks,
+                    self.who_has, self.restrictions, self.loose_restrictions,
+                    self.nbytes, key, self.occupancy, self.ncores, self.hosts)
+            self.stacks[new_worker].append(key)
+            self.add_occupancy(new_worker, key)
         self.ensure_occupied(new_worker)
 
     def mark_key_in_memory(self, key, workers=None, type=None):
@@ -361,21 +456,20 @@ class Scheduler(Server):
             self.has_what[worker].add(key)
             with ignoring(KeyError):
                 self.processing[worker].remove(key)
+                self.release_occupancy(worker, key)
 
         for dep in sorted(self.dependents.get(key, []), key=self.keyorder.get,
                           reverse=True):
-            if dep in self.waiting:
-                s = self.waiting[dep]
-                with ignoring(KeyError):
-                    s.remove(key)
+            s = self.waiting.get(dep)
+            if s is not None:
+                s.discard(key)
                 if not s:  # new task ready to run
                     self.mark_ready_to_run(dep)
 
         for dep in self.dependencies.get(key, []):
-            if dep in self.waiting_data:
-                s = self.waiting_data[dep]
-                with ignoring(KeyError):
-                    s.remove(key)
+            s = self.waiting_data.get(dep)
+            if s is not None:
+                s.discard(key)
                 if not s and dep and dep not in self.who_wants:
                     self.delete_data(keys=[dep])
 
@@ -386,22 +480,175 @@ class Scheduler(Server):
             msg['type'] = type
         self.report(msg)
 
-    def ensure_occupied(self, worker):
-        """ Send tasks to worker while it has tasks and free cores """
+    def ensure_occupied(self, worker, victim=None):
+        """ Send tasks to worker while it has tasks and free slots
+
+        Each worker gets up to ``oversubscription`` tasks per core so that it
+        always has the next tasks at hand while results travel back.
+        I/O-bound tasks run in their own threads on the worker.  They go out
+        separately, one per I/O thread, so that many downloads can be in
+        flight while the cores stay busy.
+
+        A worker with free slots and nothing left on its stack steals work
+        from ``victim`` or from the longest stack.  A worker that still has
+        tasks on its stack after filling its slots offers them to an idle
+        worker.
+        """
+        while worker is not None:
+            worker, victim = self._ensure_occupied(worker, victim)
+
+    def _ensure_occupied(self, worker, victim=None):
+        """ Fill one worker's free slots
+
+        Returns an idle worker and the victim it should steal from next, or
+        ``(None, None)`` when there is nothing left to hand off.
+        """
         logger.debug('Ensure worker is occupied: %s', worker)
-        while (self.stacks[worker] and
-               self.ncores[worker] > len(self.processing[worker])):
-            key = self.stacks[worker].pop()
+        processing = self.processing[worker]
+        nio = len(processing & self.io_keys) if self.io_keys else 0
+
+        stack = self.io_stacks[worker]
+        io_threads = self.io_threads.get(worker, self.ncores[worker])
+        while stack and io_threads > nio:
+            key = stack.pop()
             if key not in self.tasks:
+                self.release_occupancy(worker, key)
                 continue
-            self.processing[worker].add(key)
-            logger.debug("Send job to worker: %s, %s, %s", worker, key)
-            self.worker_queues[worker].put_nowait(
-                    {'op': 'compute-task',
-                     'key': key,
-                     'task': self.tasks[key],
-                     'who_has': {dep: self.who_has[dep] for dep in
-                                 self.dependencies[key]}})
+            self.send_task_to_worker(worker, key)
+            nio += 1
+
+        stack = self.stacks[worker]
+        free = self.ncores[worker] * self.oversubscription - (
+                len(processing) - nio)
+        if free > 0 and not stack and self.steal:
+            self.steal_work(worker, free, victim)
+        while stack and free > 0:
+            key = stack.pop()
+            if key not in self.tasks:
+                self.release_occupancy(worker, key)
+                continue
+            self.send_task_to_worker(worker, key)
+            free -= 1
+
+        if not stack and not processing:
+            self.occupancy[worker] = 0  # forget drift in our estimates
+            self.durations[worker].clear()
+        if free > 0 and not stack:
+            self.idle.add(worker)
+        else:
+            self.idle.discard(worker)
+            if stack and self.idle and self.steal:
+                return next(iter(self.idle)), worker
+        return None, None
+
+    def steal_work(self, thief, n, victim=None):
+        """ Move up to ``n`` tasks from the victim's stack onto ``thief``
+
+        We take tasks from the bottom of the stack, those the victim would
+        run last, and at most half of them.  A task moves only if its
+        restrictions allow the thief and sending its dependencies to the
+        thief should take less time than tasks of its group take to run.
+        Until a task of that group has finished we only move it if it needs
+        no transfer.
+
+        The victim defaults to the worker with the longest stack.  Returns
+        the number of tasks moved.
+
+        See Also
+        --------
+        Scheduler.ensure_occupied
+        """
+        if victim is None:
+            victim = max(self.stacks, key=lambda w: len(self.stacks[w]))
+        stack = self.stacks[victim]
+        if victim == thief or not stack:
+            return 0
+        want = min(n, (len(stack) + 1) // 2)
+        stolen = []
+        keep = []
+        rejected = 0
+        i = 0
+        for i, key in enumerate(stack[:4 * want]):
+            if len(stolen) == want:
+                break
+            if key not in self.tasks:
+                self.release_occupancy(victim, key)
+                continue
+            if (key in self.restrictions and
+                    thief[0] not in self.restrictions[key]):
+                keep.append(key)
+                rejected += 1
+                continue
+            nbytes = sum(self.nbytes.get(dep, 0)
+                         for dep in self.dependencies[key]
+                         if thief not in self.who_has.get(dep, ()))
+            if nbytes and nbytes / BANDWIDTH > self.task_duration.get(
+                    key_split(key), 0):
+                keep.append(key)
+                rejected += 1
+                continue
+            stolen.append(key)
+        else:
+            i += 1
+        stack[:i] = keep
+        self.steal_counts['rejected'] += rejected
+        if not stolen:
+            return 0
+        logger.debug("%s steals %d tasks from %s", thief, len(stolen), victim)
+        self.stacks[thief].extend(reversed(stolen))
+        for key in stolen:
+            self.stolen[key] = (victim, thief)
+            self.add_occupancy(thief, key,
+                               self.release_occupancy(victim, key))
+        self.steal_counts['steals'] += 1
+        self.steal_counts['stolen'] += len(stolen)
+        self.steal_log.append((time(), victim, thief, len(stolen)))
+        return len(stolen)
+
+    def estimate_duration(self, key):
+        """ Expected seconds to compute key, from tasks of the same group
+
+        I/O-bound tasks don't occupy cores and count as zero.
+        """
+        if key in self.io_keys:
+            return 0
+        return self.task_duration.get(key_split(key), DEFAULT_TASK_DURATION)
+
+    def add_occupancy(self, worker, key, duration=None):
+        """ Add key's expected duration to a worker's occupancy """
+        if duration is None:
+            duration = self.estimate_duration(key)
+        self.durations[worker][key] = duration
+        self.occupancy[worker] += duration
+
+    def release_occupancy(self, worker, key):
+        """ Remove the duration that key added to a worker's occupancy
+
+        Returns the duration removed
+        """
+        if worker not in self.occupancy:
+            return 0
+        duration = self.durations[worker].pop(key, 0)
+        self.occupancy[worker] = max(0, self.occupancy[worker] - duration)
+        return duration
+
+    def send_task_to_worker(self, worker, key):
+        """ Mark a key as processing and queue it for the worker """
+        self.processing[worker].add(key)
+        logger.debug("Send job to worker: %s, %s", worker, key)
+        who_has = {dep: self.who_has[dep] for dep in self.dependencies[key]}
+        msg = {'op': 'compute-task',
+               'key': key,
+               'task': self.tasks[key],
+               'who_has': who_has}
+        if who_has and 'unix' in self.worker_services.get(worker, ()):
+            unix_paths = {w: self.worker_services[w]['unix']
+                          for workers in who_has.values() for w in workers
+                          if w[0] == worker[0] and w != worker
+                          and 'unix' in self.worker_services.get(w, ())}
+            if unix_paths:
+                msg['unix_paths'] = unix_paths
+        self.worker_queues[worker].put_nowait(msg)
 
     def seed_ready_tasks(self, keys=None):
         """ Distribute many leaf tasks among workers
@@ -415,15 +662,30 @@ class Scheduler(Server):
         """
         if keys is None:
             keys = self.tasks
-        new_stacks = assign_many_tasks(
-                self.dependencies, self.waiting, self.keyorder, self.who_has,
-                self.stacks, self.restrictions, self.loose_restrictions,
-                self.nbytes,
-                [k for k in keys if k in self.waiting and not self.waiting[k]])
-        logger.debug("Seed ready tasks: %s", new_stacks)
-        for worker, stack in new_stacks.items():
-            if stack:
-                self.ensure_occupied(worker)
+        ready = [k for k in keys if k in self.waiting and not self.waiting[k]]
+        io = [k for k in ready if k in self.io_keys] if self.io_keys else []
+        if io:
+            ready = [k for k in ready if k not in self.io_keys]
+        workers = set()
+        for stacks, keys, occupancy in [(self.stacks, ready, self.occupancy),
+                                        (self.io_stacks, io, None)]:
+            if not keys:
+                continue
+            new_stacks = assign_many_tasks(
+                    self.dependencies, self.waiting, self.keyorder,
+                    self.who_has, stacks, self.restrictions,
+                    self.loose_restrictions, self.nbytes, keys,
+                    occupancy=occupancy, ncores=self.ncores,
+                    task_duration=self.task_duration, hosts=self.hosts)
+            logger.debug("Seed ready tasks: %s", new_stacks)
+            if occupancy is not None:
+                for worker, stack in new_stacks.items():
+                    durations = self.durations[worker]
+                    for key in stack:
+                        durations[key] = self.estimate_duration(key)
+            workers.update(w for w, stack in new_stacks.items() if stack)
+        for worker in workers:
+            self.ensure_occupied(worker)
 
     def update_data(self, who_has=None, nbytes=None, client=None):
         """
@@ -453,6 +715,10 @@ class Scheduler(Server):
         """
         if key in self.processing[worker]:
             self.processing[worker].remove(key)
+            self.release_occupancy(worker, key)
+            if key not in self.tasks:  # released while it ran
+                self.ensure_occupied(worker)
+                return
             self.exceptions[key] = exception
             self.tracebacks[key] = traceback
             self.mark_failed(key, key)
@@ -481,11 +747,22 @@ class Scheduler(Server):
         for dep in self.dependents[key]:
             self.mark_failed(dep, failing_key)
 
-    def mark_task_finished(self, key, worker, nbytes, type=None):
+    def mark_task_finished(self, key, worker, nbytes, type=None,
+                           compute_start=None, compute_stop=None):
         """ Mark that a task has finished execution on a particular worker """
         logger.debug("Mark task as finished %s, %s", key, worker)
         if key in self.processing[worker]:
             self.nbytes[key] = nbytes
+            if compute_start is not None and compute_stop is not None:
+                duration = compute_stop - compute_start
+                prefix = key_split(key)
+                if prefix in self.task_duration:
+                    duration = (self.task_duration[prefix] + duration) / 2
+                self.task_duration[prefix] = duration
+            if key in self.stolen:
+                victim, thief = self.stolen.pop(key)
+                if thief == worker:
+                    self.steal_counts['finished'] += 1
             self.mark_key_in_memory(key, [worker], type=type)
             self.ensure_occupied(worker)
             for plugin in self.plugins[:]:
@@ -497,6 +774,20 @@ class Scheduler(Server):
             logger.debug("Key not found in processing, %s, %s, %s",
                          key, worker, self.processing[worker])
 
+    def add_replicas(self, worker, keys):
+        """ Learn that a worker holds copies of keys it fetched from peers
+
+        These extra replicas count in ``decide_worker`` and are deleted along
+        with the other copies once the key is released.  Keys released while
+        they were being fetched are deleted from the worker right away.
+        """
+        for key in keys:
+            if self.who_has.get(key):
+                self.who_has[key].add(worker)
+                self.has_what[worker].add(key)
+            else:
+                self.deleted_keys[worker].add(key)
+
     def mark_missing_data(self, missing=None, key=None, worker=None):
         """ Mark that certain keys have gone missing.  Recover.
 
@@ -507,6 +798,7 @@ class Scheduler(Server):
         if key and worker:
             try:
                 self.processing[worker].remove(key)
+                self.release_occupancy(worker, key)
             except KeyError:
                 logger.debug("Tried to remove %s from %s, but it wasn't there",
                              key, worker)
@@ -539,51 +831,142 @@ class Scheduler(Server):
     def remove_worker(self, stream=None, address=None, heal=True):
         """ Mark that a worker no longer seems responsive
 
+        Tasks that were on the worker's stacks or processing there go back to
+        other workers.  Data that lived only on this worker is recomputed if
+        anything still needs it.
+
         See Also
         --------
-        Scheduler.heal_state
+        Scheduler.recover_lost_worker
         """
         logger.debug("Remove worker %s", address)
         if address not in self.processing:
             return
         keys = self.has_what.pop(address)
-        for i in range(self.ncores[address]):  # send close message, in case not dead
-            self.worker_queues[address].put_nowait({'op': 'close', 'report': False})
+        requeue = (self.stacks[address] + self.io_stacks[address] +
+                   list(self.processing[address]))
+        # send close message, in case not dead
+        self.worker_queues[address].put_nowait({'op': 'close', 'report': False})
         del self.worker_queues[address]
         del self.ncores[address]
         del self.stacks[address]
+        del self.io_stacks[address]
+        self.io_threads.pop(address, None)
+        self.idle.discard(address)
+        del self.occupancy[address]
+        del self.durations[address]
+        self.hosts[address[0]].discard(address)
+        if not self.hosts[address[0]]:
+            del self.hosts[address[0]]
         del self.processing[address]
         del self.worker_services[address]
         if not self.stacks:
             logger.critical("Lost all workers")
-        missing_keys = set()
+        lost = set()
         for key in keys:
             self.who_has[key].remove(address)
             if not self.who_has[key]:
-                missing_keys.add(key)
-        gone_data = {k for k, v in self.who_has.items() if not v}
-        self.in_play.difference_update(missing_keys)
-        for k in gone_data:
-            del self.who_has[k]
+                del self.who_has[key]
+                lost.add(key)
+        self.in_play.difference_update(lost)
 
         if heal:
-            self.heal_state()
+            self.recover_lost_worker(lost, requeue)
 
         return b'OK'
 
+    def recover_lost_worker(self, lost, requeue):
+        """ Recover from losing a worker, touching only affected keys
+
+        Parameters
+        ----------
+        lost: set
+            Keys whose only copy lived on the worker
+        requeue: list
+            Keys that were on the worker's stacks or processing there
+
+        Lost keys that no task and no client still needs are released.  The
+        others are recomputed, along with any released dependencies that
+        they need.  Tasks waiting on lost keys wait for them again, including
+        those already placed on other workers' stacks or in processing.
+        Everything that is ready is then placed on the remaining workers.
+
+        Unlike ``heal_state`` this doesn't walk the whole graph.
+
+        See Also
+        --------
+        Scheduler.remove_worker
+        Scheduler.heal_state
+        """
+        logger.debug("Recover lost keys %s, requeue %s", lost, requeue)
+        ready = set()
+
+        for key in requeue:
+            if key not in self.tasks or self.who_has.get(key):
+                continue
+            self.waiting[key] = {dep for dep in self.dependencies[key]
+                                 if not self.who_has.get(dep)}
+            ready.add(key)
+
+        needed = {k for k in lost
+                  if k in self.who_wants or self.waiting_data.get(k)}
+        for key in lost - needed:
+            self.waiting_data.pop(key, None)
+
+        # Dependents of lost keys already placed on other workers
+        placed = {dep for key in needed for dep in self.dependents[key]
+                  if dep in self.in_play and dep not in self.waiting
+                  and not self.who_has.get(dep)} - ready
+        if placed:
+            for worker, keys in self.processing.items():
+                for key in keys & placed:
+                    keys.remove(key)
+                    self.release_occupancy(worker, key)
+            for worker, stack in self.stacks.items():
+                if any(key in placed for key in stack):
+                    for key in stack:
+                        if key in placed:
+                            self.release_occupancy(worker, key)
+                    stack[:] = [key for key in stack if key not in placed]
+            for stack in self.io_stacks.values():
+                if any(key in placed for key in stack):
+                    stack[:] = [key for key in stack if key not in placed]
+            for key in placed:
+                self.waiting[key] = {dep for dep in self.dependencies[key]
+                                     if not self.who_has.get(dep)}
+            ready.update(placed)
+
+        ready.update(ensure_in_play(needed, self.dependencies,
+                self.dependents, self.who_has, self.in_play, self.waiting,
+                self.waiting_data))
+        for key in needed:
+            for dep in self.waiting_data[key]:
+                if dep in self.waiting:
+                    self.waiting[dep].add(key)
+
+        if self.stacks:
+            self.seed_ready_tasks(ready)
+
     def add_worker(self, stream=None, address=None, keys=(), ncores=None,
-                   services=None):
+                   services=None, io_threads=None):
         self.ncores[address] = ncores
         self.worker_services[address] = services
+        if io_threads is not None:
+            self.io_threads[address] = io_threads
         if address not in self.processing:
             self.has_what[address] = set()
             self.processing[address] = set()
             self.stacks[address] = []
+            self.io_stacks[address] = []
+            self.occupancy[address] = 0
+            self.durations[address] = dict()
+            self.hosts[address[0]].add(address)
             self.worker_queues[address] = Queue()
         for key in keys:
             self.mark_key_in_memory(key, [address])
 
         self._worker_coroutines.append(self.worker(address))
+        self.ensure_occupied(address)
 
         logger.info("Register %s", str(address))
         return b'OK'
@@ -596,7 +979,7 @@ class Scheduler(Server):
 
     def update_graph(self, client=None, tasks=None, keys=None,
                      dependencies=None, restrictions=None,
-                     loose_restrictions=None):
+                     loose_restrictions=None, blobs=None):
         """ Add new computations to the internal dask graph
 
         This happens whenever the Executor calls submit, map, get, or compute.
@@ -605,13 +988,26 @@ class Scheduler(Server):
             if tasks[k] is k:
                 del tasks[k]
 
+        if blobs:
+            self.blobs.update(blobs)
+        for k, task in tasks.items():
+            if isinstance(task, dict) and 'hashes' in task:
+                for h in task['hashes'].values():
+                    self.blob_refs[h] += 1
+            if k in self.tasks:
+                self.release_blobs(self.tasks[k])
+
         update_state(self.tasks, self.dependencies, self.dependents,
                 self.who_wants, self.wants_what, self.who_has, self.in_play,
                 self.waiting, self.waiting_data, tasks, keys, dependencies,
                 client)
+        self.io_keys.update(k for k, task in tasks.items()
+                            if isinstance(task, dict) and task.get('io'))
 
         if restrictions:
-            restrictions = {k: set(map(ensure_ip, v))
+            if not self.restrictions:
+                self.restriction_sets.clear()
+            restrictions = {k: self.resolve_restrictions(v)
                             for k, v in restrictions.items()}
             self.restrictions.update(restrictions)
         if loose_restrictions:
@@ -632,7 +1028,7 @@ class Scheduler(Server):
 
         self.seed_ready_tasks(tasks)
         for key in keys:
-            if self.who_has[key]:
+            if self.who_has.get(key):
                 self.mark_key_in_memory(key)
 
         for plugin in self.plugins[:]:
@@ -641,6 +1037,21 @@ class Scheduler(Server):
             except Exception as e:
                 logger.exception(e)
 
+    def resolve_restrictions(self, hostnames):
+        """ Resolve hostnames to IP addresses, reusing earlier results
+
+        Many keys usually share a few restrictions, like the hosts holding
+        the replicas of an HDFS block.  We resolve each distinct set once
+        and store one frozenset for all keys that share it.
+        """
+        hostnames = frozenset(hostnames)
+        try:
+            return self.restriction_sets[hostnames]
+        except KeyError:
+            ips = self.restriction_sets[hostnames] = frozenset(
+                    map(ensure_ip, hostnames))
+            return ips
+
     def client_releases_keys(self, keys=None, client=None):
         for k in list(keys):
             with ignoring(KeyError):
@@ -682,6 +1093,7 @@ class Scheduler(Server):
         """
         assert not self.dependents[key] and key not in self.who_wants
         if key in self.tasks:
+            self.release_blobs(self.tasks[key])
             del self.tasks[key]
             del self.dependents[key]
             for dep in self.dependencies[key]:
@@ -694,6 +1106,8 @@ class Scheduler(Server):
                 del self.restrictions[key]
             if key in self.loose_restrictions:
                 self.loose_restrictions.remove(key)
+            self.io_keys.discard(key)
+            self.stolen.pop(key, None)
             del self.keyorder[key]
             if key in self.exceptions:
                 del self.exceptions[key]
@@ -702,6 +1116,19 @@ class Scheduler(Server):
         if key in self.who_has:
             self.delete_data(keys=[key])
 
+    def release_blobs(self, task):
+        """ Drop blobs that no task refers to anymore """
+        if isinstance(task, dict) and 'hashes' in task:
+            for h in task['hashes'].values():
+                self.blob_refs[h] -= 1
+                if self.blob_refs[h] <= 0:
+                    del self.blob_refs[h]
+                    self.blobs.pop(h, None)
+
+    def get_blobs(self, stream=None, hashes=None):
+        """ Serialized functions and arguments for content hashes """
+        return {h: self.blobs[h] for h in hashes if h in self.blobs}
+
     def cancel_key(self, key, client, retries=5):
         if key not in self.who_wants:  # no key yet, lets try again in 500ms
             if retries:
@@ -725,6 +1152,8 @@ class Scheduler(Server):
         """ Recover from catastrophic change """
         logger.debug("Heal state")
         self.log_state("Before Heal")
+        for stack in self.io_stacks.values():  # heal marks these ready again
+            del stack[:]
         state = heal(self.dependencies, self.dependents, self.who_has,
                 self.stacks, self.processing, self.waiting, self.waiting_data)
         released = state['released']
@@ -738,6 +1167,11 @@ class Scheduler(Server):
 
         self.delete_data(keys=set(self.who_has) & released - set(self.who_wants))
         self.in_play.update(self.who_has)
+        for worker in self.occupancy:
+            self.durations[worker] = {key: self.estimate_duration(key)
+                    for key in concat([self.stacks[worker],
+                                       self.processing[worker]])}
+            self.occupancy[worker] = sum(self.durations[worker].values())
         self.log_state("After Heal")
 
     def my_heal_missing_data(self, missing):
@@ -752,15 +1186,13 @@ class Scheduler(Server):
         for q in self.report_queues:
             q.put_nowait(msg)
         if 'key' in msg:
-            streams = {self.streams.get(c, ())
-                       for c in self.who_wants.get(msg['key'], ())}
+            streams = {self.streams[c]
+                       for c in self.who_wants.get(msg['key'], ())
+                       if c in self.streams}
         else:
             streams = self.streams.values()
         for s in streams:
-            try:
-                write(s, msg)  # asynchrnous
-            except StreamClosedError:
-                logger.critical("Tried writing to closed stream: %s", msg)
+            s.send(msg)  # batched and asynchronous
 
     def add_plugin(self, plugin):
         """ Add external plugin to scheduler
@@ -782,13 +1214,14 @@ class Scheduler(Server):
     def control_stream(self, stream, address=None, client=None):
         """ Listen to messages from an IOStream """
         logger.info("Connection to %s, %s", type(self).__name__, client)
-        self.streams[client] = stream
+        bstream = BatchedStream(stream, loop=self.loop)
+        self.streams[client] = bstream
         try:
-            yield self.handle_messages(stream, stream, client=client)
+            yield self.handle_messages(bstream, bstream, client=client)
         finally:
             if not stream.closed():
-                yield write(stream, {'op': 'stream-closed'})
-                stream.close()
+                bstream.send({'op': 'stream-closed'})
+                yield bstream.close()
             del self.streams[client]
             logger.info("Close connection to %s, %s", type(self).__name__,
                         client)
@@ -801,6 +1234,8 @@ class Scheduler(Server):
         """
         if isinstance(in_queue, Queue):
             next_message = in_queue.get
+        elif isinstance(in_queue, BatchedStream):
+            next_message = in_queue.recv
         elif isinstance(in_queue, IOStream):
             next_message = lambda: read(in_queue)
         else:
@@ -808,6 +1243,8 @@ class Scheduler(Server):
 
         if isinstance(report, Queue):
             put = report.put_nowait
+        elif isinstance(report, BatchedStream):
+            put = report.send
         elif isinstance(report, IOStream):
             put = lambda msg: write(report, msg)
         else:
@@ -854,82 +1291,114 @@ class Scheduler(Server):
     def worker(self, ident):
         """ Manage a single distributed worker node
 
-        This coroutine manages one remote worker.  It spins up several
-        ``worker_core`` coroutines, one for each core.  It reports a closed
-        connection to scheduler if one occurs.
-        """
-        try:
-            yield All([self.worker_core(ident, i)
-                    for i in range(self.ncores[ident])])
-        except (IOError, OSError):
-            logger.info("Worker failed from closed stream: %s", ident)
-            self.remove_worker(address=ident)
+        This coroutine manages one remote worker over a single stream to its
+        ``compute_stream`` handler.  Tasks placed on ``worker_queues[ident]``
+        are sent as they arrive and collected into batches by a
+        ``BatchedStream``.  The worker reports each task as it finishes, also
+        in batches.  A closed connection is reported to the scheduler.
 
-    @gen.coroutine
-    def worker_core(self, ident, i):
-        """ Manage one core on one distributed worker node
+        **Incoming Messages** on the worker queue:
 
-        This coroutine listens on worker_queue for the following operations
-
-        **Incoming Messages**:
-
-        - compute-task:  call worker.compute(...) on remote node, report when done
+        - compute-task:  send task to the worker
         - close: close connection to worker node, report `worker-finished` to
           scheduler
 
+        **Incoming Messages** from the worker:
+
+        - task-finished:  with ``nbytes`` and ``type`` keys
+        - task-erred:  with ``exception`` and ``traceback``
+        - missing-data:  with the ``missing`` keys
+
+        Each of these may list under ``fetched`` the dependencies that the
+        worker copied from its peers.
+        - get-blobs:  send the serialized functions and arguments for these
+          content hashes back to the worker
+
         See Also
         --------
         Scheduler.mark_task_finished
         Scheduler.mark_task_erred
         Scheduler.mark_missing_data
-        distributed.worker.Worker.compute
+        distributed.worker.Worker.compute_stream
         """
-        worker = rpc(ip=ident[0], port=ident[1])
-        logger.debug("Start worker core %s, %d", ident, i)
+        queue = self.worker_queues[ident]
+        logger.debug("Start worker stream %s", ident)
+        try:
+            stream = yield connect(*ident)
+            yield write(stream, {'op': 'compute_stream', 'reply': False,
+                                 'close': True,
+                                 'report': self.center is not None})
+            bstream = BatchedStream(stream, interval=0, loop=self.loop)
+            sender = self._send_to_worker(ident, queue, bstream)
+            closed = False
+            while not closed:
+                msgs = yield bstream.recv_many()
+                for msg in msgs:
+                    op = msg.pop('op')
+                    if op == 'close':
+                        closed = True
+                        break
+                    if op == 'get-blobs':
+                        bstream.send({'op': 'blobs', 'hashes': msg['hashes'],
+                                      'blobs': self.get_blobs(**msg)})
+                        continue
+                    key = msg['key']
+                    logger.debug("Compute response from worker %s, %s, %s",
+                                 ident, op, msg)
+                    if msg.get('fetched'):
+                        self.add_replicas(ident, msg['fetched'])
+                    if op == 'task-finished':
+                        self.mark_task_finished(key, ident, msg['nbytes'],
+                                type=msg.get('type'),
+                                compute_start=msg.get('compute_start'),
+                                compute_stop=msg.get('compute_stop'))
+                    elif op == 'task-erred':
+                        self.mark_task_erred(key, ident, msg['exception'],
+                                             msg['traceback'])
+                    elif op == 'missing-data':
+                        self.mark_missing_data(msg['missing'], key=key,
+                                               worker=ident)
+                    else:
+                        logger.warn("Bad message from worker %s: op=%s, %s",
+                                    ident, op, msg)
+            msg = yield sender
+        except (IOError, OSError, StreamClosedError):
+            logger.info("Worker failed from closed stream: %s", ident)
+            if self.worker_queues.get(ident) is queue:  # not yet replaced
+                self.remove_worker(address=ident)
+            return
+        stream.close()
+        if msg.get('report', True):
+            self.put({'op': 'worker-finished',
+                      'worker': ident})
+        logger.debug("Close worker stream, %s", ident)
+
+    @gen.coroutine
+    def _send_to_worker(self, ident, queue, bstream):
+        """ Forward tasks from a worker queue to the worker's stream
 
+        Returns the ``close`` message that ended the stream.
+        """
         while True:
-            msg = yield self.worker_queues[ident].get()
+            msg = yield queue.get()
             if msg['op'] == 'close':
-                logger.debug("Worker core receives close message %s, %s",
-                        ident, msg)
-                break
+                logger.debug("Worker stream receives close message %s, %s",
+                             ident, msg)
+                bstream.send({'op': 'close'})
+                bstream.flush()
+                raise Return(msg)
             if msg['op'] == 'compute-task':
-                key = msg['key']
-                who_has = msg['who_has']
                 task = msg['task']
                 if istask(task):
                     task = {'task': task}
                     serialized = False
                 else:
                     serialized = True
-                response, content = yield worker.compute(who_has=who_has,
-                                                         key=key,
-                                                         report=self.center
-                                                                 is not None,
-                                            serialized=serialized,
-                                            **task)
-                if response == b'OK':
-                    nbytes = content['nbytes']
-                logger.debug("Compute response from worker %s, %s, %s, %s",
-                             ident, key, response, content)
-                if response == b'error':
-                    error, traceback = content
-                    self.mark_task_erred(key, ident, content['exception'],
-                                                     content['traceback'])
-
-                elif response == b'missing-data':
-                    self.mark_missing_data(content.args, key=key, worker=ident)
-
-                else:
-                    self.mark_task_finished(key, ident, nbytes,
-                                            type=content.get('type'))
-
-        yield worker.close(close=True)
-        worker.close_streams()
-        if msg.get('report', True):
-            self.put({'op': 'worker-finished',
-                      'worker': ident})
-        logger.debug("Close worker core, %s, %d", ident, i)
+                task = dict(task, op='compute-task', key=msg['key'],
+                            who_has=msg['who_has'], serialized=serialized)
+                if 'unix_paths' in msg:
+                    task['unix_paths'] = msg['unix_paths']
+                bstream.send(task)
 
     @gen.coroutine
     def clear_data_from_workers(self):
@@ -1014,7 +1483,7 @@ class Scheduler(Server):
             self.remove_worker(address=addr, heal=False)
 
         logger.debug("Send kill signal to nannies: %s", nannies)
-        nannies = [rpc(ip=ip, port=n_port)
+        nannies = [self.rpc(ip=ip, port=n_port)
                    for (ip, w_port), n_port in nannies.items()]
         yield All([nanny.kill() for nanny in nannies])
         logger.debug("Received done signal from nannies")
@@ -1041,18 +1510,22 @@ class Scheduler(Server):
                 logger.exception(e)
 
     def validate(self, allow_overlap=False, allow_bad_stacks=False):
-        released = set(self.tasks) - self.in_play
+        released = {k for k in self.tasks if k not in self.in_play}
+        stacks = {w: self.stacks[w] + self.io_stacks.get(w, [])
+                  for w in self.stacks}
         validate_state(self.dependencies, self.dependents, self.waiting,
-                self.waiting_data, self.who_has, self.stacks,
+                self.waiting_data, self.who_has, stacks,
                 self.processing, None, released, self.in_play, self.who_wants,
                 self.wants_what,
                 allow_overlap=allow_overlap, allow_bad_stacks=allow_bad_stacks)
         if not (set(self.ncores) == \
                 set(self.has_what) == \
                 set(self.stacks) == \
+                set(self.io_stacks) == \
                 set(self.processing) == \
                 set(self.worker_services) == \
-                set(self.worker_queues)):
+                set(self.worker_queues) == \
+                set(concat(self.hosts.values()))):
             raise ValueError("Workers not the same in all collections")
 
     @gen.coroutine
@@ -1094,13 +1567,15 @@ class Scheduler(Server):
     def broadcast(self, stream, msg=None):
         """ Broadcast message to workers, return all results """
         workers = list(self.ncores)
-        results = yield All([send_recv(ip=ip, port=port, close=True, **msg)
+        results = yield All([getattr(self.rpc(ip=ip, port=port), msg['op'])(
+                                **dissoc(msg, 'op'))
                              for ip, port in workers])
         raise Return(dict(zip(workers, results)))
 
 
 def decide_worker(dependencies, stacks, who_has, restrictions,
-                  loose_restrictions, nbytes, key):
+                  loose_restrictions, nbytes, key, occupancy=None, ncores=None,
+                  hosts=None):
     """ Decide which worker should take task
 
     >>> dependencies = {'c': {'b'}, 'b': {'a'}}
@@ -1130,6 +1605,14 @@ def decide_worker(dependencies, stacks, who_has, restrictions,
     ...               loose_restrictions, nbytes, 'b')
     ('alice', 8000)
 
+    An index of workers by hostname avoids checking every worker against the
+    restrictions
+
+    >>> hosts = {'alice': {('alice', 8000)}, 'bob': {('bob', 8000)}}
+    >>> decide_worker(dependencies, stacks, who_has, restrictions,
+    ...               loose_restrictions, nbytes, 'b', hosts=hosts)
+    ('alice', 8000)
+
     If the task requires data communication, then we choose to minimize the
     number of bytes sent between workers. This takes precedence over worker
     occupancy.
@@ -1141,23 +1624,42 @@ def decide_worker(dependencies, stacks, who_has, restrictions,
 
     >>> decide_worker(dependencies, stacks, who_has, {}, set(), nbytes, 'c')
     ('bob', 8000)
+
+    Given the expected seconds of work on each worker and their cores we
+    choose the worker that should finish its current work first, rather than
+    the one with the shortest stack.
+
+    >>> who_has = {'a': {('alice', 8000), ('bob', 8000)},
+    ...            'b': {('alice', 8000), ('bob', 8000)}}
+    >>> stacks = {('alice', 8000): ['z'], ('bob', 8000): []}
+    >>> occupancy = {('alice', 8000): 1.0, ('bob', 8000): 3.0}
+    >>> ncores = {('alice', 8000): 4, ('bob', 8000): 1}
+    >>> decide_worker(dependencies, stacks, who_has, {}, set(), nbytes, 'c',
+    ...               occupancy, ncores)
+    ('alice', 8000)
     """
     deps = dependencies[key]
     workers = frequencies(w for dep in deps
                             for w in who_has[dep])
-    if not workers:
-        workers = stacks
     if key in restrictions:
         r = restrictions[key]
-        workers = {w for w in workers if w[0] in r}  # TODO: nonlinear
+        if hosts is not None:
+            valid = set()
+            for host in r:
+                if host in hosts:
+                    valid.update(hosts[host])
+        else:
+            valid = {w for w in stacks if w[0] in r}
+        workers = {w for w in workers if w in valid} or valid
         if not workers:
-            workers = {w for w in stacks if w[0] in r}
-            if not workers:
-                if key in loose_restrictions:
-                    return decide_worker(dependencies, stacks, who_has,
-                                         {}, set(), nbytes, key)
-                else:
-                    raise ValueError("Task has no valid workers", key, r)
+            if key in loose_restrictions:
+                return decide_worker(dependencies, stacks, who_has,
+                                     {}, set(), nbytes, key, occupancy,
+                                     ncores)
+            else:
+                raise ValueError("Task has no valid workers", key, r)
+    elif not workers:
+        workers = stacks
     if not workers or not stacks:
         raise ValueError("No workers found")
 
@@ -1168,7 +1670,10 @@ def decide_worker(dependencies, stacks, who_has, restrictions,
     minbytes = min(commbytes.values())
 
     workers = {w for w, nb in commbytes.items() if nb == minbytes}
-    worker = min(workers, key=lambda w: len(stacks[w]))
+    if occupancy is not None:
+        worker = min(workers, key=lambda w: occupancy[w] / ncores[w])
+    else:
+        worker = min(workers, key=lambda w: len(stacks[w]))
     return worker
 
 
@@ -1320,8 +1825,8 @@ def keys_outside_frontier(dependencies, keys, frontier):
     ['b', 'z']
     """
     assert isinstance(keys, set)
-    assert isinstance(frontier, set)
-    stack = list(keys - frontier)
+    assert isinstance(frontier, Set)
+    stack = [k for k in keys if k not in frontier]
     result = set()
     while stack:
         x = stack.pop()
@@ -1428,7 +1933,8 @@ _round_robin = [0]
 
 
 def assign_many_tasks(dependencies, waiting, keyorder, who_has, stacks,
-        restrictions, loose_restrictions, nbytes, keys):
+        restrictions, loose_restrictions, nbytes, keys, occupancy=None,
+        ncores=None, task_duration=None, hosts=None):
     """ Assign many new ready tasks to workers
 
     Often at the beginning of computation we have to assign many new leaves to
@@ -1441,6 +1947,12 @@ def assign_many_tasks(dependencies, waiting, keyorder, who_has, stacks,
     This mutates waiting and stacks in place and returns a dictionary,
     new_stacks, that serves as a diff between the old and new stacks.  These
     new tasks have yet to be put on worker queues.
+
+    Given ``occupancy``, the expected seconds of work on each worker, along
+    with ``ncores`` and ``task_duration`` we split the leaves so that every
+    worker expects to finish at about the same time, and add their expected
+    durations to ``occupancy``.  Otherwise each worker gets the same number
+    of leaves.
     """
     leaves = list()  # ready tasks without data dependencies
     ready = list()   # ready tasks with data dependencies
@@ -1464,17 +1976,39 @@ def assign_many_tasks(dependencies, waiting, keyorder, who_has, stacks,
     workers = workers[k:] + workers[:k]
     _round_robin[0] += 1
 
-    k = int(ceil(len(leaves) / len(workers)))
-    for i, worker in enumerate(workers):
-        keys = leaves[i*k: (i + 1)*k][::-1]
-        new_stacks[worker].extend(keys)
-        stacks[worker].extend(keys)
+    if occupancy is None:
+        k = int(ceil(len(leaves) / len(workers)))
+        for i, worker in enumerate(workers):
+            keys = leaves[i*k: (i + 1)*k][::-1]
+            new_stacks[worker].extend(keys)
+            stacks[worker].extend(keys)
+    else:
+        durations = [task_duration.get(key_split(key), DEFAULT_TASK_DURATION)
+                     for key in leaves]
+        finish = ((sum(occupancy[w] for w in workers) + sum(durations)) /
+                  sum(ncores[w] for w in workers))
+        i = 0
+        for j, worker in enumerate(workers):
+            start = i
+            total = occupancy[worker]
+            target = finish * ncores[worker]
+            last = j == len(workers) - 1
+            while i < len(leaves) and (last or total < target):
+                total += durations[i]
+                i += 1
+            keys = leaves[start:i][::-1]
+            occupancy[worker] = total
+            new_stacks[worker].extend(keys)
+            stacks[worker].extend(keys)
 
     for key in ready:
         worker = decide_worker(dependencies, stacks, who_has, restrictions,
-                loose_restrictions, nbytes, key)
+                loose_restrictions, nbytes, key, occupancy, ncores, hosts)
         new_stacks[worker].append(key)
         stacks[worker].append(key)
+        if occupancy is not None:
+            occupancy[worker] += task_duration.get(key_split(key),
+                                                   DEFAULT_TASK_DURATION)
 
     return new_stacks
 
@@ -1491,6 +2025,34 @@ def heal_missing_data(tasks, dependencies, dependents,
         if key in in_play:
             in_play.remove(key)
 
+    ensure_in_play(missing, dependencies, dependents, who_has, in_play,
+                   waiting, waiting_data)
+
+    assert set(missing).issubset(in_play)
+
+
+def ensure_in_play(keys, dependencies, dependents, who_has, in_play, waiting,
+                   waiting_data):
+    """ Put keys back in play, along with the dependencies they need
+
+    Each key not already in play, and recursively each of its dependencies
+    not in play, waits on its dependencies that aren't in memory and feeds
+    its dependents in play that aren't in memory.
+
+    Mutates ``in_play``, ``waiting`` and ``waiting_data`` in place and returns
+    the set of keys that it put back in play.
+
+    >>> dependencies = {'x': set(), 'y': {'x'}}
+    >>> dependents = {'x': {'y'}, 'y': set()}
+    >>> in_play, waiting, waiting_data = set(), dict(), dict()
+    >>> sorted(ensure_in_play(['y'], dependencies, dependents, {}, in_play,
+    ...                       waiting, waiting_data))
+    ['x', 'y']
+    >>> waiting == {'x': set(), 'y': {'x'}}
+    True
+    """
+    added = set()
+
     def ensure_key(key):
         if key in in_play:
             return
@@ -1502,11 +2064,12 @@ def heal_missing_data(tasks, dependencies, dependents,
         waiting_data[key] = {dep for dep in dependents[key] if dep in in_play
                                                     and not who_has.get(dep)}
         in_play.add(key)
+        added.add(key)
 
-    for key in missing:
+    for key in keys:
         ensure_key(key)
 
-    assert set(missing).issubset(in_play)
+    return added
 
 
 def _maybe_complex(task):
@@ -1516,8 +2079,74 @@ def _maybe_complex(task):
             isinstance(task, dict) and any(map(_maybe_complex, task.values())))
 
 
+def _is_args_list(task):
+    """ A task building a tuple of arguments that holds no other tasks
+
+    >>> _is_args_list((tuple, [1, 'x']))
+    True
+    >>> _is_args_list((tuple, [1, (len, 'x')]))
+    False
+    """
+    return (istask(task) and task[0] is tuple and len(task) == 2 and
+            isinstance(task[1], list) and
+            not (task[1] and callable(task[1][0])) and
+            not any(map(_maybe_complex, task[1])))
+
+
 cache = dict()
 
+BLOB_THRESHOLD = 10000
+
+BANDWIDTH = 100e6  # bytes per second between workers, used for stealing
+
+DEFAULT_TASK_DURATION = 0.5  # seconds, for groups we haven't yet seen
+
+
+def hash_blobs(tasks, threshold=BLOB_THRESHOLD):
+    """ Replace serialized functions and shared large arguments with hashes
+
+    Tasks from ``Executor.map`` all carry the same function, and often the
+    same large keyword arguments.  We send each of these once per message,
+    keyed by hash, and workers keep them cached across messages.  Large
+    arguments used by only one task stay in that task, so that workers don't
+    cache data that no other task needs.
+
+    Mutates the task dicts in place and returns the blobs as ``{hash: bytes}``
+
+    >>> tasks = {'x': {'function': b'f', 'args': b'(1,)'}}
+    >>> hash_blobs(tasks)  # doctest: +SKIP
+    {'a9fc...': b'f'}
+    >>> tasks  # doctest: +SKIP
+    {'x': {'hashes': {'function': 'a9fc...'}, 'args': b'(1,)'}}
+    """
+    hashes = dict()
+    counts = defaultdict(int)
+    found = []
+    for task in tasks.values():
+        if not isinstance(task, dict):
+            continue
+        for field in ('function', 'args', 'kwargs'):
+            b = task.get(field)
+            if b is None or field != 'function' and len(b) < threshold:
+                continue
+            try:
+                h = hashes[id(b)][1]
+            except KeyError:  # hold on to b so that its id isn't reused
+                h = hashlib.sha1(b).hexdigest()
+                hashes[id(b)] = (b, h)
+            counts[h] += 1
+            found.append((task, field, h))
+
+    blobs = dict()
+    for task, field, h in found:
+        if field != 'function' and counts[h] < 2:
+            continue
+        blobs[h] = task.pop(field)
+        if 'hashes' not in task:
+            task['hashes'] = dict()
+        task['hashes'][field] = h
+    return blobs
+
 
 def dumps_function(func):
     """ Dump a function to bytes, cache functions """
@@ -1541,6 +2170,9 @@ def dumps_task(task):
     {'function': b'\x80\x04\x95\x00\x8c\t_operator\x94\x8c\x03add\x94\x93\x94.'
      'args': b'\x80\x04\x95\x07\x00\x00\x00K\x01K\x02\x86\x94.'}
 
+    Tasks calling functions marked with ``distributed.utils.io_bound`` also
+    carry ``'io': True``.
+
     Or as a single task blob if it can't easily decompose the result.  This
     happens either if the task is highly nested, or if it isn't a task at all
 
@@ -1548,11 +2180,22 @@ def dumps_task(task):
     {'task': b'\x80\x04\x95\x03\x00\x00\x00\x00\x00\x00\x00K\x01.'}
     """
     if istask(task):
+        if task[0] is apply and _is_args_list(task[2]):
+            # (apply, f, (tuple, [1, 'x']), kwargs) as from Executor.map
+            task = (apply, task[1], tuple(task[2][1])) + task[3:]
         if task[0] is apply and not any(map(_maybe_complex, task[2:])):
-            return {'function': dumps_function(task[1]),
-                        'args': dumps(task[2]),
-                      'kwargs': dumps(task[3])}
+            func = task[1]
+            d = {'function': dumps_function(func),
+                     'args': dumps(task[2]),
+                   'kwargs': dumps(task[3])}
         elif not any(map(_maybe_complex, task[1:])):
-            return {'function': dumps_function(task[0]),
-                        'args': dumps(task[1:])}
+            func = task[0]
+            d = {'function': dumps_function(func),
+                     'args': dumps(task[1:])}
+        else:
+            func = task[0]
+            d = {'task': dumps(task)}
+        if getattr(func, 'io_bound', False):
+            d['io'] = True
+        return d
     return {'task': dumps(task)}
@@ -0,0 +1,275 @@
+"""
+Memory-bounded storage for worker data that spills to disk
+
+``SpillBuffer`` is a ``MutableMapping`` that keeps recently used values in
+memory, up to a budget measured with ``sizeof``.  Beyond that budget it moves
+the least recently used values to files in a directory and loads them back
+when they are asked for again.  Workers use it for ``Worker.data`` when given
+a ``memory_limit``.
+
+Spilled NumPy arrays are written with ``numpy.save`` and read back as
+copy-on-write memory maps.  Reading one does not copy it into memory and does
+not count against the budget.  We open each map once and hand out the same
+array on later reads, as we do for values in memory.  Other values are
+pickled.  Values larger than the whole budget are loaded on every read but
+stay where they are rather than being written out again.
+
+Optionally a middle tier holds values compressed in memory, with its own
+budget.  Values leaving the uncompressed tier go there if they compress well
+and otherwise straight to disk.  The least recently used compressed values
+go to disk in turn.
+"""
+from __future__ import print_function, division, absolute_import
+
+from collections import MutableMapping, OrderedDict
+from itertools import count
+import logging
+import os
+import pickle
+from time import time
+
+import cloudpickle
+
+from . import protocol
+from .sizeof import sizeof
+from .utils import ignoring, nbytes
+
+logger = logging.getLogger(__name__)
+
+
+np = None
+with ignoring(ImportError):
+    import numpy as np
+
+
+def _is_plain_array(o):
+    return (np is not None and isinstance(o, np.ndarray) and
+            not o.dtype.hasobject and o.nbytes > 0)
+
+
+class SpillBuffer(MutableMapping):
+    """ Mapping that spills least recently used values to disk
+
+    Parameters
+    ----------
+    directory: str
+        Where to write spilled values.  Created if it does not exist.
+    memory_limit: int
+        Number of bytes of values to keep in memory, as measured by ``sizeof``
+    compressed_limit: int, optional
+        Number of bytes of compressed values to keep in memory.  Defaults to
+        zero, meaning that values go straight from memory to disk.
+    compression: str, optional
+        Compression for the compressed tier, one of
+        ``protocol.compressions``.  Defaults to
+        ``protocol.default_compression`` or ``'zlib'``.
+    sizeof: function, optional
+        Estimates the number of bytes of a value
+
+    Attributes
+    ----------
+    fast: OrderedDict
+        ``{key: value}`` in memory, from least to most recently used
+    compressed: OrderedDict
+        ``{key: frames}`` compressed in memory, from least to most recently
+        used
+    slow: dict
+        ``{key: path}`` of values spilled to disk
+    mapped: dict
+        ``{key: memmap}`` of spilled arrays that we have read
+    memory: int
+        Total ``sizeof`` of values in memory
+    compressed_memory: int
+        Total bytes of compressed values
+    stats: dict
+        Hits in each tier, and counts, bytes and seconds spent compressing,
+        spilling and unspilling
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> d = SpillBuffer(tempfile.mkdtemp(), memory_limit=100)
+    >>> d['x'] = b'0' * 1000  # larger than memory_limit, goes to disk
+    >>> list(d.slow)
+    ['x']
+    >>> d['x'] == b'0' * 1000
+    True
+
+    >>> d = SpillBuffer(tempfile.mkdtemp(), memory_limit=100,
+    ...                 compressed_limit=10000)
+    >>> d['x'] = b'0' * 100000  # compresses well, kept in memory
+    >>> list(d.compressed)
+    ['x']
+    """
+    def __init__(self, directory, memory_limit, compressed_limit=0,
+                 compression=None, sizeof=sizeof):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.compressed_limit = compressed_limit
+        self.compression = (compression or protocol.default_compression or
+                            'zlib')
+        self.sizeof = sizeof
+        self.fast = OrderedDict()
+        self.compressed = OrderedDict()
+        self.slow = dict()
+        self.mapped = dict()
+        self.weights = dict()
+        self.memory = 0
+        self.compressed_memory = 0
+        self.stats = {'memory-hits': 0, 'compressed-hits': 0, 'disk-hits': 0,
+                      'compress-count': 0, 'compress-bytes': 0,
+                      'compressed-bytes': 0, 'compress-time': 0.0,
+                      'decompress-time': 0.0,
+                      'spill-count': 0, 'spill-bytes': 0, 'spill-time': 0.0,
+                      'unspill-count': 0, 'unspill-bytes': 0,
+                      'unspill-time': 0.0}
+        self._counter = count()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __str__(self):
+        return ('<SpillBuffer: %d in memory (%d bytes), %d compressed '
+                '(%d bytes), %d on disk>' % (
+                len(self.fast), self.memory, len(self.compressed),
+                self.compressed_memory, len(self.slow)))
+
+    __repr__ = __str__
+
+    def __getitem__(self, key):
+        if key in self.fast:
+            self.stats['memory-hits'] += 1
+            value = self.fast.pop(key)  # mark as most recently used
+            self.fast[key] = value
+            return value
+        if key in self.compressed:
+            self.stats['compressed-hits'] += 1
+            frames = self.compressed.pop(key)
+            start = time()
+            value = protocol.loads(frames)
+            self.stats['decompress-time'] += time() - start
+            weight = self.sizeof(value)
+            if weight > self.memory_limit:  # would be compressed again
+                self.compressed[key] = frames
+                return value
+            self.compressed_memory -= sum(map(nbytes, frames))
+            self._store(key, value, weight)
+            return value
+        path = self.slow[key]
+        self.stats['disk-hits'] += 1
+        if path.endswith('.npy'):
+            value = self.mapped.get(key)
+            if value is None:
+                start = time()
+                value = self.mapped[key] = np.load(path, mmap_mode='c')
+                self._record('unspill', value.nbytes, time() - start)
+            return value
+        value = self._unspill(path)
+        weight = self.sizeof(value)
+        if weight > self.memory_limit:  # would be spilled again
+            return value
+        del self.slow[key]
+        os.remove(path)
+        self._store(key, value, weight)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+        self._store(key, value)
+
+    def __delitem__(self, key):
+        if key in self.fast:
+            del self.fast[key]
+            self.memory -= self.weights.pop(key)
+        elif key in self.compressed:
+            frames = self.compressed.pop(key)
+            self.compressed_memory -= sum(map(nbytes, frames))
+        else:
+            path = self.slow.pop(key)
+            self.mapped.pop(key, None)
+            with ignoring(OSError):
+                os.remove(path)
+
+    def __contains__(self, key):
+        return key in self.fast or key in self.compressed or key in self.slow
+
+    def __iter__(self):
+        for d in [self.fast, self.compressed, self.slow]:
+            for key in list(d):
+                yield key
+
+    def __len__(self):
+        return len(self.fast) + len(self.compressed) + len(self.slow)
+
+    def _store(self, key, value, weight=None):
+        """ Put a value in memory and evict others until we fit the budget """
+        if weight is None:
+            weight = self.sizeof(value)
+        self.fast[key] = value
+        self.weights[key] = weight
+        self.memory += weight
+        while self.memory > self.memory_limit and self.fast:
+            self.evict(next(iter(self.fast)))
+
+    def evict(self, key):
+        """ Move one value out of uncompressed memory
+
+        It goes to the compressed tier if we have one and the value
+        compresses to less than ``protocol.COMPRESSION_MIN_RATIO`` of its
+        size, and otherwise to disk.
+        """
+        value = self.fast.pop(key)
+        weight = self.weights.pop(key)
+        self.memory -= weight
+        if self.compressed_limit:
+            start = time()
+            frames = protocol.dumps(value, compression=self.compression)
+            size = sum(map(nbytes, frames))
+            self.stats['compress-time'] += time() - start
+            if (size < protocol.COMPRESSION_MIN_RATIO * weight and
+                    size <= self.compressed_limit):
+                self.stats['compress-count'] += 1
+                self.stats['compress-bytes'] += weight
+                self.stats['compressed-bytes'] += size
+                self.compressed[key] = frames
+                self.compressed_memory += size
+                while self.compressed_memory > self.compressed_limit:
+                    self._spill_compressed(next(iter(self.compressed)))
+                return
+        self.spill(key, value)
+
+    def _spill_compressed(self, key):
+        frames = self.compressed.pop(key)
+        self.compressed_memory -= sum(map(nbytes, frames))
+        start = time()
+        value = protocol.loads(frames)
+        self.stats['decompress-time'] += time() - start
+        self.spill(key, value)
+
+    def spill(self, key, value):
+        """ Write one value to disk """
+        start = time()
+        n = next(self._counter)
+        if _is_plain_array(value):
+            path = os.path.join(self.directory, '%d.npy' % n)
+            np.save(path, value, allow_pickle=False)
+        else:
+            path = os.path.join(self.directory, '%d.pkl' % n)
+            with open(path, 'wb') as f:
+                cloudpickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.slow[key] = path
+        self._record('spill', os.path.getsize(path), time() - start)
+        logger.debug("Spilled %s to %s", key, path)
+
+    def _unspill(self, path):
+        """ Load a pickled value from disk """
+        start = time()
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+        self._record('unspill', os.path.getsize(path), time() - start)
+        return value
+
+    def _record(self, kind, nbytes, duration):
+        self.stats[kind + '-count'] += 1
+        self.stats[kind + '-bytes'] += nbytes
+        self.stats[kind + '-time'] += duration
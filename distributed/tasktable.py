@@ -0,0 +1,461 @@
+""" Compact storage of per-key scheduler state
+
+The scheduler tracks several facts about every key: its task, the keys it
+depends on, the keys that depend on it, which of those it still waits on or
+still feeds, its position in the execution order, and whether it is currently
+in play.  Keeping each fact in its own dict of sets costs over a kilobyte per
+key, which dominates scheduler memory for graphs with millions of tasks.
+
+The ``TaskTable`` maps each key to a small integer id and keeps every fact in
+a column indexed by that id.  Small sets of keys are stored as tuples, the
+execution order in ``array`` objects and the released/in-play state in a
+``bytearray``.  The scheduler exposes the columns through views that behave
+like the dicts and sets they replace, so existing code and plugins keep
+working unchanged.  Set operators on these views return plain sets.
+
+The views cost CPU on every transition, so the scheduler only uses the table
+when created with ``compact_state=True``.
+"""
+from __future__ import print_function, division, absolute_import
+
+from array import array
+from collections import MutableMapping, MutableSet
+
+
+RELEASED = 0
+IN_PLAY = 1
+
+SMALL = 8  # sets of up to this many keys are stored as tuples
+
+
+class _Nothing(object):
+    def __repr__(self):
+        return 'NOTHING'
+
+NOTHING = _Nothing()  # marks an empty cell, tasks may legitimately be None
+
+
+class TaskTable(object):
+    """ Integer-indexed table of per-key scheduler state
+
+    Ids are handed out on first write and returned to a free list once a key
+    has no remaining state, so the table stays as large as the number of keys
+    the scheduler currently knows about.
+
+    Examples
+    --------
+    >>> t = TaskTable()
+    >>> t.dependencies['y'] = {'x'}
+    >>> t.dependents['x'] = set()
+    >>> t.dependents['x'].add('y')
+    >>> t.dependents['x'] == {'y'}
+    True
+    >>> t.in_play.add('y')
+    >>> 'y' in t.in_play
+    True
+    >>> len(t)
+    2
+    """
+    def __init__(self):
+        self.ids = dict()
+        self.keys = list()
+        self.free = list()
+        self.state = bytearray()
+        self.columns = list()
+
+        self.tasks = Column(self)
+        self.dependencies = KeySetColumn(self)
+        self.dependents = KeySetColumn(self)
+        self.waiting = KeySetColumn(self)
+        self.waiting_data = KeySetColumn(self)
+        self.keyorder = KeyOrder(self)
+        self.in_play = InPlay(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def id(self, key):
+        """ Id of key, allocating a new one if necessary """
+        try:
+            return self.ids[key]
+        except KeyError:
+            pass
+        if self.free:
+            i = self.free.pop()
+            self.keys[i] = key
+        else:
+            i = len(self.keys)
+            self.keys.append(key)
+            self.state.append(RELEASED)
+            for column in self.columns:
+                column.grow()
+        self.ids[key] = i
+        return i
+
+    def maybe_free(self, i):
+        """ Release id ``i`` if its key no longer has any state """
+        if self.state[i] != RELEASED:
+            return
+        for column in self.columns:
+            if not column.empty(i):
+                return
+        del self.ids[self.keys[i]]
+        self.keys[i] = None
+        self.free.append(i)
+
+    def clear(self):
+        """ Drop all keys, keeping the views valid """
+        self.ids.clear()
+        del self.keys[:]
+        del self.free[:]
+        del self.state[:]
+        for column in self.columns:
+            column.reset()
+        self.in_play.count = 0
+
+    def nbytes(self):
+        """ Approximate number of bytes used by the table """
+        from sys import getsizeof
+        total = (getsizeof(self.ids) + getsizeof(self.keys) +
+                 getsizeof(self.free) + getsizeof(self.state))
+        for column in self.columns:
+            total += column.nbytes()
+        return total
+
+
+class Column(MutableMapping):
+    """ Mapping view onto one column of a ``TaskTable`` """
+    def __init__(self, table):
+        self.table = table
+        self.data = [NOTHING] * len(table.keys)
+        self.count = 0
+        table.columns.append(self)
+
+    def grow(self):
+        self.data.append(NOTHING)
+
+    def empty(self, i):
+        return self.data[i] is NOTHING
+
+    def reset(self):
+        del self.data[:]
+        self.count = 0
+
+    def nbytes(self):
+        from sys import getsizeof
+        return getsizeof(self.data)
+
+    def __getitem__(self, key):
+        i = self.table.ids[key]
+        value = self.data[i]
+        if value is NOTHING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        i = self.table.ids.get(key)
+        if i is None:
+            return default
+        value = self.data[i]
+        return default if value is NOTHING else value
+
+    def __contains__(self, key):
+        i = self.table.ids.get(key)
+        return i is not None and self.data[i] is not NOTHING
+
+    def __setitem__(self, key, value):
+        i = self.table.id(key)
+        if self.data[i] is NOTHING:
+            self.count += 1
+        self.data[i] = value
+
+    def __delitem__(self, key):
+        i = self.table.ids.get(key)
+        if i is None or self.data[i] is NOTHING:
+            raise KeyError(key)
+        self.data[i] = NOTHING
+        self.count -= 1
+        self.table.maybe_free(i)
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def __iter__(self):
+        keys = self.table.keys
+        return (keys[i] for i, value in enumerate(self.data)
+                if value is not NOTHING)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        data = self.data
+        used = [i for i, value in enumerate(data) if value is not NOTHING]
+        for i in used:
+            data[i] = NOTHING
+        self.count = 0
+        for i in used:
+            self.table.maybe_free(i)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _compact(keys):
+    """ Storage for a set of keys: a tuple when small, a set otherwise """
+    if not keys:
+        return ()
+    if not isinstance(keys, (set, frozenset)):
+        keys = set(keys)
+    if len(keys) <= SMALL:
+        return tuple(keys)
+    return set(keys)
+
+
+class KeySetColumn(Column):
+    """ Column mapping keys to sets of keys
+
+    Values are live ``KeySet`` views, so ``column[key].add(dep)`` mutates the
+    table as it would mutate a set held in a dict.  Assigned sets are copied.
+    """
+    def nbytes(self):
+        from sys import getsizeof
+        return getsizeof(self.data) + sum(getsizeof(v) for v in self.data
+                                          if v is not NOTHING and v != ())
+
+    def __getitem__(self, key):
+        i = self.table.ids[key]
+        if self.data[i] is NOTHING:
+            raise KeyError(key)
+        return KeySet(self.data, i)
+
+    def get(self, key, default=None):
+        i = self.table.ids.get(key)
+        if i is None or self.data[i] is NOTHING:
+            return default
+        return KeySet(self.data, i)
+
+    def __setitem__(self, key, value):
+        Column.__setitem__(self, key, _compact(value))
+
+    def pop(self, key, *default):
+        """ Remove key and return a copy of its set """
+        i = self.table.ids.get(key)
+        if i is None or self.data[i] is NOTHING:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = set(self.data[i])
+        del self[key]
+        return value
+
+    def __repr__(self):
+        return repr({k: set(v) for k, v in self.items()})
+
+
+class KeySet(MutableSet):
+    """ Set view onto one cell of a ``KeySetColumn`` """
+    __slots__ = ('data', 'i')
+
+    def __init__(self, data, i):
+        self.data = data
+        self.i = i
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def copy(self):
+        return set(self.data[self.i])
+
+    def __contains__(self, key):
+        return key in self.data[self.i]
+
+    def __iter__(self):
+        return iter(self.data[self.i])
+
+    def __len__(self):
+        return len(self.data[self.i])
+
+    def add(self, key):
+        s = self.data[self.i]
+        if type(s) is tuple:
+            if key in s:
+                return
+            if len(s) < SMALL:
+                self.data[self.i] = s + (key,)
+                return
+            s = self.data[self.i] = set(s)
+        s.add(key)
+
+    def discard(self, key):
+        s = self.data[self.i]
+        if type(s) is tuple:
+            if key in s:
+                self.data[self.i] = tuple([k for k in s if k != key])
+        else:
+            s.discard(key)
+            if not s:
+                self.data[self.i] = ()
+
+    def remove(self, key):
+        if key not in self.data[self.i]:
+            raise KeyError(key)
+        self.discard(key)
+
+    def clear(self):
+        self.data[self.i] = ()
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __repr__(self):
+        return repr(set(self.data[self.i]))
+
+
+class KeyOrder(Column):
+    """ Column of ``(generation, order)`` pairs stored in two arrays """
+    def __init__(self, table):
+        self.table = table
+        self.generation = array('l', [-1]) * len(table.keys)
+        self.order = array('l', [0]) * len(table.keys)
+        self.count = 0
+        table.columns.append(self)
+
+    def grow(self):
+        self.generation.append(-1)
+        self.order.append(0)
+
+    def empty(self, i):
+        return self.generation[i] < 0
+
+    def reset(self):
+        del self.generation[:]
+        del self.order[:]
+        self.count = 0
+
+    def nbytes(self):
+        return (self.generation.buffer_info()[1] * self.generation.itemsize +
+                self.order.buffer_info()[1] * self.order.itemsize)
+
+    def __getitem__(self, key):
+        i = self.table.ids[key]
+        if self.generation[i] < 0:
+            raise KeyError(key)
+        return (self.generation[i], self.order[i])
+
+    def get(self, key, default=None):
+        i = self.table.ids.get(key)
+        if i is None or self.generation[i] < 0:
+            return default
+        return (self.generation[i], self.order[i])
+
+    def __contains__(self, key):
+        i = self.table.ids.get(key)
+        return i is not None and self.generation[i] >= 0
+
+    def __setitem__(self, key, value):
+        generation, order = value
+        i = self.table.id(key)
+        if self.generation[i] < 0:
+            self.count += 1
+        self.generation[i] = generation
+        self.order[i] = order
+
+    def __delitem__(self, key):
+        i = self.table.ids.get(key)
+        if i is None or self.generation[i] < 0:
+            raise KeyError(key)
+        self.generation[i] = -1
+        self.count -= 1
+        self.table.maybe_free(i)
+
+    def __iter__(self):
+        keys = self.table.keys
+        return (keys[i] for i, g in enumerate(self.generation) if g >= 0)
+
+    def clear(self):
+        used = [i for i, g in enumerate(self.generation) if g >= 0]
+        for i in used:
+            self.generation[i] = -1
+        self.count = 0
+        for i in used:
+            self.table.maybe_free(i)
+
+
+class InPlay(MutableSet):
+    """ Set view of the keys whose state is ``IN_PLAY`` """
+    def __init__(self, table):
+        self.table = table
+        self.count = 0
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def copy(self):
+        return set(self)
+
+    def __contains__(self, key):
+        i = self.table.ids.get(key)
+        return i is not None and self.table.state[i] == IN_PLAY
+
+    def __iter__(self):
+        keys = self.table.keys
+        return (keys[i] for i, s in enumerate(self.table.state)
+                if s == IN_PLAY)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        table = self.table
+        i = table.id(key)
+        if table.state[i] != IN_PLAY:
+            table.state[i] = IN_PLAY
+            self.count += 1
+
+    def discard(self, key):
+        table = self.table
+        i = table.ids.get(key)
+        if i is not None and table.state[i] == IN_PLAY:
+            table.state[i] = RELEASED
+            self.count -= 1
+            table.maybe_free(i)
+
+    def remove(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.discard(key)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def difference_update(self, keys):
+        for key in keys:
+            self.discard(key)
+
+    def clear(self):
+        table = self.table
+        state = table.state
+        used = [i for i, s in enumerate(state) if s == IN_PLAY]
+        for i in used:
+            state[i] = RELEASED
+        self.count = 0
+        for i in used:
+            table.maybe_free(i)
+
+    def __repr__(self):
+        return repr(set(self))
@@ -0,0 +1,79 @@
+import socket
+
+from tornado import gen
+from tornado.iostream import IOStream, StreamClosedError
+import pytest
+
+from distributed.batched import BatchedStream
+from distributed.core import read, write
+from distributed.utils_test import gen_test
+
+
+def stream_pair():
+    a, b = socket.socketpair()
+    return IOStream(a), IOStream(b)
+
+
+@gen_test()
+def test_batched_stream():
+    a, b = stream_pair()
+    sender, receiver = BatchedStream(a, interval=0.01), BatchedStream(b)
+
+    for i in range(1000):
+        sender.send({'op': 'key-in-memory', 'key': ('x', i)})
+
+    msgs = []
+    for i in range(1000):
+        msg = yield receiver.recv()
+        msgs.append(msg)
+    assert msgs == [{'op': 'key-in-memory', 'key': ('x', i)}
+                    for i in range(1000)]
+    assert sender.message_count == 1000
+    assert sender.batch_count < 10
+
+    yield write(a, {'op': 'unbatched'})  # plain messages still arrive
+    assert (yield receiver.recv()) == {'op': 'unbatched'}
+
+    sender.send([1, 2])  # lists are ordinary messages, not batches
+    yield sender.flush()
+    yield write(a, ['unbatched', 'list'])
+    assert (yield receiver.recv()) == [1, 2]
+    assert (yield receiver.recv()) == ['unbatched', 'list']
+
+    sender.send('final')
+    yield sender.close()
+    assert (yield receiver.recv()) == 'final'
+    with pytest.raises(StreamClosedError):
+        yield receiver.recv()
+
+
+@gen_test()
+def test_recv_many():
+    a, b = stream_pair()
+    sender, receiver = BatchedStream(a, interval=0.01), BatchedStream(b)
+
+    for i in range(10):
+        sender.send(i)
+    yield write(a, 'unbatched')
+    msgs = yield receiver.recv_many()
+    while len(msgs) < 11:
+        msgs.extend((yield receiver.recv_many()))
+    assert sorted(msgs, key=str) == sorted(list(range(10)) + ['unbatched'],
+                                           key=str)
+    assert not receiver.inbox
+    a.close()
+    b.close()
+
+
+@gen_test()
+def test_batched_stream_max_messages():
+    a, b = stream_pair()
+    sender = BatchedStream(a, interval=10, max_messages=5)
+
+    for i in range(5):
+        sender.send(i)
+
+    msg = yield gen.with_timeout(sender.loop.time() + 1, read(b))
+    assert msg == {'op': 'batch', 'msgs': [0, 1, 2, 3, 4]}
+    a.close()
+    b.close()
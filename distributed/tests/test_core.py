@@ -1,12 +1,16 @@
 from functools import partial
 from multiprocessing import Process
 import socket
+from time import sleep, time
 
 from tornado import gen, ioloop
+from tornado.iostream import IOStream, StreamClosedError
 import pytest
 
 from distributed.core import (read, write, pingpong, Server, rpc, connect,
-        coerce_to_rpc)
+        coerce_to_rpc, read_frames, write_frames, ConnectionPool,
+        connection_pool, LATENCY_BUCKETS, offload_stats)
+from distributed import core
 from distributed.utils_test import slow, loop
 
 def test_server(loop):
@@ -30,6 +34,55 @@ def test_server(loop):
     loop.run_sync(f)
 
 
+def test_frames(loop):
+    @gen.coroutine
+    def f():
+        a, b = socket.socketpair()
+        sa, sb = IOStream(a), IOStream(b)
+
+        frames = [b'', b'123', memoryview(b'456' * 1000), b'', b'7' * 100000]
+        written = write_frames(sa, frames)
+        result = yield read_frames(sb)
+        yield written
+        assert result == [b'', b'123', b'456' * 1000, b'', b'7' * 100000]
+        assert type(result[-1]) is bytearray  # large frames are writable
+
+        yield write(sb, {'x': b'0' * 10000})
+        msg = yield read(sa)
+        assert msg == {'x': b'0' * 10000}
+
+        sa.close()
+        sb.close()
+
+    loop.run_sync(f)
+
+
+def test_read_writable_numpy_arrays(loop):
+    np = pytest.importorskip('numpy')
+
+    @gen.coroutine
+    def f():
+        a, b = socket.socketpair()
+        sa, sb = IOStream(a), IOStream(b)
+
+        x = np.arange(100000)
+        written = write(sa, {'x': x})
+        msg = yield read(sb)
+        yield written
+        y = msg['x']
+        assert (y == x).all()
+        assert y.flags.writeable
+        base = y
+        while isinstance(base, np.ndarray):
+            base = base.base
+        assert type(base) is bytearray  # built on the frame, not a copy
+
+        sa.close()
+        sb.close()
+
+    loop.run_sync(f)
+
+
 def test_rpc(loop):
     @gen.coroutine
     def f():
@@ -72,6 +125,187 @@ def test_rpc_with_many_connections(loop):
     loop.run_sync(f)
 
 
+def test_metrics(loop):
+    @gen.coroutine
+    def f():
+        server = Server({'ping': pingpong, 'echo': lambda stream, x: x})
+        server.listen(0)
+
+        remote = rpc(ip='127.0.0.1', port=server.port)
+        for i in range(3):
+            yield remote.ping()
+        yield remote.echo(x=b'0' * 10000)
+
+        metrics = yield remote.metrics()
+        assert metrics['buckets'] == LATENCY_BUCKETS
+        ping = metrics['ops']['ping']
+        assert ping['count'] == 3
+        for stage in ['deserialize', 'handler', 'serialize']:
+            assert sum(ping[stage]) == 3
+            assert len(ping[stage]) == len(LATENCY_BUCKETS) + 1
+            assert ping[stage + '-time'] >= 0
+        echo = metrics['ops']['echo']
+        assert echo['bytes-in'] > 10000
+        assert echo['bytes-out'] > 10000
+        assert metrics['ops']['metrics']['count'] == 1
+
+        remote.close_streams()
+        server.stop()
+
+    loop.run_sync(f)
+
+
+class SlowToLoad(object):
+    """ Takes half a second to unpickle """
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __setstate__(self, state):
+        sleep(0.5)
+        self.__dict__.update(state)
+
+
+def test_offload_large_messages(loop, monkeypatch):
+    monkeypatch.setattr(core, 'OFFLOAD_THRESHOLD', 1000)
+
+    @gen.coroutine
+    def f():
+        server = Server({'ping': pingpong, 'echo': lambda stream, x: x})
+        server.listen(0)
+        before = offload_stats.copy()
+
+        slow = rpc(ip='127.0.0.1', port=server.port)
+        fast = rpc(ip='127.0.0.1', port=server.port)
+        future = slow.echo(x=SlowToLoad(b'0' * 2000))
+        yield gen.sleep(0.05)
+        start = time()
+        response = yield fast.ping()  # not blocked by the slow message
+        assert response == b'pong'
+        assert time() - start < 0.3
+
+        result = yield future
+        assert result.payload == b'0' * 2000
+        assert offload_stats['offloaded-loads'] >= before['offloaded-loads'] + 2
+        assert offload_stats['offloaded-time'] >= before['offloaded-time'] + 1
+
+        response = yield fast.echo(x=b'0' * 5000)
+        assert response == b'0' * 5000
+        assert offload_stats['offloaded-dumps'] >= before['offloaded-dumps'] + 2
+
+        metrics = yield fast.metrics()
+        assert metrics['offload']['offloaded-loads'] >= 2
+
+        slow.close_streams()
+        fast.close_streams()
+        server.stop()
+
+    loop.run_sync(f, timeout=10)
+
+
+def test_write_keeps_order_with_offload(loop, monkeypatch):
+    monkeypatch.setattr(core, 'OFFLOAD_THRESHOLD', 1000)
+
+    @gen.coroutine
+    def f():
+        a, b = socket.socketpair()
+        sa, sb = IOStream(a), IOStream(b)
+
+        msgs = [{'i': i, 'data': b'0' * (5000 if i % 2 else 10)}
+                for i in range(10)]
+        yield [write(sa, msg) for msg in msgs]
+        for msg in msgs:
+            result = yield read(sb)
+            assert result == msg
+
+        sa.close()
+        sb.close()
+
+    loop.run_sync(f)
+
+
+def test_connection_pool(loop):
+    @gen.coroutine
+    def slowping(stream, delay=0.05):
+        yield gen.sleep(delay)
+        raise gen.Return(b'pong')
+
+    @gen.coroutine
+    def f():
+        servers = [Server({'ping': slowping}) for i in range(3)]
+        for server in servers:
+            server.listen(0)
+
+        pool = ConnectionPool(limit_per_address=2, max_idle=3)
+        remote = pool(ip='127.0.0.1', port=servers[0].port)
+        results = yield [remote.ping() for i in range(6)]
+        assert results == [b'pong'] * 6
+        assert pool.counts['misses'] == 2  # never more than two streams
+        assert pool.counts['hits'] == 4
+        assert pool.open == 2
+
+        for server in servers[1:]:
+            yield pool(addr=('127.0.0.1', server.port)).ping()
+        assert pool.open == 3  # least recently used stream evicted
+        assert pool.counts['evictions'] == 1
+
+        pool.idle_timeout = 0
+        pool.collect()
+        assert pool.open == 0
+
+        for server in servers:
+            server.stop()
+
+    loop.run_sync(f)
+
+
+def test_connection_pool_reconnects(loop):
+    @gen.coroutine
+    def f():
+        server = Server({'ping': pingpong})
+        server.listen(0)
+
+        pool = connection_pool()
+        assert connection_pool() is pool
+        remote = pool(ip='127.0.0.1', port=server.port)
+        assert (yield remote.ping()) == b'pong'
+
+        yield remote.ping(close=True)  # server closes the stream on its end
+        assert (yield remote.ping()) == b'pong'
+        assert pool.open == 1
+
+        server.stop()
+        pool.close()
+
+    loop.run_sync(f)
+
+
+def test_connection_pool_does_not_resend_after_write(loop):
+    calls = []
+
+    def count_and_close(stream):
+        calls.append(1)
+        stream.close()
+
+    @gen.coroutine
+    def f():
+        server = Server({'ping': pingpong, 'count': count_and_close})
+        server.listen(0)
+
+        pool = ConnectionPool()
+        remote = pool(ip='127.0.0.1', port=server.port)
+        assert (yield remote.ping()) == b'pong'
+
+        with pytest.raises(StreamClosedError):
+            yield remote.count()  # over the reused stream
+        assert calls == [1]
+        assert (yield remote.ping()) == b'pong'
+
+        server.stop()
+        pool.close()
+
+    loop.run_sync(f)
+
+
 @slow
 def test_large_packets(loop):
     """ tornado has a 100MB cap by default """
@@ -29,7 +29,7 @@ from distributed.executor import (Executor, Future, CompatibleExecutor, _wait,
         default_executor, _first_completed, ensure_default_get, futures_of)
 from distributed.scheduler import Scheduler
 from distributed.sizeof import sizeof
-from distributed.utils import ignoring, sync, tmp_text
+from distributed.utils import ignoring, sync, tmp_text, io_bound
 from distributed.utils_test import (cluster, cluster_center, slow,
         _test_cluster, _test_scheduler, loop, inc, dec, div, throws,
         gen_cluster, gen_test, double, deep)
@@ -104,6 +104,115 @@ def test_map(s, a, b):
 
     yield e._shutdown()
 
+def getpid(x=None):
+    return os.getpid()
+
+
+@gen_cluster()
+def test_submit_map_processes(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    x = e.submit(getpid, processes=True)
+    pid = yield x._result()
+    assert pid != os.getpid()
+    assert s.tasks[x.key]['processes'] is True
+
+    L = e.map(getpid, range(5), processes=True)
+    pids = yield e._gather(L)
+    assert os.getpid() not in pids
+    assert all(s.tasks[f.key]['processes'] is True for f in L)
+
+    y = e.submit(getpid, 10)
+    pid = yield y._result()
+    assert pid == os.getpid()
+    assert 'processes' not in s.tasks[y.key]
+
+    yield e._shutdown()
+
+
+def add_len(x, y=()):
+    return x + len(y)
+
+
+@gen_cluster()
+def test_map_sends_function_and_large_kwargs_once(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    y = list(range(10000))
+    L = e.map(add_len, range(20), y=y)
+    results = yield e._gather(L)
+    assert results == [i + 10000 for i in range(20)]
+    assert len(s.blobs) == 2
+    for f in L:
+        assert set(s.tasks[f.key]['hashes']) == {'function', 'kwargs'}
+    assert all(w.blob_cache for w in [a, b])
+    assert all(len(w.blob_cache) <= 2 for w in [a, b])
+
+    del L, f
+    start = time()
+    while s.blobs or s.blob_refs:
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+
+    yield e._shutdown()
+
+
+def append_len(x, y=None):
+    y.append(x)
+    return len(y)
+
+
+@gen_cluster()
+def test_map_tasks_get_their_own_copy_of_shared_kwargs(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    y = bytearray(20000)  # not copied by pack_data, unlike lists
+    L = e.map(append_len, range(20), y=y)
+    results = yield e._gather(L)
+    assert results == [20001] * 20
+
+    yield e._shutdown()
+
+
+@gen_cluster()
+def test_map_does_not_cache_single_use_arguments(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    L = e.map(len, [list(range(i, i + 10000)) for i in range(10)])
+    results = yield e._gather(L)
+    assert results == [10000] * 10
+    assert len(s.blobs) == 1  # just the function
+    for w in [a, b]:
+        assert sum(map(len, w.blob_cache.values())) < 10000
+        assert w.blob_cache_nbytes == sum(map(len, w.blob_cache.values()))
+
+    yield e._shutdown()
+
+
+@io_bound
+def read(x):
+    return x
+
+
+@gen_cluster()
+def test_submit_map_io_bound(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    x = e.submit(read, 1)
+    L = e.map(read, range(5))
+    y = e.submit(inc, 1)
+    results = yield e._gather([x, y] + L)
+    assert results == [1, 2] + list(range(5))
+    assert s.io_keys == {x.key} | {f.key for f in L}
+
+    yield e._shutdown()
+
+
 @gen_cluster()
 def test_compatible_map(s, a, b):
     e = CompatibleExecutor((s.ip, s.port), start=False)
@@ -1022,6 +1131,59 @@ def test_nbytes_determines_worker(s, a, b):
     yield e._shutdown()
 
 
+@pytest.mark.skipif(sys.platform!='linux',
+                    reason="Need 127.0.0.2 to mean localhost")
+@gen_cluster([('127.0.0.1', 1), ('127.0.0.2', 1)])
+def test_fetched_dependencies_kept_as_replicas(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    x = e.submit(inc, 1, workers=[a.ip])
+    ys = [e.submit(add, x, i, workers=[b.ip]) for i in range(5)]
+    yield e._gather(ys)
+
+    assert b.data[x.key] == 2
+    assert s.who_has[x.key] == {a.address, b.address}
+    assert x.key in s.has_what[b.address]
+    assert a.metrics['get_data']['count'] == 1  # fetched only once
+    s.validate()
+
+    key = x.key
+    del x, ys
+    start = time()
+    while key in a.data or key in b.data:
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert key not in s.who_has
+
+    yield e._shutdown()
+
+
+@pytest.mark.skipif(sys.platform!='linux',
+                    reason="Need 127.0.0.2 to mean localhost")
+@gen_cluster([('127.0.0.1', 1), ('127.0.0.2', 1)])
+def test_replicas_fetched_for_failed_tasks_are_tracked(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    x = e.submit(inc, 1, workers=[a.ip])
+    y = e.submit(div, x, 0, workers=[b.ip])
+    yield _wait([y])
+    assert y.status == 'error'
+
+    assert b.data[x.key] == 2
+    assert s.who_has[x.key] == {a.address, b.address}
+
+    key = x.key
+    del x, y
+    start = time()
+    while key in a.data or key in b.data:
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+
+    yield e._shutdown()
+
+
 @gen_cluster()
 def test_pragmatic_move_small_data_to_large_data(s, a, b):
     e = Executor((s.ip, s.port), start=False)
@@ -2324,6 +2486,22 @@ def test_async_persist(s, a, b):
     yield e._shutdown()
 
 
+@gen_cluster()
+def test_compute_persisted_before_it_finishes(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    from dask.imperative import do
+    x = do(slowinc)(1)
+    y = do(inc)(x)
+    yy = e.persist(y)
+    future = e.compute(yy)
+    result = yield future._result()
+    assert result == 3
+
+    yield e._shutdown()
+
+
 def test_persist(loop):
     pytest.importorskip('dask.array')
     import dask.array as da
@@ -2424,3 +2602,15 @@ def test_fatally_serialized_input(s):
         yield gen.sleep(0.01)
 
     yield e._shutdown()
+
+
+@gen_cluster()
+def test_submit_before_start(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    x = e.submit(inc, 1)
+    yield e._start()
+
+    result = yield x._result()
+    assert result == 2
+
+    yield e._shutdown()
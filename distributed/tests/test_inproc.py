@@ -0,0 +1,84 @@
+from operator import add
+
+from tornado.iostream import StreamClosedError
+import pytest
+
+from distributed import Executor
+from distributed.core import Server, rpc, connect, read, write, pingpong
+from distributed.inproc import stream_pair, servers, InProcStream, is_inproc
+from distributed.utils_test import gen_cluster, gen_test, inc
+
+
+def test_is_inproc():
+    assert is_inproc('inproc://123')
+    assert is_inproc(u'inproc://123')
+    assert not is_inproc('127.0.0.1')
+    assert not is_inproc(None)
+
+
+@gen_test()
+def test_stream_pair():
+    a, b = stream_pair()
+    msg = {'op': 'ping', 'data': [1, 2, 3]}
+    yield write(a, msg)
+    result = yield read(b)
+    assert result == msg
+    assert result is not msg
+    assert result['data'] is msg['data']  # not serialized
+
+    yield write(b, 'x')
+    a.close()
+    assert b.closed() is False
+    with pytest.raises(StreamClosedError):
+        yield read(b)
+    with pytest.raises(StreamClosedError):
+        yield read(a)
+    with pytest.raises(StreamClosedError):
+        yield write(b, 'y')
+
+
+@gen_test()
+def test_server():
+    server = Server({'ping': pingpong, 'add': lambda stream, x, y: x + y})
+    server.listen('inproc://')
+    assert server.ip.startswith('inproc://')
+    assert not server._sockets
+    assert servers[(server.ip, server.port)] is server
+
+    remote = rpc(ip=server.ip, port=server.port)
+    response = yield remote.ping()
+    assert response == b'pong'
+    response = yield remote.add(x=1, y=2)
+    assert response == 3
+    assert server.metrics['add']['count'] == 1
+
+    server.stop()
+    assert (server.ip, server.port) not in servers
+    with pytest.raises(StreamClosedError):
+        yield connect(server.ip, server.port, timeout=0.05)
+
+
+@gen_cluster(port='inproc://')
+def test_inproc_cluster(s, a, b):
+    assert s.ip.startswith('inproc://')
+    assert not s._sockets and not a._sockets and not b._sockets
+    assert set(s.ncores) == {a.address, b.address}
+
+    e = Executor('%s:%d' % (s.ip, s.port), start=False)
+    yield e._start()
+    assert isinstance(e.scheduler_stream, InProcStream)
+
+    x = e.submit(inc, 1)
+    result = yield x._result()
+    assert result == 2
+
+    [y] = yield e._scatter([10], workers=[a.address])
+    [z] = yield e._scatter([20], workers=[b.address])
+    w = e.submit(add, y, z)  # one worker gets data from the other
+    result = yield w._result()
+    assert result == 30
+
+    results = yield e._gather([x, y, z])
+    assert results == [2, 10, 20]
+
+    yield e._shutdown()
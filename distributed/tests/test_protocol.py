@@ -0,0 +1,153 @@
+import pytest
+
+from distributed.protocol import (dumps, loads, msgpack, MSGPACK, PICKLE,
+        register_serialization, compressions, compression_stats,
+        maybe_compress, decompress)
+from distributed.utils import nbytes
+
+
+def test_protocol():
+    for msg in [1, 'a', b'a', {'x': 1}, {b'x': 1}, {'x': b''}, {}]:
+        assert loads(dumps(msg)) == msg
+
+
+def test_msgpack_control_messages():
+    if msgpack is None:
+        pytest.skip("msgpack not installed")
+    msgs = [{'op': 'compute', 'key': ('x', 1),
+             'who_has': {'y': {('alice', 8000)}}, 'report': True, 'serialized': True, 'task': b'123'},
+            {'op': 'key-in-memory', 'key': 'x', 'workers': [('alice', 8000)]},
+            {'op': 'delete_data', 'keys': frozenset(['x', 'y']), 'nbytes': 1.5,
+             'close': None},
+            (b'OK', {'nbytes': {('x', 1): 100}})]
+    for msg in msgs:
+        frames = dumps(msg)
+        assert frames[0] == MSGPACK
+        result = loads(frames)
+        assert result == msg
+        assert type(result) == type(msg)
+
+
+def test_loads_reports_unknown_header():
+    with pytest.raises(ValueError):
+        loads([b'\xff'])
+
+
+def test_pickle_fallback():
+    from operator import add
+    from collections import defaultdict
+    for msg in [{'op': 'compute', 'function': add}, defaultdict(set), 2**100]:
+        frames = dumps(msg)
+        assert frames[0] == PICKLE
+        assert loads(frames) == msg
+        assert type(loads(frames)) == type(msg)
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def test_register_serialization():
+    register_serialization(Point, lambda p: ({'x': p.x}, [str(p.y).encode()]),
+                           lambda h, frames: Point(h['x'], int(frames[0])))
+    frames = dumps({'point': Point(1, 2)})
+    assert frames[0] == PICKLE
+    assert len(frames) == 3
+    p = loads(frames)['point']
+    assert (p.x, p.y) == (1, 2)
+
+
+def test_numpy_out_of_band():
+    np = pytest.importorskip('numpy')
+    x = np.arange(100000)
+    msg = {'op': 'update_data', 'data': {'x': x, 'y': np.ones(5)}}
+    frames = dumps(msg)
+    assert len(frames) == 3  # small array stays inline
+    assert len(frames[1]) < 1000
+
+    result = loads([bytes(frame) for frame in frames])
+    assert (result['data']['x'] == x).all()
+    assert (result['data']['y'] == 1).all()
+
+
+def test_numpy_received_arrays_are_writeable():
+    np = pytest.importorskip('numpy')
+    x = np.arange(100000)
+    for frames in [[bytes(frame) for frame in dumps(x)],
+                   dumps(x, compression='zlib')]:
+        y = loads(frames)
+        y[0] = 100
+        assert y[0] == 100
+    assert x[0] == 0
+
+
+def test_numpy_writable_frames_are_not_copied():
+    np = pytest.importorskip('numpy')
+    x = np.arange(100000)
+    frames = [bytearray(frame) if len(frame) > 1000 else frame
+              for frame in dumps(x, compression=None)]
+    y = loads(frames)
+    y[0] = 100
+    assert loads(frames)[0] == 100  # y lives in our frame
+
+
+def test_numpy_layouts():
+    np = pytest.importorskip('numpy')
+    x = np.arange(200000, dtype='f8').reshape((400, 500))
+    for y in [x, x.T, x[::2], np.asfortranarray(x),
+              np.array(['a' * 10] * 10000, dtype=object),
+              x.astype('M8[ns]'), np.zeros(100000, dtype=[('a', 'i4'),
+                                                          ('b', 'f8')])]:
+        frames = dumps(y)
+        z = loads([bytes(frame) for frame in frames])
+        assert z.dtype == y.dtype
+        assert z.shape == y.shape
+        assert (z == y).all()
+
+
+def test_pandas_out_of_band():
+    pd = pytest.importorskip('pandas')
+    np = pytest.importorskip('numpy')
+    df = pd.DataFrame({'x': np.arange(100000), 'y': np.ones(100000),
+                       'z': ['a'] * 100000})
+    frames = dumps(df)
+    assert len(frames) > 1
+    result = loads([bytes(frame) for frame in frames])
+    assert result.equals(df)
+
+
+@pytest.mark.parametrize('compression', list(compressions))
+def test_compression(compression):
+    before = compression_stats['frames-compressed']
+    msg = {'x': b'0' * 1000000, 'y': 1}
+    frames = dumps(msg, compression=compression)
+    if compression is not None:
+        assert len(frames[0]) == len(frames)
+        assert sum(map(len, frames)) < 100000
+        assert compression_stats['frames-compressed'] > before
+    else:
+        assert len(frames[0]) == 1
+        assert compression_stats['frames-compressed'] == before
+    assert loads(frames) == msg
+
+
+def test_compress_memoryview_of_wide_items():
+    from array import array
+    x = array('d', [0] * 100000)
+    frame = memoryview(x)
+    assert nbytes(frame) == 800000
+    code, compressed = maybe_compress(frame, 'zlib')
+    assert code == compressions['zlib']['code']
+    assert decompress(code, compressed) == frame.tobytes()
+
+
+def test_incompressible_frames_sent_raw():
+    import os
+    data = os.urandom(100000)
+    code, frame = maybe_compress(data, 'zlib')
+    assert code == compressions[None]['code']
+    assert frame is data
+    frames = dumps({'x': data}, compression='zlib')
+    assert len(frames[0]) == 1
@@ -1,7 +1,7 @@
 from collections import defaultdict
 from copy import deepcopy
 from operator import add
-from time import time
+from time import sleep, time
 
 from dask.core import get_deps
 from toolz import merge, concat, valmap
@@ -11,11 +11,14 @@ from tornado.gen import TimeoutError
 import pytest
 
 from distributed import Center, Nanny, Worker
-from distributed.core import connect, read, write, rpc, loads
+from distributed.batched import BatchedStream
+from distributed.core import connect, read, write, rpc, dumps, loads
 from distributed.client import WrappedKey
 from distributed.scheduler import (validate_state, heal, update_state,
-        decide_worker, assign_many_tasks, heal_missing_data, Scheduler,
-        _maybe_complex, dumps_function, dumps_task, apply)
+        decide_worker, assign_many_tasks, heal_missing_data, ensure_in_play,
+        Scheduler,
+        _maybe_complex, dumps_function, dumps_task, apply, hash_blobs)
+from distributed.utils import io_bound
 from distributed.utils_test import inc, ignoring, dec
 
 
@@ -344,6 +347,33 @@ def test_decide_worker_with_loose_restrictions():
 
 
 
+def test_decide_worker_with_host_index():
+    dependencies = {'x': set(), 'y': {'z'}}
+    alice1, alice2, bob = ('alice', 8000), ('alice', 8001), ('bob', 8000)
+    stacks = {alice1: [1, 2], alice2: [1], bob: []}
+    hosts = {'alice': {alice1, alice2}, 'bob': {bob}}
+    restrictions = {'x': frozenset({'alice', 'charlie'}),
+                    'y': frozenset({'alice'})}
+
+    result = decide_worker(dependencies, stacks, {}, restrictions, set(), {},
+                           'x', hosts=hosts)
+    assert result == alice2
+
+    who_has = {'z': {alice1, bob}}
+    nbytes = {'z': 100}
+    result = decide_worker(dependencies, stacks, who_has, restrictions, set(),
+                           nbytes, 'y', hosts=hosts)
+    assert result == alice1
+
+    restrictions = {'x': frozenset({'charlie'})}
+    with pytest.raises(ValueError):
+        decide_worker(dependencies, stacks, {}, restrictions, set(), {}, 'x',
+                      hosts=hosts)
+    result = decide_worker(dependencies, stacks, {}, restrictions, {'x'}, {},
+                           'x', hosts=hosts)
+    assert result == bob
+
+
 def test_decide_worker_without_stacks():
     with pytest.raises(ValueError):
         result = decide_worker({'x': []}, [], {}, {}, set(), {}, 'x')
@@ -447,6 +477,28 @@ def test_assign_many_tasks_with_restrictions():
     assert set(concat(new_stacks.values())) == set(concat(stacks.values()))
 
 
+def test_assign_many_tasks_by_occupancy():
+    alice, bob = ('alice', 8000), ('bob', 8000)
+    keys = ['x-%d' % i for i in range(12)]
+    dependencies = {k: set() for k in keys}
+    waiting = {k: set() for k in keys}
+    keyorder = {k: i for i, k in enumerate(keys)}
+    stacks = {alice: [], bob: []}
+    occupancy = {alice: 3.0, bob: 0}
+    ncores = {alice: 2, bob: 1}
+    task_duration = {'x': 1.0}
+
+    assign_many_tasks(dependencies, waiting, keyorder, {}, stacks, {}, set(),
+                      {}, keys, occupancy=occupancy, ncores=ncores,
+                      task_duration=task_duration)
+
+    # both expect to finish after five seconds
+    assert len(stacks[alice]) == 7
+    assert len(stacks[bob]) == 5
+    assert occupancy == {alice: 10.0, bob: 5.0}
+    assert sorted(stacks[alice] + stacks[bob]) == sorted(keys)
+
+
 def test_fill_missing_data():
     dsk = {'x': 1, 'y': (inc, 'x'), 'z': (inc, 'y')}
     dependencies, dependents = get_deps(dsk)
@@ -477,6 +529,27 @@ def test_fill_missing_data():
     assert in_play == e_in_play
 
 
+def test_ensure_in_play():
+    dsk = {'w': 0, 'x': 1, 'y': (add, 'w', 'x'), 'z': (inc, 'y')}
+    dependencies, dependents = get_deps(dsk)
+
+    who_has = {'w': {alice}}
+    in_play = {'w', 'z'}
+    waiting = {'z': {'y'}}
+    waiting_data = {'w': set(), 'z': set()}
+
+    added = ensure_in_play(['y', 'z'], dependencies, dependents, who_has,
+                           in_play, waiting, waiting_data)
+
+    assert added == {'x', 'y'}
+    assert in_play == {'w', 'x', 'y', 'z'}
+    assert waiting == {'x': set(), 'y': {'x'}, 'z': {'y'}}
+    assert waiting_data == {'w': {'y'}, 'x': {'y'}, 'y': {'z'}, 'z': set()}
+
+    assert not ensure_in_play(['y'], dependencies, dependents, who_has,
+                              in_play, waiting, waiting_data)
+
+
 from distributed.utils_test import gen_cluster, gen_test
 from distributed.utils import All
 from tornado import gen
@@ -488,7 +561,8 @@ def div(x, y):
 def test_scheduler(s, a, b):
     stream = yield connect(s.ip, s.port)
     yield write(stream, {'op': 'register-client', 'client': 'ident'})
-    msg = yield read(stream)
+    bstream = BatchedStream(stream)
+    msg = yield bstream.recv()
     assert msg['op'] == 'stream-start'
 
     # Test update graph
@@ -502,7 +576,7 @@ def test_scheduler(s, a, b):
                          'keys': ['x', 'z'],
                          'client': 'ident'})
     while True:
-        msg = yield read(stream)
+        msg = yield bstream.recv()
         if msg['op'] == 'key-in-memory' and msg['key'] == 'z':
             break
 
@@ -518,7 +592,7 @@ def test_scheduler(s, a, b):
                          'client': 'ident'})
 
     while True:
-        msg = yield read(stream)
+        msg = yield bstream.recv()
         if msg['op'] == 'task-erred' and msg['key'] == 'b':
             break
 
@@ -526,7 +600,7 @@ def test_scheduler(s, a, b):
     yield write(stream, {'op': 'missing-data', 'missing': ['z']})
 
     while True:
-        msg = yield read(stream)
+        msg = yield bstream.recv()
         if msg['op'] == 'key-in-memory' and msg['key'] == 'z':
             break
 
@@ -540,7 +614,7 @@ def test_scheduler(s, a, b):
                          'keys': ['zz'],
                          'client': 'ident'})
     while True:
-        msg = yield read(stream)
+        msg = yield bstream.recv()
         if msg['op'] == 'key-in-memory' and msg['key'] == 'zz':
             break
 
@@ -593,6 +667,7 @@ def test_multi_queues(s, a, b):
 def test_server(s, a, b):
     stream = yield connect('127.0.0.1', s.port)
     yield write(stream, {'op': 'register-client', 'client': 'ident'})
+    bstream = BatchedStream(stream)
     yield write(stream, {'op': 'update-graph',
                          'tasks': {'x': (inc, 1), 'y': (inc, 'x')},
                          'dependencies': {'x': set(), 'y': {'x'}},
@@ -600,13 +675,15 @@ def test_server(s, a, b):
                          'client': 'ident'})
 
     while True:
-        msg = yield read(stream)
+        msg = yield bstream.recv()
         if msg['op'] == 'key-in-memory' and msg['key'] == 'y':
             break
 
     yield write(stream, {'op': 'close-stream'})
-    msg = yield read(stream)
+    msg = yield bstream.recv()
     assert msg == {'op': 'stream-closed'}
+    with pytest.raises(StreamClosedError):
+        yield bstream.recv()
     assert stream.closed()
     stream.close()
 
@@ -620,7 +697,7 @@ def test_server_listens_to_other_ops(s, a, b):
 
 @gen_cluster()
 def test_remove_worker_from_scheduler(s, a, b):
-    dsk = {('x', i): (inc, i) for i in range(10)}
+    dsk = {('x', i): (inc, i) for i in range(100)}
     s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
                    dependencies={k: set() for k in dsk})
     assert s.stacks[a.address]
@@ -634,6 +711,270 @@ def test_remove_worker_from_scheduler(s, a, b):
     s.validate()
 
 
+@gen_cluster()
+def test_remove_worker_recomputes_only_lost_keys(s, a, b):
+    dsk = merge({('x', i): (inc, i) for i in range(10)},
+                {('y', i): (inc, ('x', i)) for i in range(10)})
+    ykeys = [('y', i) for i in range(10)]
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=ykeys,
+                   client='client',
+                   dependencies=merge({('x', i): set() for i in range(10)},
+                                      {('y', i): {('x', i)}
+                                       for i in range(10)}))
+    a.data['z'] = 1
+    s.update_data(who_has={'z': [a.address]}, nbytes={'z': 10})
+
+    start = time()
+    while not all(s.who_has.get(k) for k in ykeys):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    lost = {k for k in ykeys if s.who_has[k] == {a.address}}
+    kept = {k: s.who_has[k] for k in ykeys if k not in lost}
+
+    s.remove_worker(address=a.address)
+    assert 'z' not in s.who_has and 'z' not in s.in_play
+    assert all(k in s.in_play and k not in s.who_has for k in lost)
+    assert {k: s.who_has[k] for k in kept} == kept
+    s.validate(allow_overlap=True)
+
+    start = time()
+    while not all(s.who_has.get(k) for k in ykeys):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert all(b.data[('y', i)] == i + 2 for i in range(10))
+
+
+@gen_cluster()
+def test_remove_worker_pulls_back_dependents(s, a, b):
+    s.update_graph(tasks={'x': dumps_task((inc, 1))}, keys=['x'],
+                   client='client', dependencies={'x': set()})
+    start = time()
+    while not s.who_has.get('x'):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    victim, = s.who_has['x']
+    survivor, = set(s.ncores) - {victim}
+
+    s.task_duration['y'] = 1  # worth moving x to steal these
+    dsk = {('y', i): (slowinc, 'x') for i in range(30)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: {'x'} for k in dsk})
+    assert any(k in s.processing[survivor] or k in s.stacks[survivor]
+               for k in dsk)
+
+    s.remove_worker(address=victim)
+    assert s.processing[survivor] | set(s.stacks[survivor]) == {'x'}
+    assert all(s.waiting[k] == {'x'} for k in dsk)
+    s.validate()
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+
+
+@gen_cluster()
+def test_oversubscription(s, a, b):
+    dsk = {('x', i): (inc, i) for i in range(100)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: set() for k in dsk})
+    for w in [a, b]:
+        assert len(s.processing[w.address]) == w.ncores * s.oversubscription
+        assert s.stacks[w.address]
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert len(a.data) + len(b.data) == len(dsk)
+
+
+@io_bound
+def slow_read(x):
+    sleep(0.01)
+    return x
+
+
+@gen_cluster()
+def test_io_tasks_dont_occupy_cores(s, a, b):
+    reads = {('read', i): (slow_read, i) for i in range(40)}
+    dsk = merge(reads, {('x', i): (inc, i) for i in range(100)})
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: set() for k in dsk})
+    assert s.io_keys == set(reads)
+    for w in [a, b]:
+        processing = s.processing[w.address]
+        assert len(processing & s.io_keys) == w.io_threads
+        assert len(processing - s.io_keys) == w.ncores * s.oversubscription
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert len(a.data) + len(b.data) == len(dsk)
+
+
+def slowinc(x):
+    sleep(0.02)
+    return x + 1
+
+
+@gen_cluster()
+def test_steal_work(s, a, b):
+    a.data['x'] = 1
+    s.update_data(who_has={'x': [a.address]}, nbytes={'x': 10})
+    dsk = {('y', i): (slowinc, 'x') for i in range(40)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: {'x'} for k in dsk})
+    assert not s.stacks[b.address]  # all placed with the data on a
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert s.task_duration['y'] > 0.01
+    assert s.steal_counts['steals'] == len(s.steal_log) > 0
+    assert s.steal_counts['finished'] == s.steal_counts['stolen'] > 0
+    assert any(k in b.data for k in dsk)
+    assert not s.stolen
+
+
+def fake_workers(s, workers, ncores=1):
+    """ Register workers on a scheduler that isn't running """
+    s.worker_queues = {}
+    for w in workers:
+        s.ncores[w] = ncores
+        s.has_what[w] = set()
+        s.processing[w] = set()
+        s.stacks[w] = []
+        s.io_stacks[w] = []
+        s.occupancy[w] = 0
+        s.durations[w] = {}
+        s.hosts[w[0]].add(w)
+        s.worker_queues[w] = Queue()
+        s.worker_services[w] = {}
+
+
+def run_fake_workers(s):
+    """ Finish everything that the scheduler sends to fake workers """
+    while any(s.processing.values()):
+        for w, processing in s.processing.items():
+            for key in list(processing):
+                s.mark_task_finished(key, w, 8)
+
+
+def test_occupancy_removes_the_duration_it_added():
+    s = Scheduler()
+    w = ('alice', 8000)
+    fake_workers(s, [w])
+
+    dsk = {('x', i): (inc, i) for i in range(10)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: set() for k in dsk})
+    assert s.occupancy[w] == 10 * 0.5
+
+    # much faster than the default estimate the others were placed with
+    key = next(iter(s.processing[w]))
+    s.mark_task_finished(key, w, 8, compute_start=0, compute_stop=0.001)
+    assert s.task_duration['x'] == 0.001
+    assert abs(s.occupancy[w] - 9 * 0.5) < 1e-9
+    assert set(s.durations[w]) == s.processing[w] | set(s.stacks[w])
+
+    while s.processing[w]:
+        key = next(iter(s.processing[w]))
+        s.mark_task_finished(key, w, 8, compute_start=0, compute_stop=0.001)
+        assert abs(s.occupancy[w] - 0.5 * len(s.durations[w])) < 1e-9
+    assert s.occupancy[w] == 0 and not s.durations[w]
+
+
+def test_steal_work_releases_skipped_keys():
+    s = Scheduler()
+    victim, thief = ('alice', 8000), ('bob', 8000)
+    fake_workers(s, [victim, thief])
+
+    keys = ['x-%d' % i for i in range(4)]
+    for key in keys:
+        s.tasks[key] = dumps_task((inc, 1))
+        s.dependencies[key] = {'missing'}
+    s.stacks[victim].extend(['released'] + keys)
+    for key in s.stacks[victim]:
+        s.add_occupancy(victim, key)
+
+    assert s.steal_work(thief, 2, victim) == 2
+    assert 'released' not in s.durations[victim]
+    assert s.occupancy[victim] == 2 * 0.5
+    assert s.stacks[victim] == ['x-2', 'x-3']
+    assert s.stacks[thief] == ['x-1', 'x-0']
+    assert 'missing' not in s.who_has
+
+
+def test_compact_state():
+    dsk = {('x', i): (inc, i) for i in range(20)}
+    dsk.update({('y', i): (add, ('x', i), ('x', (i + 1) % 20))
+                for i in range(20)})
+    dependencies, dependents = get_deps(dsk)
+
+    states = []
+    for compact_state in [False, True]:
+        s = Scheduler(compact_state=compact_state)
+        assert (s.table is not None) == compact_state
+        fake_workers(s, [(alice, 8000), (bob, 8000)], ncores=2)
+
+        s.update_graph(tasks=valmap(dumps_task, dsk), keys=[('y', 0)],
+                       client='client', dependencies=dependencies)
+        assert s.dependents[('x', 1)] == {('y', 0), ('y', 1)}
+        s.validate()
+
+        run_fake_workers(s)
+        assert s.who_has[('y', 0)]
+        assert ('y', 0) in s.in_play and not s.waiting
+        s.validate()
+
+        s.client_releases_keys(keys=[('y', 0)], client='client')
+        states.append((set(s.tasks), set(s.in_play),
+                       {k: set(v) for k, v in s.dependencies.items()},
+                       {k: set(v) for k, v in s.waiting_data.items()}))
+
+    assert states[0] == states[1]
+
+
+@gen_cluster()
+def test_dont_steal_expensive_data(s, a, b):
+    a.data['x'] = 1
+    s.update_data(who_has={'x': [a.address]}, nbytes={'x': 1e12})
+    dsk = {('y', i): (slowinc, 'x') for i in range(20)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: {'x'} for k in dsk})
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+    assert not s.steal_counts['stolen']
+    assert s.steal_counts['rejected']
+    assert not any(k in b.data for k in dsk)
+
+
+@gen_cluster()
+def test_restrictions_share_resolved_hosts(s, a, b):
+    assert s.hosts == {'127.0.0.1': {a.address, b.address}}
+    dsk = {('x', i): (inc, i) for i in range(10)}
+    s.update_graph(tasks=valmap(dumps_task, dsk), keys=list(dsk),
+                   client='client', dependencies={k: set() for k in dsk},
+                   restrictions={k: ['localhost'] for k in dsk})
+    assert len(s.restriction_sets) == 1
+    assert len({id(s.restrictions[k]) for k in dsk}) == 1
+    assert s.restrictions[('x', 0)] == {'127.0.0.1'}
+
+    start = time()
+    while not all(s.who_has.get(k) for k in dsk):
+        yield gen.sleep(0.01)
+        assert time() < start + 5
+
+    s.remove_worker(address=a.address)
+    assert s.hosts == {'127.0.0.1': {b.address}}
+
+
 @gen_cluster()
 def test_add_worker(s, a, b):
     w = Worker(s.ip, s.port, ncores=3, ip='127.0.0.1')
@@ -794,27 +1135,28 @@ def test_filtered_communication(s, a, b):
     f = yield connect(ip=s.ip, port=s.port)
     yield write(e, {'op': 'register-client', 'client': 'e'})
     yield write(f, {'op': 'register-client', 'client': 'f'})
-    yield read(e)
-    yield read(f)
+    e, f = BatchedStream(e), BatchedStream(f)
+    yield e.recv()
+    yield f.recv()
 
     assert set(s.streams) == {'e', 'f'}
 
-    yield write(e, {'op': 'update-graph',
-                    'tasks': {'x': (inc, 1), 'y': (inc, 'x')},
-                    'dependencies': {'x': set(), 'y': {'x'}},
-                    'client': 'e',
-                    'keys': ['y']})
+    e.send({'op': 'update-graph',
+            'tasks': {'x': (inc, 1), 'y': (inc, 'x')},
+            'dependencies': {'x': set(), 'y': {'x'}},
+            'client': 'e',
+            'keys': ['y']})
 
-    yield write(f, {'op': 'update-graph',
-                    'tasks': {'x': (inc, 1), 'z': (add, 'x', 10)},
-                    'dependencies': {'x': set(), 'z': {'x'}},
-                    'client': 'f',
-                    'keys': ['z']})
+    f.send({'op': 'update-graph',
+            'tasks': {'x': (inc, 1), 'z': (add, 'x', 10)},
+            'dependencies': {'x': set(), 'z': {'x'}},
+            'client': 'f',
+            'keys': ['z']})
 
-    msg = yield read(e)
+    msg = yield e.recv()
     assert msg['op'] == 'key-in-memory'
     assert msg['key'] == 'y'
-    msg = yield read(f)
+    msg = yield f.recv()
     assert msg['op'] == 'key-in-memory'
     assert msg['key'] == 'z'
 
@@ -848,3 +1190,37 @@ def test_dumps_task():
     assert loads(d['function'])(1, 2) == 3
     assert loads(d['args']) == (1,)
     assert loads(d['kwargs']) == {'y': 10}
+
+    d = dumps_task((apply, inc, (tuple, [1]), {}))
+    assert set(d) == {'function', 'args', 'kwargs'}
+    assert loads(d['args']) == (1,)
+    d = dumps_task((apply, f, (tuple, [inc]), {}))  # (inc,) is not args
+    assert set(d) == {'task'}
+
+    d = dumps_task((slow_read, 1))
+    assert d['io'] is True
+    assert 'io' not in dumps_task((inc, 1))
+
+
+def test_hash_blobs():
+    big = dumps(list(range(10000)))
+    f = dumps_function(inc)
+    tasks = {'x': {'function': f, 'args': dumps((1,))},
+             'y': {'function': f, 'args': dumps((2,)), 'kwargs': big},
+             'z': {'function': f, 'args': dumps((3,)), 'kwargs': dumps(
+                                                    list(range(10000)))},
+             'v': {'function': f, 'args': dumps((list(range(20000)),))},
+             'w': {'task': dumps((inc, 1))}}
+    blobs = hash_blobs(tasks)
+    assert len(blobs) == 2
+    assert set(blobs.values()) == {f, big}
+    for k in 'xyz':
+        assert 'function' not in tasks[k]
+        assert blobs[tasks[k]['hashes']['function']] == f
+        assert loads(tasks[k]['args']) == ('xyz'.index(k) + 1,)
+    assert tasks['y']['hashes']['kwargs'] == tasks['z']['hashes']['kwargs']
+    assert 'kwargs' not in tasks['y']
+    assert 'hashes' not in tasks['x'] or 'args' not in tasks['x']['hashes']
+    assert tasks['w'] == {'task': dumps((inc, 1))}
+    assert 'args' in tasks['v']  # large but used once, stays inline
+    assert set(tasks['v']['hashes']) == {'function'}
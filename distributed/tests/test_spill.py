@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from distributed.spill import SpillBuffer
+
+
+def test_spill_least_recently_used(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=250, sizeof=lambda x: 100)
+    d['x'] = 1
+    d['y'] = 2
+    assert set(d.fast) == {'x', 'y'} and not d.slow
+
+    d['x']  # x is now more recently used than y
+    d['z'] = 3
+    assert set(d.fast) == {'x', 'z'}
+    assert set(d.slow) == {'y'}
+    assert d.memory == 200
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    assert d['y'] == 2  # loaded back into memory, spilling x
+    assert set(d.fast) == {'z', 'y'}
+    assert set(d.slow) == {'x'}
+
+    assert len(d) == 3
+    assert set(d) == {'x', 'y', 'z'}
+    assert dict(d) == {'x': 1, 'y': 2, 'z': 3}
+
+    assert d.stats['spill-count'] >= 2
+    assert d.stats['unspill-count'] >= 1
+    assert d.stats['spill-bytes'] > 0
+    assert d.stats['spill-time'] >= 0
+
+
+def test_delete_and_overwrite(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=150, sizeof=lambda x: 100)
+    d['x'] = 1
+    d['y'] = 2
+    assert 'x' in d.slow
+
+    d['x'] = 10
+    assert d['x'] == 10
+    del d['y']
+    del d['x']
+    assert not d
+    assert d.memory == 0
+    assert not os.listdir(str(tmpdir))
+
+    with pytest.raises(KeyError):
+        d['x']
+
+
+def test_spilled_numpy_arrays_are_memory_mapped(tmpdir):
+    np = pytest.importorskip('numpy')
+    d = SpillBuffer(str(tmpdir), memory_limit=1000)
+    x = np.arange(1000)
+    d['x'] = x
+    assert 'x' in d.slow and d.memory == 0
+
+    y = d['x']
+    assert isinstance(y, np.memmap)
+    assert (y == x).all()
+    assert 'x' in d.slow  # reading does not count against memory
+    assert d.memory == 0
+
+    assert d['x'] is y  # mapped once
+    assert d.stats['unspill-count'] == 1
+
+    y[0] = 100  # copy-on-write, the spilled file is unchanged
+    assert np.load(d.slow['x'])[0] == 0
+
+    d['o'] = np.array([object()] * 200)  # object arrays are pickled
+    assert d['o'].shape == (200,)
+
+
+def test_values_larger_than_memory_stay_on_disk(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=100, sizeof=len)
+    d['x'] = b'0' * 1000
+    path = d.slow['x']
+    assert d.stats['spill-count'] == 1
+
+    for i in range(3):
+        assert d['x'] == b'0' * 1000
+    assert d.slow['x'] == path and os.path.exists(path)
+    assert d.stats['spill-count'] == 1  # never written again
+    assert d.stats['unspill-count'] == 3
+    assert not d.fast and d.memory == 0
+
+
+def test_values_larger_than_memory_stay_compressed(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=100, compressed_limit=10000,
+                    compression='zlib', sizeof=len)
+    d['x'] = b'0' * 100000
+    assert list(d.compressed) == ['x']
+    size = d.compressed_memory
+
+    for i in range(3):
+        assert d['x'] == b'0' * 100000
+    assert list(d.compressed) == ['x'] and d.compressed_memory == size
+    assert d.stats['compress-count'] == 1
+
+
+def test_compressed_tier(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=150000,
+                    compressed_limit=5000, compression='zlib')
+    d['x'] = b'x' * 100000
+    d['y'] = b'y' * 100000  # pushes x into the compressed tier
+    assert list(d.fast) == ['y']
+    assert list(d.compressed) == ['x']
+    assert 0 < d.compressed_memory < 5000
+    assert not d.slow and not os.listdir(str(tmpdir))
+
+    assert d['x'] == b'x' * 100000  # decompressed, pushes y down
+    assert list(d.fast) == ['x']
+    assert list(d.compressed) == ['y']
+    assert d.stats['compressed-hits'] == 1
+    assert d.stats['compress-count'] == 2
+    assert d.stats['compressed-bytes'] < d.stats['compress-bytes'] / 10
+
+    d['z'] = os.urandom(100000)
+    d['w'] = b'w' * 100000
+    assert 'z' in d.slow  # incompressible, went straight to disk
+    assert list(d.compressed) == ['y', 'x']
+    assert len(d) == 4
+    assert set(d) == {'w', 'x', 'y', 'z'}
+
+    del d['y']
+    assert 'y' not in d
+    assert d.compressed_memory == sum(len(b''.join(map(bytes, frames)))
+                                      for frames in d.compressed.values())
+
+
+def test_compressed_tier_overflows_to_disk(tmpdir):
+    d = SpillBuffer(str(tmpdir), memory_limit=1, compressed_limit=1000,
+                    compression='zlib')
+    for i in range(10):
+        d[i] = str(i).encode() * 100000
+    assert d.compressed_memory <= 1000
+    assert d.slow
+    assert len(d.compressed) + len(d.slow) + len(d.fast) == 10
+    for i in range(10):
+        assert d[i] == str(i).encode() * 100000
+    assert d.stats['disk-hits'] > 0
+
+
+def test_compressed_tier_returns_writeable_arrays(tmpdir):
+    np = pytest.importorskip('numpy')
+    d = SpillBuffer(str(tmpdir), memory_limit=1, compressed_limit=10**7,
+                    compression='zlib')
+    d['x'] = np.zeros(100000)
+    d['y'] = np.zeros(100000)  # pushes x into the compressed tier
+    assert 'x' in d.compressed
+
+    x = d['x']
+    x[0] = 1
+    assert x[0] == 1
@@ -0,0 +1,135 @@
+import pytest
+
+from distributed.tasktable import TaskTable, SMALL
+
+
+def test_columns_behave_like_dicts():
+    t = TaskTable()
+    t.tasks['x'] = None
+    t.tasks['y'] = (inc, 'x')
+    assert t.tasks['x'] is None
+    assert set(t.tasks) == {'x', 'y'}
+    assert 'x' in t.tasks and 'z' not in t.tasks
+    assert t.tasks.get('z', 1) == 1
+    with pytest.raises(KeyError):
+        t.tasks['z']
+    with pytest.raises(KeyError):
+        del t.tasks['z']
+
+    del t.tasks['x']
+    assert dict(t.tasks) == {'y': (inc, 'x')}
+    assert len(t.tasks) == 1
+
+
+def test_key_sets_are_live():
+    t = TaskTable()
+    t.dependents['x'] = set()
+    s = t.dependents['x']
+    assert not s
+    keys = ['y-%d' % i for i in range(SMALL + 2)]
+    for k in keys:
+        t.dependents['x'].add(k)
+    assert s == set(keys)
+    assert set(keys) == s
+    assert type(t.dependents.data[t.ids['x']]) is set
+
+    for k in keys:
+        s.remove(k)
+    assert t.dependents['x'] == set()
+    assert t.dependents.data[t.ids['x']] == ()
+    with pytest.raises(KeyError):
+        s.remove('y-0')
+
+    deps = {'a', 'b'}
+    t.waiting['z'] = deps
+    deps.add('c')
+    assert t.waiting['z'] == {'a', 'b'}
+    assert t.waiting.pop('z') == {'a', 'b'}
+    assert 'z' not in t.waiting
+
+
+def test_in_play_and_keyorder():
+    t = TaskTable()
+    t.in_play.update(['x', 'y'])
+    t.in_play |= {'z'}
+    assert t.in_play == {'x', 'y', 'z'}
+    t.in_play.difference_update(['x'])
+    t.in_play.remove('y')
+    with pytest.raises(KeyError):
+        t.in_play.remove('y')
+    assert set(t.in_play) == {'z'} and len(t.in_play) == 1
+
+    t.keyorder['a'] = (1, 2)
+    t.keyorder['b'] = (0, 5)
+    assert sorted(['a', 'b'], key=t.keyorder.get) == ['b', 'a']
+    assert t.keyorder.get('c') is None
+
+
+def test_set_operators_return_sets():
+    t = TaskTable()
+    t.dependents['x'] = {'a', 'b', 'c'}
+    d = t.dependents['x']
+    s = {'b', 'c', 'z'}
+
+    assert d - {'a'} == {'b', 'c'}
+    assert d & s == {'b', 'c'}
+    assert d | s == {'a', 'b', 'c', 'z'}
+    assert d ^ s == {'a', 'z'}
+    assert {'a', 'z'} - d == {'z'}
+    assert s & d == {'b', 'c'}
+    assert type(d - {'a'}) is set and type(d | s) is set
+
+    c = d.copy()
+    assert type(c) is set and c == {'a', 'b', 'c'}
+    c.add('d')
+    assert 'd' not in t.dependents['x']
+
+    t.in_play.update(['x', 'y'])
+    assert t.in_play - {'x'} == {'y'}
+    assert t.in_play | {'z'} == {'x', 'y', 'z'}
+    assert t.in_play & {'y', 'z'} == {'y'}
+    assert {'y', 'z'} - t.in_play == {'z'}
+    assert type(t.in_play - {'x'}) is set
+    c = t.in_play.copy()
+    c.discard('x')
+    assert 'x' in t.in_play
+
+
+def test_ids_are_reused():
+    t = TaskTable()
+    t.tasks['x'] = 1
+    t.dependencies['x'] = set()
+    t.in_play.add('x')
+    i = t.ids['x']
+
+    del t.tasks['x']
+    t.in_play.discard('x')
+    assert 'x' in t
+    del t.dependencies['x']
+    assert 'x' not in t and len(t) == 0
+
+    t.tasks['y'] = 2
+    assert t.ids['y'] == i
+    assert 'y' not in t.dependencies
+    assert 'y' not in t.in_play
+
+
+def test_clear():
+    t = TaskTable()
+    for k in 'abc':
+        t.tasks[k] = k
+        t.dependents[k] = {'z'}
+    t.waiting['a'] = {'b'}
+    t.in_play.add('a')
+    dependents = t.dependents
+
+    t.waiting.clear()
+    assert not t.waiting and len(t) == 3
+    t.clear()
+    assert not t.tasks and not dependents and not t.in_play and len(t) == 0
+    t.dependents['d'] = set()
+    assert dependents['d'] == set()
+
+
+def inc(x):
+    return x + 1
@@ -0,0 +1,130 @@
+from operator import add
+import os
+
+from tornado import gen
+from tornado.iostream import StreamClosedError
+import pytest
+
+from distributed import Executor
+from distributed.client import gather_from_workers
+from distributed.core import Server, rpc, connect, pingpong, connection_pool
+from distributed import unix
+from distributed.unix import local_address, socket_path
+from distributed.utils_test import gen_cluster, loop
+
+pytestmark = pytest.mark.skipif(not unix.available,
+                                reason="No Unix domain sockets")
+
+
+def test_server(loop, tmpdir):
+    path = str(tmpdir.join('server.sock'))
+
+    @gen.coroutine
+    def f():
+        server = Server({'ping': pingpong})
+        server.listen(0)
+        server.listen('unix://' + path)
+        assert isinstance(server.port, int)
+
+        remote = rpc(ip='unix://' + path, port=server.port)
+        response = yield remote.ping()
+        assert response == b'pong'
+        response = yield rpc(ip='127.0.0.1', port=server.port).ping()
+        assert response == b'pong'
+
+        remote.close_streams()
+        server.stop()
+        with pytest.raises((StreamClosedError, IOError)):
+            yield connect('unix://' + path, 0)
+
+    loop.run_sync(f)
+
+
+@gen_cluster()
+def test_workers_listen_on_unix_sockets(s, a, b):
+    paths = {}
+    for w in [a, b]:
+        assert os.path.dirname(w.unix_path) == w.local_dir
+        assert os.path.exists(w.unix_path)
+        assert s.worker_services[w.address]['unix'] == w.unix_path
+        paths[w.address] = w.unix_path
+        assert local_address(w.address) == w.address  # not advertised
+        assert local_address(w.address, paths) == ('unix://' + w.unix_path,
+                                                   w.port)
+
+    a.data['x'] = 1
+    b.data['y'] = 2
+    result = yield gather_from_workers({'x': {a.address}, 'y': {b.address}},
+                                       unix_paths=paths)
+    assert result == {'x': 1, 'y': 2}
+    pool = connection_pool()
+    assert all(unix.is_unix(ip) for ip, port in pool.available)
+
+    path = a.unix_path
+    yield a._close(report=False)
+    assert not os.path.exists(path)
+
+
+def test_socket_paths_are_unique(tmpdir):
+    paths = {socket_path(str(tmpdir)) for i in range(10)}
+    assert len(paths) == 10
+    assert all(os.path.dirname(p) == str(tmpdir) for p in paths)
+
+
+def test_remove_socket_only_removes_our_own(tmpdir):
+    path = str(tmpdir.join('worker.sock'))
+    with open(path, 'w') as f:
+        f.write('')
+    ours = os.stat(path)
+    with open(path + '.new', 'w') as f:
+        f.write('')
+    os.rename(path + '.new', path)  # another worker took over this path
+
+    unix.remove_socket(path, ours)
+    assert os.path.exists(path)
+    unix.remove_socket(path, os.stat(path))
+    assert not os.path.exists(path)
+    unix.remove_socket(path, ours)  # already gone
+
+
+@gen_cluster()
+def test_fall_back_to_tcp(s, a, b):
+    path = os.path.join(b.local_dir, 'stale.sock')
+    with open(path, 'w') as f:  # a file left behind, nobody listens here
+        f.write('')
+    b.data['y'] = 2
+    paths = {b.address: path}
+    result = yield gather_from_workers({'y': {b.address}}, unix_paths=paths)
+    assert result == {'y': 2}
+    assert not paths  # we don't try that socket again
+
+
+@gen_cluster()
+def test_tasks_carry_peer_socket_paths(s, a, b):
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    [x] = yield e._scatter([1], workers=[a.address])
+    [y] = yield e._scatter([2], workers=[b.address])
+    z = e.submit(add, x, y)
+    result = yield z._result()
+    assert result == 3
+
+    w, peer = (a, b) if z.key in a.data else (b, a)
+    assert w.unix_paths == {peer.address: peer.unix_path}
+
+    yield e._shutdown()
+
+
+def test_local_address_other_host():
+    assert local_address(('192.0.2.1', 8000)) == ('192.0.2.1', 8000)
+    assert local_address(('192.0.2.1', 8000),
+                         {('192.0.2.1', 8000): '/tmp/w.sock'}) == \
+            ('192.0.2.1', 8000)
+
+
+def test_is_unix():
+    assert unix.is_unix('unix:///tmp/w.sock')
+    assert unix.is_unix(u'unix:///tmp/w.sock')
+    assert not unix.is_unix('127.0.0.1')
+    assert not unix.is_unix(None)
@@ -9,10 +9,15 @@ from toolz import pluck
 from tornado import gen
 from tornado.ioloop import TimeoutError
 
+from distributed import Executor
+from distributed.batched import BatchedStream
 from distributed.center import Center
-from distributed.core import rpc, dumps, loads
+from distributed.core import rpc, dumps, loads, connect, write
+from distributed.executor import _wait
 from distributed.sizeof import sizeof
-from distributed.worker import Worker
+from distributed.spill import SpillBuffer
+from distributed.worker import (Worker, dumps_type, flatten_task,
+        execute_plan, _plans)
 from distributed.utils_test import loop, _test_cluster, inc, gen_cluster
 
 
@@ -100,6 +105,8 @@ def test_compute_who_has(loop):
         yield zz.compute(function=inc, args=('a',), needed=['a'],
                          who_has={'a': {x.address}}, key='b')
         assert z.data['b'] == 2
+        assert z.data['a'] == 1  # kept as a replica
+        del z.data['a']
 
         yield zz.compute(function=inc, args=('a',), needed=['a'],
                          who_has={'a': {y.address}}, key='c')
@@ -287,3 +294,275 @@ def test_worker_task_bytes(s, a, b):
 
     yield aa.compute(function=dumps(inc), args=dumps((10,)), key='y', serialized=True)
     assert a.data['y'] == 11
+
+
+@gen_cluster()
+def test_worker_nested_task_data(s, a, b):
+    aa = rpc(ip=a.ip, port=a.port)
+    yield aa.compute(key='x', task=1)
+    yield aa.compute(key='y', task=(sum, [(inc, 'x'), (inc, 'x'), 'x']),
+                     needed=['x'])
+    assert a.data['y'] == 2 + 2 + 1
+
+    yield aa.compute(key='z', task=(len, ['x', ('x', 1)]), needed=['x'])
+    assert a.data['z'] == 2
+
+
+def test_flatten_task():
+    data = {'x': 1, ('x', 1): 2}
+    shape, values = flatten_task((add, 'x', (inc, ('x', 1))), data)
+    assert shape == (1, 0, (1, 0))
+    assert values == [add, 1, inc, 2]
+
+    # keys within lists without tasks, tuples and dicts are filled in too
+    shape, values = flatten_task((sum, ['x', ('x', 1)]), data)
+    assert shape == (1, 0)
+    assert values == [sum, [1, 2]]
+    shape, values = flatten_task((list, ('x', 'y', ('x', 1))), data)
+    assert values == [list, (1, 'y', 2)]
+    shape, values = flatten_task((dict, {'a': 'x'}), data)
+    assert values == [dict, {'a': 1}]
+
+    assert flatten_task('x', data) == (0, [1])
+    assert flatten_task([slice(1)], data) == (0, [[slice(1)]])
+
+
+def test_execute_plan():
+    data = {'x': 1, 'y': 2}
+    task = (add, (inc, 'x'), (sum, [(inc, 'y'), 10]))
+    assert execute_plan(*flatten_task(task, data)) == 2 + 13
+    shape, _ = flatten_task(task, data)
+    assert shape in _plans
+    plan = _plans[shape]
+
+    task = (add, (inc, 'y'), (sum, [(inc, 'x'), 20]))
+    assert execute_plan(*flatten_task(task, data)) == 3 + 22
+    assert _plans[shape] is plan
+
+    assert execute_plan(*flatten_task((max,) + tuple(range(1000)), data)) == 999
+
+    task = 1
+    for i in range(200):
+        task = (inc, task)
+    assert execute_plan(*flatten_task(task, data)) == 201
+    assert execute_plan(*flatten_task('x', data)) == 1
+
+
+def test_worker_memory_limit():
+    w = Worker('127.0.0.1', 8007, memory_limit=1e6, compressed_limit=1e5)
+    try:
+        assert isinstance(w.data, SpillBuffer)
+        assert w.data.memory_limit == 1e6
+        assert w.data.compressed_limit == 1e5
+        assert w.data.directory.startswith(w.local_dir)
+    finally:
+        shutil.rmtree(w.local_dir)
+
+    data = dict()
+    w = Worker('127.0.0.1', 8007, data=data)
+    try:
+        assert w.data is data
+    finally:
+        shutil.rmtree(w.local_dir)
+
+
+@gen_cluster()
+def test_worker_spills_to_disk(s, a, b):
+    np = pytest.importorskip('numpy')
+    a.data = SpillBuffer(os.path.join(a.local_dir, 'storage'),
+                         memory_limit=1000)
+    aa = rpc(ip=a.ip, port=a.port)
+    bb = rpc(ip=b.ip, port=b.port)
+
+    yield aa.update_data(data={'x': np.ones(100), 'y': b'0' * 600},
+                         report=False)
+    yield aa.compute(task=(np.ones, 100), key='z', report=False)
+    assert set(a.data.slow) == {'x', 'y'}
+    assert list(a.data.fast) == ['z']
+
+    result = yield aa.get_data(keys=['x', 'y'])
+    assert (result['x'] == 1).all()
+    assert result['y'] == b'0' * 600
+
+    yield aa.compute(task=(np.sum, 'x'), key='total', needed=['x'],
+                     report=False)
+    assert a.data['total'] == 100
+
+    yield bb.compute(task=(np.sum, 'x'), key='total',
+                     who_has={'x': {a.address}}, report=False)
+    assert b.data['total'] == 100
+
+    yield aa.delete_data(keys=['x', 'y', 'z', 'total'], report=False)
+    assert not a.data
+    assert not os.listdir(a.data.directory)
+
+    metrics = yield aa.metrics()
+    assert metrics['spill']['spill-count'] >= 3
+    assert metrics['spill']['unspill-count'] >= 2
+    assert metrics['spill']['memory-limit'] == 1000
+
+
+@gen_cluster()
+def test_gather_dependencies_shares_transfers(s, a, b):
+    a.data.update({'x': 1, 'y': 2})
+    bb = rpc(ip=b.ip, port=b.port)
+    responses = yield [bb.compute(task=(inc, 'x'), key='x%d' % i,
+                                  who_has={'x': {a.address}}, report=False)
+                       for i in range(5)] + \
+                      [bb.compute(task=(inc, 'y'), key='y1',
+                                  who_has={'y': {a.address}}, report=False)]
+    assert all(r == b'OK' for r, _ in responses)
+    assert [b.data['x%d' % i] for i in range(5)] == [2] * 5
+    assert b.data['y1'] == 3
+
+    assert a.metrics['get_data']['count'] == 1  # one transfer for x and y
+    stats = b.transfer_stats
+    assert stats['fetch-requests'] == 6
+    assert stats['fetches'] == 1
+    assert stats['keys-fetched'] == 2
+    assert stats['keys-deduplicated'] == 4
+    assert stats['bytes-deduplicated'] == 4 * sizeof(1)
+    assert not b.in_flight
+
+    metrics = yield bb.metrics()
+    assert metrics['transfers'] == stats
+
+
+@gen_cluster()
+def test_gather_dependencies_missing_keys(s, a, b):
+    a.data['x'] = 1
+    bb = rpc(ip=b.ip, port=b.port)
+    good, bad = yield [bb.compute(task=(inc, 'x'), key='good',
+                                  who_has={'x': {a.address}}, report=False),
+                       bb.compute(task=(add, 'x', 'z'), key='bad',
+                                  who_has={'x': {a.address},
+                                           'z': {a.address}}, report=False)]
+    assert good[0] == b'OK'
+    assert bad[0] == b'missing-data'
+    assert b.data['good'] == 2
+    assert 'bad' not in b.data
+    assert not b.in_flight
+
+
+def fail_on_load():
+    raise ValueError("Can not deserialize")
+
+
+class FailsOnLoad(object):
+    def __reduce__(self):
+        return (fail_on_load, ())
+
+
+@gen_cluster()
+def test_gather_dependencies_bad_peer(s, a, b):
+    a.data['x'] = FailsOnLoad()
+    bb = rpc(ip=b.ip, port=b.port)
+    response, content = yield bb.compute(task=(inc, 'x'), key='y',
+                                         who_has={'x': {a.address}},
+                                         report=False)
+    assert response == b'missing-data'
+    assert 'y' not in b.data
+    assert not b.in_flight
+
+
+@gen_cluster()
+def test_compute_fills_kwargs_with_data(s, a, b):
+    a.data['x'] = 10
+    aa = rpc(ip=a.ip, port=a.port)
+    response, _ = yield aa.compute(function=lambda a, b=0: a + b, args=(1,),
+                                   kwargs={'b': 'x'}, needed=['x'], key='y',
+                                   report=False)
+    assert response == b'OK'
+    assert a.data['y'] == 11
+
+
+@gen_cluster()
+def test_compute_stream(s, a, b):
+    stream = yield connect(a.ip, a.port)
+    yield write(stream, {'op': 'compute_stream', 'reply': False,
+                         'close': True, 'report': False})
+    bstream = BatchedStream(stream, interval=0)
+    for i in range(10):
+        bstream.send({'op': 'compute-task', 'key': 'x-%d' % i,
+                      'task': (inc, i)})
+    bstream.send({'op': 'compute-task', 'key': 'z', 'task': (div, 1, 0)})
+    bstream.send({'op': 'compute-task', 'key': 'w', 'task': (inc, 'y'),
+                  'who_has': {'y': {('127.0.0.1', 1)}}})
+
+    msgs = []
+    while len(msgs) < 12:
+        msgs.extend((yield bstream.recv_many()))
+    results = {msg['key']: msg for msg in msgs}
+
+    for i in range(10):
+        assert results['x-%d' % i]['op'] == 'task-finished'
+        assert results['x-%d' % i]['type'] == dumps_type(int)
+        assert a.data['x-%d' % i] == i + 1
+    assert results['z']['op'] == 'task-erred'
+    assert isinstance(results['z']['exception'], ZeroDivisionError)
+    assert results['w'] == {'op': 'missing-data', 'key': 'w',
+                            'missing': ('y',)}
+
+    bstream.send({'op': 'close'})
+    msg = yield bstream.recv()
+    assert msg == {'op': 'close'}
+    stream.close()
+
+
+def div(x, y):
+    return x / y
+
+
+def inc_with_pid(x):
+    return os.getpid(), x + 1
+
+
+@gen_cluster()
+def test_compute_in_process_pool(s, a, b):
+    aa = rpc(ip=a.ip, port=a.port)
+    response, _ = yield aa.compute(function=inc_with_pid, args=(1,),
+                                   key='x', processes=True, report=False)
+    assert response == b'OK'
+    pid, result = a.data['x']
+    assert pid != os.getpid()
+    assert result == 2
+
+    response, content = yield aa.compute(function=div, args=(1, 0), key='y',
+                                         processes=True, report=False)
+    assert response == b'error'
+    assert isinstance(content['exception'], ZeroDivisionError)
+
+
+@gen_cluster()
+def test_worker_processes(s, a, b):
+    w = Worker(s.ip, s.port, ncores=1, ip='127.0.0.1', processes=True)
+    yield w._start(0)
+    try:
+        ww = rpc(ip=w.ip, port=w.port)
+        response, _ = yield ww.compute(function=os.getpid, key='x',
+                                       report=False)
+        assert response == b'OK'
+        assert w.data['x'] != os.getpid()
+    finally:
+        yield w._close(report=False)
+
+
+@gen_cluster()
+def test_compute_stream_reports_failures_in_compute(s, a, b):
+    @gen.coroutine
+    def compute(stream, **kwargs):
+        raise ValueError("Worker failure")
+
+    a.compute = b.compute = compute  # as if reporting to the center failed
+
+    e = Executor((s.ip, s.port), start=False)
+    yield e._start()
+
+    x = e.submit(inc, 1)
+    yield _wait([x])
+    assert x.status == 'error'
+    with pytest.raises(ValueError):
+        yield x._result()
+    assert not a.active and not b.active
+
+    yield e._shutdown()
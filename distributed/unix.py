@@ -0,0 +1,118 @@
+"""
+Unix domain socket transport between processes on the same host
+
+Workers listen on a Unix domain socket in their ``local_dir`` next to their
+TCP port and advertise its path to the center and scheduler as the ``'unix'``
+service.  Every worker picks a new path, so workers never take over each
+other's sockets.  The scheduler
+passes the paths of peers on the same host along with tasks.
+``local_address`` rewrites a peer's ``(ip, port)`` address to
+``('unix://<path>', port)`` when the peer is on this host and advertised a
+path.  ``connect`` and ``Server.listen`` accept these addresses.  Callers fall
+back to TCP when the socket can not be reached.
+
+This skips the TCP stack for traffic between worker processes on one machine,
+as with ``dworker --nprocs``.
+"""
+from __future__ import print_function, division, absolute_import
+
+import logging
+import os
+import socket
+import uuid
+
+from tornado import gen
+from tornado.iostream import IOStream
+from tornado.netutil import bind_unix_socket
+
+from .compatibility import string_types
+from .utils import get_ip
+
+logger = logging.getLogger(__name__)
+
+
+PREFIX = 'unix://'
+
+available = hasattr(socket, 'AF_UNIX')
+
+
+def is_unix(ip):
+    """ Does this address refer to a Unix domain socket?
+
+    >>> is_unix('unix:///tmp/worker-abc/worker-1a2b.sock')
+    True
+    >>> is_unix('127.0.0.1')
+    False
+    """
+    return isinstance(ip, string_types) and ip.startswith(PREFIX)
+
+
+def socket_path(directory):
+    """ New unique path for a worker's socket in ``directory`` """
+    return os.path.join(directory, 'worker-%s.sock' % uuid.uuid4().hex[:16])
+
+
+_local_hosts = set()
+
+
+def local_hosts():
+    """ Names and addresses under which other processes see this host """
+    if not _local_hosts:
+        _local_hosts.update(['127.0.0.1', 'localhost', socket.gethostname()])
+        try:
+            _local_hosts.add(get_ip())
+        except Exception:
+            pass
+    return _local_hosts
+
+
+def local_address(addr, paths=None):
+    """ Prefer the Unix domain socket of a peer on this host
+
+    Returns ``addr`` unchanged unless the peer is on this host and advertised
+    a socket path in ``paths``, a dict mapping addresses to paths.
+
+    >>> local_address(('127.0.0.1', 8000), {('127.0.0.1', 8000): '/tmp/w.sock'})
+    ('unix:///tmp/w.sock', 8000)
+    >>> local_address(('192.0.2.1', 8000), {('192.0.2.1', 8000): '/tmp/w.sock'})
+    ('192.0.2.1', 8000)
+    """
+    if not available or not paths or addr not in paths:
+        return addr
+    ip, port = addr
+    if ip in local_hosts():
+        return (PREFIX + paths[addr], port)
+    return addr
+
+
+def listen(server, ip):
+    """ Add a listening Unix domain socket at ``ip`` to a TCPServer """
+    path = ip[len(PREFIX):]
+    sock = bind_unix_socket(path)
+    server.add_socket(sock)
+    return path
+
+
+def remove_socket(path, stat):
+    """ Remove the socket file at ``path`` if it is still the one we created
+
+    ``stat`` is the result of ``os.stat(path)`` right after we bound it.
+    """
+    try:
+        if os.path.samestat(os.stat(path), stat):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+@gen.coroutine
+def connect(ip, max_buffer_size=None):
+    """ Connect to the Unix domain socket at ``ip``
+
+    Raises ``StreamClosedError`` if nothing listens there
+    """
+    path = ip[len(PREFIX):]
+    stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM),
+                      max_buffer_size=max_buffer_size)
+    yield stream.connect(path)
+    raise gen.Return(stream)
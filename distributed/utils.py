@@ -16,7 +16,7 @@ from dask import istask
 from toolz import memoize
 from tornado import gen
 
-from .compatibility import Queue
+from .compatibility import Queue, memoryview_nbytes
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +31,21 @@ def funcname(func):
         return str(func)
 
 
+def io_bound(func):
+    """ Mark a function as spending most of its time waiting on I/O
+
+    Tasks calling such a function run in a separate, larger pool of threads
+    on the worker and don't count against the worker's cores in the
+    scheduler.
+
+    >>> @io_bound
+    ... def download(url):
+    ...     return urlopen(url).read()
+    """
+    func.io_bound = True
+    return func
+
+
 def get_ip():
     return [(s.connect(('8.8.8.8', 80)), s.getsockname()[0], s.close())
         for s in [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]][0][1]
@@ -238,9 +253,13 @@ def ensure_ip(hostname):
     '127.0.0.1'
     >>> ensure_ip('123.123.123.123')  # pass through IP addresses
     '123.123.123.123'
+    >>> ensure_ip('inproc://123')  # and in-process hosts
+    'inproc://123'
     """
     if re.match('\d+\.\d+\.\d+\.\d+', hostname):  # is IP
         return hostname
+    elif hostname.startswith('inproc://'):
+        return hostname
     else:
         return socket.gethostbyname(hostname)
 
@@ -254,7 +273,8 @@ def get_traceback():
            os.path.join('distributed', 'scheduler'),
            os.path.join('tornado', 'gen.py'),
            os.path.join('concurrent', 'futures')]
-    while any(b in exc_traceback.tb_frame.f_code.co_filename for b in bad):
+    while exc_traceback and any(b in exc_traceback.tb_frame.f_code.co_filename
+                                for b in bad):
         exc_traceback = exc_traceback.tb_next
     return exc_traceback
 
@@ -273,6 +293,20 @@ def truncate_exception(e, n=10000):
         return e
 
 
+def nbytes(frame):
+    """ Number of bytes in a bytestring or memoryview
+
+    >>> nbytes(b'123')
+    3
+    >>> nbytes(memoryview(b'123'))
+    3
+    """
+    if isinstance(frame, memoryview):
+        return memoryview_nbytes(frame)
+    else:
+        return len(frame)
+
+
 def queue_to_iterator(q):
     while True:
         result = q.get()
@@ -380,12 +380,12 @@ from .worker import Worker
 from .executor import Executor
 
 @gen.coroutine
-def start_cluster(ncores, Worker=Worker):
+def start_cluster(ncores, Worker=Worker, port=0):
     s = Scheduler(ip='127.0.0.1')
-    done = s.start(0)
+    done = s.start(port)
     workers = [Worker(s.ip, s.port, ncores=v, ip=k) for k, v in ncores]
 
-    yield [w._start() for w in workers]
+    yield [w._start(port) for w in workers]
 
     start = time()
     while len(s.ncores) < len(ncores):
@@ -406,13 +406,16 @@ def end_cluster(s, workers):
 
 
 def gen_cluster(ncores=[('127.0.0.1', 1), ('127.0.0.1', 2)], timeout=10,
-        Worker=Worker):
+        Worker=Worker, port=0):
     """ Coroutine test with small cluster
 
     @gen_cluster()
     def test_foo(scheduler, worker1, worker2):
         yield ...  # use tornado coroutines
 
+    Pass ``port='inproc://'`` to connect everything in-process rather than
+    over TCP.
+
     See also:
         start
         end
@@ -426,7 +429,8 @@ def gen_cluster(ncores=[('127.0.0.1', 1), ('127.0.0.1', 2)], timeout=10,
             loop.make_current()
 
             s, workers = loop.run_sync(lambda: start_cluster(ncores,
-                                                             Worker=Worker))
+                                                             Worker=Worker,
+                                                             port=port))
             try:
                 loop.run_sync(lambda: cor(s, *workers), timeout=timeout)
             finally:
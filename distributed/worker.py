@@ -1,27 +1,35 @@
 from __future__ import print_function, division, absolute_import
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import timedelta
 from importlib import import_module
 import logging
+import multiprocessing
 from multiprocessing.pool import ThreadPool
 import os
 import pkg_resources
+import socket
 import tempfile
 import shutil
 import sys
+from time import time
 
 from dask.core import istask
 from toolz import merge
+from tornado.concurrent import Future
 from tornado.gen import Return
 from tornado import gen
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.ioloop import IOLoop
 from tornado.iostream import StreamClosedError
 
 from .client import _gather, pack_data, gather_from_workers
+from . import inproc, unix
+from .batched import BatchedStream
 from .compatibility import reload
 from .core import rpc, Server, pingpong, dumps, loads
 from .sizeof import sizeof
+from .spill import SpillBuffer
 from .utils import (funcname, get_ip, get_traceback, truncate_exception,
     ignoring)
 
@@ -50,13 +58,44 @@ class Worker(Server):
     **State**
 
     * **data:** ``{key: object}``:
-        Dictionary mapping keys to actual values
+        Dictionary mapping keys to actual values.  Any ``MutableMapping`` may
+        be passed as ``data=``.  Given ``memory_limit=`` in bytes we use a
+        ``SpillBuffer`` that moves least recently used values to
+        ``local_dir`` once they exceed that limit.  With
+        ``compressed_limit=`` it first keeps up to that many bytes of them
+        compressed in memory.
     * **active:** ``{key}``:
         Set of keys currently under computation
+    * **in_flight:** ``{key: Future}``:
+        Keys currently being fetched from peers.  Concurrent tasks that need
+        the same key wait on the same transfer.
+    * **blob_cache:** ``{hash: bytes}``:
+        Serialized functions and large arguments shared between tasks, which
+        tasks refer to by content hash.  We ask for missing ones over the
+        scheduler's compute stream and keep the most recently used, up to
+        ``blob_cache_bytes`` bytes.  Each task deserializes its own copy.
+        This cache is separate from ``data`` and doesn't count against
+        ``memory_limit``.
+    * **transfer_stats:** ``{str: int}``:
+        Number of requests for remote keys, of batched fetches serving
+        them, and keys and bytes fetched or shared between requests
     * **ncores:** ``int``:
         Number of cores used by this worker process
     * **executor:** ``concurrent.futures.ThreadPoolExecutor``:
         Executor used to perform computation
+    * **io_threads:** ``int``:
+        Number of threads for I/O-bound tasks
+    * **io_executor:** ``concurrent.futures.ThreadPoolExecutor``:
+        Pool of ``io_threads`` threads for tasks tagged as I/O-bound, like
+        reads from S3 or HDFS.  These spend most of their time waiting on
+        the network, so they run here rather than taking up a core in
+        ``executor``.  See ``distributed.utils.io_bound``.
+    * **process_pool:** ``concurrent.futures.ProcessPoolExecutor``:
+        Pool of ``ncores`` processes for tasks that hold the GIL, like pure
+        Python parsing.  Tasks submitted with ``processes=True`` run here, as
+        do all tasks if the worker was created with ``processes=True``.  The
+        pool starts on first use.  Functions, arguments and results travel
+        to and from it pickled.
     * **local_dir:** ``path``:
         Path on local machine to store temporary files
     * **center:** ``rpc``:
@@ -64,6 +103,13 @@ class Worker(Server):
     * **services:** ``{str: Server}``:
         Auxiliary web servers running on this worker
     * **service_ports:** ``{str: port}``:
+    * **unix_path:** ``path``:
+        Unix domain socket in ``local_dir`` on which we also listen, so that
+        peers on the same host can skip TCP.  Advertised to the center as the
+        ``'unix'`` service.
+    * **unix_paths:** ``{worker: path}``:
+        Sockets of peers on this host, as passed along with tasks.  Peers
+        that we fail to reach are dropped.
 
     Examples
     --------
@@ -91,22 +137,50 @@ class Worker(Server):
 
     def __init__(self, center_ip, center_port, ip=None, ncores=None,
                  loop=None, local_dir=None, services=None, service_ports=None,
+                 data=None, memory_limit=None, compressed_limit=0,
+                 processes=False, io_threads=16, blob_cache_bytes=50e6,
                  **kwargs):
         self.ip = ip or get_ip()
         self._port = 0
         self.ncores = ncores or _ncores
-        self.data = dict()
         self.loop = loop or IOLoop.current()
         self.status = None
         self.local_dir = local_dir or tempfile.mkdtemp(prefix='worker-')
+        if data is not None:
+            self.data = data
+        elif memory_limit is not None:
+            self.data = SpillBuffer(os.path.join(self.local_dir, 'storage'),
+                                    memory_limit,
+                                    compressed_limit=compressed_limit)
+        else:
+            self.data = dict()
         self.executor = ThreadPoolExecutor(self.ncores)
+        self.io_threads = io_threads
+        self.io_executor = ThreadPoolExecutor(io_threads)
+        self.processes = processes
+        self._process_pool = None
         self.center = rpc(ip=center_ip, port=center_port)
         self.active = set()
+        self.in_flight = dict()
+        self.blob_cache = OrderedDict()
+        self.blob_cache_bytes = blob_cache_bytes
+        self.blob_cache_nbytes = 0
+        self._blob_fetches = dict()
+        self._blob_stream = None
+        self._fetch_queue = dict()
+        self._fetch_scheduled = False
+        self.transfer_stats = {'fetch-requests': 0, 'fetches': 0,
+                               'keys-fetched': 0, 'bytes-fetched': 0,
+                               'keys-deduplicated': 0,
+                               'bytes-deduplicated': 0}
         if services is not None:
             self.services = {k: v(self) for k, v in services.items()}
         else:
             self.services = dict()
         self.service_ports = service_ports or dict()
+        self.unix_path = None
+        self._unix_stat = None
+        self.unix_paths = dict()  # socket paths advertised by peers
 
         if not os.path.exists(self.local_dir):
             os.mkdir(self.local_dir)
@@ -115,6 +189,7 @@ class Worker(Server):
             sys.path.insert(0, self.local_dir)
 
         handlers = {'compute': self.compute,
+                    'compute_stream': self.compute_stream,
                     'get_data': self.get_data,
                     'update_data': self.update_data,
                     'delete_data': self.delete_data,
@@ -127,6 +202,14 @@ class Worker(Server):
     @gen.coroutine
     def _start(self, port=0):
         self.listen(port)
+        if unix.available and not inproc.is_inproc(self.ip):
+            path = unix.socket_path(self.local_dir)
+            try:
+                self.listen(unix.PREFIX + path)
+                self.unix_path = path
+                self._unix_stat = os.stat(path)
+            except (OSError, socket.error) as e:
+                logger.info("Could not listen on %s: %s", path, e)
         for k, v in self.services.items():
             v.listen(0)
             self.service_ports[k] = v.port
@@ -134,13 +217,19 @@ class Worker(Server):
         logger.info('      Start worker at: %20s:%d', self.ip, self.port)
         for k, v in self.service_ports.items():
             logger.info('  %16s at: %20s:%d' % (k, self.ip, v))
+        if self.unix_path:
+            logger.info('  %16s at: %s', 'unix', self.unix_path)
         logger.info('Waiting to connect to: %20s:%d',
                     self.center.ip, self.center.port)
+        services = dict(self.service_ports)
+        if self.unix_path:
+            services['unix'] = self.unix_path
         while True:
             try:
                 resp = yield self.center.register(
                         ncores=self.ncores, address=(self.ip, self.port),
-                        keys=list(self.data), services=self.service_ports)
+                        keys=list(self.data), services=services,
+                        io_threads=self.io_threads)
                 break
             except (OSError, StreamClosedError):
                 logger.debug("Unable to register with center.  Waiting")
@@ -164,7 +253,12 @@ class Worker(Server):
                     self.center.unregister(address=(self.ip, self.port)))
         self.center.close_streams()
         self.stop()
+        if self.unix_path:
+            unix.remove_socket(self.unix_path, self._unix_stat)
         self.executor.shutdown()
+        self.io_executor.shutdown()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
         if os.path.exists(self.local_dir):
             shutil.rmtree(self.local_dir)
 
@@ -185,11 +279,40 @@ class Worker(Server):
     def address_string(self):
         return '%s:%d' % (self.ip, self.port)
 
+    @property
+    def process_pool(self):
+        if self._process_pool is None:
+            process = multiprocessing.current_process()
+            if process.daemon:
+                # Nannies start workers as daemonic processes, which may not
+                # have children.  We shut our pool down when we close.
+                process.daemon = False
+            self._process_pool = ProcessPoolExecutor(self.ncores)
+        return self._process_pool
+
     @gen.coroutine
     def compute(self, stream, function=None, key=None, args=(), kwargs={},
-            task=None, needed=[], who_has=None, report=True, serialized=False):
-        """ Execute function """
+            task=None, needed=[], who_has=None, report=True, serialized=False,
+            processes=False, io=False, hashes=None, unix_paths=None):
+        """ Execute function
+
+        Dependencies gathered from peers stay in ``data`` as replicas so that
+        later tasks here need not fetch them again.  Their keys are returned
+        under ``'fetched'`` so that the scheduler can track them.
+
+        With ``processes=True``, or on a worker created with
+        ``processes=True``, the function runs in ``process_pool`` rather than
+        in a thread.  With ``io=True`` it runs in ``io_executor``.
+
+        Fields listed in ``hashes`` come from ``blob_cache`` rather than from
+        the message.
+
+        ``unix_paths`` maps peers on this host to the Unix domain socket
+        paths they advertised.  We remember these for later transfers.
+        """
         self.active.add(key)
+        if unix_paths:
+            self.unix_paths.update(unix_paths)
         if needed:
             local_data = {k: self.data[k] for k in needed if k in self.data}
             needed = [n for n in needed if n not in self.data]
@@ -203,14 +326,15 @@ class Worker(Server):
         if needed or who_has:
             try:
                 if who_has:
-                    logger.info("gather %d keys from peers: %s",
-                                len(who_has), str(who_has))
-                    other = yield gather_from_workers(who_has)
+                    logger.debug("gather %d keys from peers: %s",
+                                 len(who_has), who_has)
+                    other = yield self.gather_dependencies(who_has)
                 elif needed:
-                    logger.info("gather %d keys from peers: %s",
-                                len(needed), str(needed))
+                    logger.debug("gather %d keys from peers: %s",
+                                 len(needed), needed)
                     other = yield _gather(self.center, needed=needed)
                     other = dict(zip(needed, other))
+                    self.data.update(other)  # keep as replicas
                 else:
                     raise ValueError()
             except KeyError as e:
@@ -220,6 +344,7 @@ class Worker(Server):
                 raise Return((b'missing-data', e))
             data2 = merge(local_data, other)
         else:
+            other = {}
             data2 = local_data
 
         if serialized:
@@ -232,57 +357,59 @@ class Worker(Server):
                     args = loads(args)
                 if kwargs:
                     kwargs = loads(kwargs)
+                if hashes:
+                    blobs = yield self.load_blobs(list(hashes.values()))
+                    function = blobs.get(hashes.get('function'), function)
+                    args = blobs.get(hashes.get('args'), args)
+                    kwargs = blobs.get(hashes.get('kwargs'), kwargs)
             except Exception as e:
                 logger.warn("Could not deserialize task", exc_info=True)
                 tb = get_traceback()
                 e2 = truncate_exception(e, 1000)
                 self.active.remove(key)
-                raise Return((b'error', {'exception': e2, 'traceback': tb}))
+                out = {'exception': e2, 'traceback': tb}
+                if other:
+                    out['fetched'] = list(other)
+                raise Return((b'error', out))
 
+        # Fill args with data
         if task is not None:
             assert not function and not args and not kwargs
-            function = execute_task
-            args = (task,)
-
-        # Fill args with data
-        args2 = pack_data(args, data2)
-        kwargs2 = pack_data(kwargs, data2)
+            function = execute_plan
+            args2 = flatten_task(task, data2)
+            kwargs2 = {}
+        else:
+            args2 = pack_data(args, data2)
+            kwargs2 = pack_data(kwargs, data2)
 
-        # Log and compute in separate thread
+        # Compute in separate thread.  The executor's done-callback wakes us.
         try:
             job_counter[0] += 1
             i = job_counter[0]
-            logger.info("Start job %d: %s - %s", i, funcname(function), key)
-            future = self.executor.submit(function, *args2, **kwargs)
-            pc = PeriodicCallback(lambda: logger.debug("future state: %s - %s",
-                key, future._state), 1000)
-            pc.start()
-            try:
-                if sys.version_info < (3, 2):
-                    yield future
-                else:
-                    while not future.done() and future._state != 'FINISHED':
-                        try:
-                            yield gen.with_timeout(timedelta(seconds=1), future)
-                            break
-                        except gen.TimeoutError:
-                            logger.info("work queue size: %d", self.executor._work_queue.qsize())
-                            logger.info("future state: %s", future._state)
-                            logger.info("Pending job %d: %s", i, future)
-            finally:
-                pc.stop()
-            result = future.result()
-            logger.info("Finish job %d: %s - %s", i, funcname(function), key)
+            logger.debug("Start job %d: %s", i, key)
+            if processes or self.processes:
+                payload = dumps((function, args2, kwargs2))
+                result = yield self.process_pool.submit(execute_pickled,
+                                                        payload)
+                result, start, stop = loads(result)
+            else:
+                pool = self.io_executor if io else self.executor
+                result, start, stop = yield pool.submit(
+                        apply_timed, function, args2, kwargs2)
+            logger.debug("Finish job %d: %s", i, key)
             self.data[key] = result
             if report:
                 response = yield self.center.add_keys(address=(self.ip, self.port),
-                                                      keys=[key])
+                                                      keys=[key] + list(other))
                 if not response == b'OK':
                     logger.warn('Could not report results to center: %s',
                                 response.decode())
-            out = (b'OK', {'nbytes': sizeof(result)})
+            out = (b'OK', {'nbytes': sizeof(result),
+                           'compute_start': start, 'compute_stop': stop})
             if result is not None:
                 out[1]['type'] = type(result)
+            if other:
+                out[1]['fetched'] = list(other)
         except Exception as e:
             tb = get_traceback()
             e2 = truncate_exception(e, 1000)
@@ -300,12 +427,141 @@ class Worker(Server):
                 tb = None
 
             out = (b'error', {'exception': e2, 'traceback': tb})
+            if other:
+                out[1]['fetched'] = list(other)
 
         logger.debug("Send compute response to client: %s, %s", key, out)
         with ignoring(KeyError):
             self.active.remove(key)
         raise Return(out)
 
+    @gen.coroutine
+    def load_blobs(self, hashes):
+        """ Deserialized blobs for content hashes
+
+        Blobs not in ``blob_cache`` we ask for over the scheduler's compute
+        stream.  Tasks that need the same missing blob share one request.
+        Every call deserializes new objects, so that a task that modifies
+        its arguments doesn't affect other tasks.
+        """
+        cache = self.blob_cache
+        result = dict()
+        missing = []
+        for h in hashes:
+            if h in cache:
+                result[h] = cache[h] = cache.pop(h)  # most recently used
+            else:
+                missing.append(h)
+        if missing:
+            new = [h for h in missing if h not in self._blob_fetches]
+            if new:
+                if self._blob_stream is None or self._blob_stream.closed():
+                    raise ValueError("No scheduler stream to fetch blobs")
+                for h in new:
+                    self._blob_fetches[h] = Future()
+                self._blob_stream.send({'op': 'get-blobs', 'hashes': new})
+            frames = yield [self._blob_fetches[h] for h in missing]
+            result.update(zip(missing, frames))
+        raise Return({h: loads(b) for h, b in result.items()})
+
+    def receive_blobs(self, hashes=None, blobs=None):
+        """ Cache blobs sent by the scheduler and wake tasks waiting on them
+        """
+        for h in hashes:
+            future = self._blob_fetches.pop(h, None)
+            if h not in blobs:
+                if future is not None:
+                    future.set_exception(KeyError(h))
+                continue
+            b = blobs[h]
+            if h not in self.blob_cache:
+                self.blob_cache[h] = b
+                self.blob_cache_nbytes += len(b)
+            if future is not None:
+                future.set_result(b)
+        while self.blob_cache and self.blob_cache_nbytes > self.blob_cache_bytes:
+            h, b = self.blob_cache.popitem(last=False)
+            self.blob_cache_nbytes -= len(b)
+
+    @gen.coroutine
+    def compute_stream(self, stream, report=True):
+        """ Execute tasks sent over a stream, reporting each as it finishes
+
+        The scheduler keeps one such stream open to every worker.  It sends
+        ``compute-task`` messages, with the same fields as ``compute``, in
+        batches.  Each task runs as soon as it arrives.  Results are sent
+        back in batches as ``task-finished``, ``task-erred`` or
+        ``missing-data`` messages, in the order in which tasks finish.  A
+        ``close`` message ends the stream.
+
+        Tasks that refer to functions or arguments by content hash ask for
+        those they don't have with ``get-blobs`` messages.  The scheduler
+        answers with ``blobs`` messages on the same stream.
+
+        See Also
+        --------
+        Worker.compute
+        distributed.scheduler.Scheduler.worker
+        """
+        bstream = BatchedStream(stream, interval=0, loop=self.loop)
+        self._blob_stream = bstream
+        closed = False
+        while not closed:
+            try:
+                msgs = yield bstream.recv_many()
+            except StreamClosedError:
+                break
+            for msg in msgs:
+                op = msg.pop('op')
+                if op == 'close':
+                    closed = True
+                    break
+                elif op == 'compute-task':
+                    self._compute_and_report(bstream, report, msg)
+                elif op == 'blobs':
+                    self.receive_blobs(**msg)
+                else:
+                    logger.warn("Bad message on compute stream: op=%s, %s",
+                                op, msg)
+        if self._blob_stream is bstream:
+            self._blob_stream = None
+            for h in list(self._blob_fetches):
+                self._blob_fetches.pop(h).set_exception(
+                        StreamClosedError("Lost stream to scheduler"))
+        if not bstream.closed():
+            bstream.send({'op': 'close'})
+            yield bstream.close()
+
+    @gen.coroutine
+    def _compute_and_report(self, bstream, report, msg):
+        key = msg['key']
+        try:
+            response, content = yield self.compute(None, report=report, **msg)
+        except Exception as e:
+            # Nothing else would tell the scheduler, so the task would hang
+            logger.warn("Failed to compute %s", key, exc_info=True)
+            self.active.discard(key)
+            tb = get_traceback()
+            try:
+                assert len(dumps(tb)) < 1e6
+            except:
+                tb = None
+            response, content = b'error', {
+                    'exception': truncate_exception(e, 1000), 'traceback': tb}
+        if response == b'OK':
+            if 'type' in content:
+                content['type'] = dumps_type(content['type'])
+            bstream.send(merge(content, {'op': 'task-finished', 'key': key}))
+        elif response == b'error':
+            bstream.send(merge(content, {'op': 'task-erred', 'key': key}))
+        else:
+            # Dependencies that did arrive stay here as replicas
+            out = {'op': 'missing-data', 'key': key, 'missing': content.args}
+            fetched = [k for k in msg.get('who_has') or () if k in self.data]
+            if fetched:
+                out['fetched'] = fetched
+            bstream.send(out)
+
     @gen.coroutine
     def update_data(self, stream, data=None, report=True):
         self.data.update(data)
@@ -331,6 +587,93 @@ class Worker(Server):
     def get_data(self, stream, keys=None):
         return {k: self.data[k] for k in keys if k in self.data}
 
+    @gen.coroutine
+    def gather_dependencies(self, who_has):
+        """ Fetch keys from peers, sharing transfers with concurrent calls
+
+        Keys already being fetched for another task wait on that transfer.
+        Other keys requested during the same iteration of the event loop are
+        fetched together, with one ``get_data`` call per peer.  Fetched values
+        are kept in ``data``.  Raises ``KeyError`` with the keys that no peer
+        had or that we could not get from any peer.
+
+        See Also
+        --------
+        distributed.client.gather_from_workers
+        """
+        futures = dict()
+        shared = set()
+        for k, workers in who_has.items():
+            if k in self.in_flight:
+                shared.add(k)
+                futures[k] = self.in_flight[k]
+            else:
+                futures[k] = self.in_flight[k] = Future()
+                self._fetch_queue[k] = workers
+        self.transfer_stats['fetch-requests'] += 1
+        if self._fetch_queue and not self._fetch_scheduled:
+            self._fetch_scheduled = True
+            self.loop.add_callback(self._fetch)
+
+        results = dict()
+        missing = []
+        for k, future in futures.items():
+            try:
+                results[k] = yield future
+            except KeyError:
+                missing.append(k)
+            else:
+                if k in shared:
+                    self.transfer_stats['keys-deduplicated'] += 1
+                    self.transfer_stats['bytes-deduplicated'] += \
+                            sizeof(results[k])
+        if missing:
+            raise KeyError(*missing)
+        raise Return(results)
+
+    @gen.coroutine
+    def _fetch(self):
+        """ Fetch all queued keys in one call to ``gather_from_workers`` """
+        who_has, self._fetch_queue = self._fetch_queue, dict()
+        self._fetch_scheduled = False
+        logger.debug("gather %d keys from peers: %s", len(who_has), who_has)
+        self.transfer_stats['fetches'] += 1
+        try:
+            data, missing = yield gather_from_workers(who_has,
+                    permissive=True, unix_paths=self.unix_paths)
+        except Exception as e:
+            # Treat a failed transfer like peers that don't have the data
+            logger.warn("Could not gather %d keys from peers", len(who_has),
+                        exc_info=True)
+            for k in who_has:
+                self.in_flight.pop(k).set_exception(KeyError(k))
+            return
+        self.data.update(data)
+        for k in who_has:
+            future = self.in_flight.pop(k)
+            if k in data:
+                self.transfer_stats['keys-fetched'] += 1
+                self.transfer_stats['bytes-fetched'] += sizeof(data[k])
+                future.set_result(data[k])
+            else:
+                future.set_exception(KeyError(k))
+
+    def get_metrics(self, stream=None):
+        """ Server metrics, with transfer and spill counters """
+        result = super(Worker, self).get_metrics(stream)
+        result['transfers'] = self.transfer_stats.copy()
+        if isinstance(self.data, SpillBuffer):
+            d = self.data
+            result['spill'] = merge(d.stats, {
+                'memory': d.memory,
+                'memory-limit': d.memory_limit,
+                'compressed-memory': d.compressed_memory,
+                'compressed-limit': d.compressed_limit,
+                'keys-in-memory': len(d.fast),
+                'keys-compressed': len(d.compressed),
+                'keys-on-disk': len(d.slow)})
+        return result
+
     def upload_file(self, stream, filename=None, data=None, load=True):
         out_filename = os.path.join(self.local_dir, filename)
         with open(out_filename, 'wb') as f:
@@ -361,6 +704,47 @@ class Worker(Server):
 job_counter = [0]
 
 
+_type_cache = dict()
+
+
+def dumps_type(typ):
+    """ Pickle the type of a result, caching types already seen
+
+    Reports of finished tasks carry the type as bytes so that they stay
+    plain enough to send with msgpack.
+    """
+    try:
+        return _type_cache[typ]
+    except KeyError:
+        b = _type_cache[typ] = dumps(typ)
+        return b
+    except TypeError:  # unhashable
+        return dumps(typ)
+
+
+def apply_timed(function, args, kwargs):
+    """ Call function, returning its result and start and stop times
+
+    >>> apply_timed(max, (1, 2), {})  # doctest: +SKIP
+    (2, 1467040000.0, 1467040000.1)
+    """
+    start = time()
+    result = function(*args, **kwargs)
+    return result, start, time()
+
+
+def execute_pickled(payload):
+    """ Run a pickled function application, pickling the result
+
+    This runs in the processes of ``Worker.process_pool``.  We pickle with
+    cloudpickle on both ends so that lambdas and interactively defined
+    functions work as they do in threads.  The result comes back with its
+    start and stop times, as from ``apply_timed``.
+    """
+    function, args, kwargs = loads(payload)
+    return dumps(apply_timed(function, args, kwargs))
+
+
 def execute_task(task):
     """ Evaluate a nested task
 
@@ -377,3 +761,118 @@ def execute_task(task):
         return list(map(execute_task, task))
     else:
         return task
+
+
+CALL, LIST = 1, 2
+_plans = dict()
+MAX_PLANS = 10000
+MAX_PLAN_DEPTH = 50
+
+
+def flatten_task(task, data):
+    """ Split a nested task into its shape and a flat list of values
+
+    The shape is ``0`` for a value, ``(CALL, *args)`` for a task and
+    ``(LIST, *items)`` for a list that holds tasks.  It records only the
+    nesting, not the functions or values, so that tasks of the same form
+    share one compiled plan in ``execute_plan``.  Values are listed in the
+    order in which the shape visits them, with keys in ``data`` replaced by
+    their values as in ``pack_data``.
+
+    >>> inc = lambda x: x + 1
+    >>> shape, values = flatten_task((sum, [1, 'x', (inc, 3)]), {'x': 10})
+    >>> shape
+    (1, (2, 0, 0, (1, 0)))
+    >>> values == [sum, 1, 10, inc, 3]
+    True
+    """
+    values = []
+    shape = _flatten(task, data, values)
+    return shape, values
+
+
+def _flatten(task, data, values):
+    if type(task) is tuple and task and callable(task[0]):
+        values.append(task[0])
+        return (CALL,) + tuple([_flatten(a, data, values) for a in task[1:]])
+    if type(task) is list:
+        if any(type(t) is list or istask(t) for t in task):
+            return (LIST,) + tuple([_flatten(t, data, values) for t in task])
+        values.append([_fill(t, data) for t in task])
+        return 0
+    values.append(_fill(task, data))
+    return 0
+
+
+def _fill(o, data):
+    try:
+        if o in data:
+            return data[o]
+    except TypeError:
+        pass
+    if isinstance(o, (tuple, set, frozenset, dict)):
+        return pack_data(o, data)
+    return o
+
+
+def execute_plan(shape, values):
+    """ Evaluate a task given by ``flatten_task``
+
+    The first task of each shape compiles it into a function that makes all
+    of its calls in one expression.  Later tasks of that shape reuse it, so
+    we don't walk nested tuples for every task.
+
+    >>> inc = lambda x: x + 1
+    >>> execute_plan(*flatten_task((sum, [1, 'x', (inc, 3)]), {'x': 10}))
+    15
+    """
+    if shape == 0:
+        return values[0]
+    try:
+        plan = _plans[shape]
+    except KeyError:
+        plan = compile_plan(shape)
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        _plans[shape] = plan
+    return plan(values)
+
+
+def compile_plan(shape):
+    """ Compile a task shape into a function of its flat list of values
+
+    >>> plan = compile_plan((CALL, 0, (CALL, 0)))  # v[0](v[1], v[2](v[3]))
+    >>> plan([max, 0, len, 'abc'])
+    3
+
+    Shapes too deep or too large for Python to compile fall back to an
+    interpreter.
+    """
+    try:
+        source = _source(shape, [0], MAX_PLAN_DEPTH)
+        return eval('lambda v: ' + source, {})
+    except (SyntaxError, RuntimeError, MemoryError, ValueError):
+        return lambda values: _interpret(shape, iter(values))
+
+
+def _source(shape, counter, depth):
+    if shape == 0:
+        counter[0] += 1
+        return 'v[%d]' % (counter[0] - 1)
+    if not depth:
+        raise ValueError("Task too deeply nested to compile")
+    if shape[0] == CALL:
+        func = _source(0, counter, depth)
+        args = [_source(s, counter, depth - 1) for s in shape[1:]]
+        return '%s(%s)' % (func, ', '.join(args))
+    items = [_source(s, counter, depth - 1) for s in shape[1:]]
+    return '[%s]' % ', '.join(items)
+
+
+def _interpret(shape, values):
+    if shape == 0:
+        return next(values)
+    if shape[0] == CALL:
+        func = next(values)
+        return func(*[_interpret(s, values) for s in shape[1:]])
+    return [_interpret(s, values) for s in shape[1:]]